@@ -0,0 +1,219 @@
+import psycopg
+
+DAILY_SALES_COLUMNS = ("day", "orders", "items", "revenue")
+TOP_PRODUCT_COLUMNS = ("product_id", "name", "orders", "units", "revenue")
+COURIER_THROUGHPUT_COLUMNS = ("courier_id", "name", "assigned", "collected", "abandoned")
+CUSTOMER_LTV_COLUMNS = ("customer_email", "customer_name", "orders", "revenue", "average_order", "first_order_at", "last_order_at")
+
+REPORT_DAYS = 30
+REPORT_LIMIT = 10
+
+ANALYTICS_TABLES = ("daily_sales", "product_daily_sales", "courier_daily_stats", "customer_ltv")
+
+# The triggers add each transaction's counts to one of this many rows per day
+# (per product, per courier), picked by backend, so concurrent tills update
+# different rows instead of queueing on today's. The reports add the slots up.
+ANALYTICS_SLOTS = 16
+
+# Recomputes every summary table from orders and order_items, or the views over
+# them and their archived months, as chosen by rebuild_analytics. Orders that
+# predate orders.created_at are dated by the migration that added it, and the day
+# an order was closed is taken from updated_at, as that is the last time it changed.
+REBUILD_STATEMENTS = [
+    "TRUNCATE " + ", ".join(ANALYTICS_TABLES),
+    """INSERT INTO daily_sales (day, orders, items, revenue)
+       SELECT o.created_at::date, COUNT(*), COALESCE(SUM(line.items), 0), COALESCE(SUM(line.revenue), 0)
+       FROM {orders} o
+       LEFT JOIN (SELECT order_id, SUM(qty) AS items, SUM(qty * unit_price) AS revenue FROM {order_items} GROUP BY order_id) line
+              ON line.order_id = o.id
+       GROUP BY 1""",
+    """INSERT INTO product_daily_sales (day, product_id, orders, units, revenue)
+       SELECT o.created_at::date, i.product_id, COUNT(*), SUM(i.qty), SUM(i.qty * i.unit_price)
+       FROM {order_items} i JOIN {orders} o ON o.id = i.order_id
+       GROUP BY 1, 2""",
+    """INSERT INTO courier_daily_stats (day, courier_id, assigned, collected, abandoned)
+       SELECT day, courier_id, SUM(assigned), SUM(collected), SUM(abandoned)
+       FROM (SELECT created_at::date AS day, courier_id, 1 AS assigned, 0 AS collected, 0 AS abandoned
+             FROM {orders} WHERE courier_id IS NOT NULL
+             UNION ALL
+             SELECT updated_at::date, courier_id, 0, (status = 'collected')::int, (status = 'abandoned')::int
+             FROM {orders} WHERE courier_id IS NOT NULL AND status IN ('collected', 'abandoned')) events
+       GROUP BY day, courier_id""",
+    """INSERT INTO customer_ltv (customer_email, orders, revenue, first_order_at, last_order_at)
+       SELECT lower(o.customer_email), COUNT(*), COALESCE(SUM(line.revenue), 0), MIN(o.created_at), MAX(o.created_at)
+       FROM {orders} o
+       LEFT JOIN (SELECT order_id, SUM(qty * unit_price) AS revenue FROM {order_items} GROUP BY order_id) line
+              ON line.order_id = o.id
+       WHERE o.customer_email IS NOT NULL
+       GROUP BY 1""",
+]
+
+def rebuild_analytics(conn: psycopg.Connection, orders: str = "order_history", order_items: str = "order_item_history"):
+    """
+    Recompute every analytics summary table from the orders in the database.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        orders (str): The table or view to read orders from. The default view
+            covers both the live and the archived orders.
+        order_items (str): The table or view to read order items from.
+
+    The summary tables are kept up to date by triggers as orders are written, so
+    this is only needed to fill them the first time or to repair them, for
+    example after orders were deleted. It runs in one transaction: TRUNCATE locks
+    the summary tables, so orders placed meanwhile wait for the rebuild and are
+    then counted once on top of it.
+    """
+    try:
+        with conn.cursor() as cursor:
+            for statement in REBUILD_STATEMENTS:
+                cursor.execute(statement.format(orders=orders, order_items=order_items))
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+def daily_sales(conn: psycopg.Connection, days: int = REPORT_DAYS):
+    """
+    Retrieve the orders, items sold and revenue of each of the last few days.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        days (int): How many days back to report, including today.
+
+    Adds up the precomputed daily_sales slot rows of each day with orders.
+    Revenue counts every order when it is placed, whatever its status is now.
+    Returns a list of rows, newest day first, with the fields named in
+    DAILY_SALES_COLUMNS.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """SELECT day, SUM(orders), SUM(items), SUM(revenue)
+               FROM daily_sales WHERE day > current_date - %s
+               GROUP BY day
+               ORDER BY day DESC""",
+            (days,)
+        )
+        return cursor.fetchall()
+
+def top_products(conn: psycopg.Connection, days: int = REPORT_DAYS, limit: int = REPORT_LIMIT):
+    """
+    Retrieve the best selling products of the last few days by revenue.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        days (int): How many days back to report, including today.
+        limit (int): The number of products to return.
+
+    Adds up at most ANALYTICS_SLOTS product_daily_sales rows per product per
+    day. Products that have since been deleted are still listed, without a name.
+    Returns a list of rows with the fields named in TOP_PRODUCT_COLUMNS.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """SELECT s.product_id, p.name, SUM(s.orders), SUM(s.units), SUM(s.revenue)
+               FROM product_daily_sales s LEFT JOIN products p ON p.id = s.product_id
+               WHERE s.day > current_date - %s
+               GROUP BY s.product_id, p.name
+               ORDER BY 5 DESC, 4 DESC
+               LIMIT %s""",
+            (days, limit)
+        )
+        return cursor.fetchall()
+
+def courier_throughput(conn: psycopg.Connection, days: int = REPORT_DAYS):
+    """
+    Retrieve how many orders each courier was given, delivered and abandoned over the last few days.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        days (int): How many days back to report, including today.
+
+    Orders are counted as assigned on the day they were placed and as collected
+    or abandoned on the day they were closed. Returns a list of rows, busiest
+    courier first, with the fields named in COURIER_THROUGHPUT_COLUMNS.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """SELECT s.courier_id, c.name, SUM(s.assigned), SUM(s.collected), SUM(s.abandoned)
+               FROM courier_daily_stats s LEFT JOIN couriers c ON c.id = s.courier_id
+               WHERE s.day > current_date - %s
+               GROUP BY s.courier_id, c.name
+               ORDER BY 4 DESC, 3 DESC""",
+            (days,)
+        )
+        return cursor.fetchall()
+
+def customer_ltv(conn: psycopg.Connection, limit: int = REPORT_LIMIT):
+    """
+    Retrieve the customers with the highest lifetime value.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        limit (int): The number of customers to return.
+
+    Reads the top of the customer_ltv table through its revenue index, so the
+    cost does not grow with the number of customers or orders. Customers are
+    matched to orders by email. Returns a list of rows with the fields named in
+    CUSTOMER_LTV_COLUMNS.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """SELECT l.customer_email, c.customer_name, l.orders, l.revenue,
+                      round(l.revenue / NULLIF(l.orders, 0), 2), l.first_order_at, l.last_order_at
+               FROM customer_ltv l LEFT JOIN customers c ON lower(c.customer_email) = l.customer_email
+               ORDER BY l.revenue DESC
+               LIMIT %s""",
+            (limit,)
+        )
+        return cursor.fetchall()
+
+def prompt_days():
+    """Ask how many days to report on, defaulting to REPORT_DAYS."""
+    days = input(f"Number of days to report on (default {REPORT_DAYS}): ").strip()
+    return int(days) if days else REPORT_DAYS
+
+def view_daily_sales(conn: psycopg.Connection):
+    """Ask for a number of days and display the sales of each day."""
+    rows = daily_sales(conn, prompt_days())
+    print(f"\n{'Day':<15}{'Orders':<10}{'Items':<10}{'Revenue':<10}\n{'-'*45}")
+    for x in rows:
+        print(f"{x[0]!s:<15}{x[1]:<10}{x[2]:<10}£{x[3]:<10}")
+    print()
+
+def view_top_products(conn: psycopg.Connection):
+    """Ask for a number of days and display the best selling products."""
+    rows = top_products(conn, prompt_days())
+    print(f"\n{'ID':<5}{'Name':<25}{'Orders':<10}{'Units':<10}{'Revenue':<10}\n{'-'*60}")
+    for x in rows:
+        print(f"{x[0]:<5}{x[1] or '(deleted)':<25}{x[2]:<10}{x[3]:<10}£{x[4]:<10}")
+    print()
+
+def view_courier_throughput(conn: psycopg.Connection):
+    """Ask for a number of days and display the orders handled by each courier."""
+    rows = courier_throughput(conn, prompt_days())
+    print(f"\n{'ID':<5}{'Courier':<20}{'Assigned':<10}{'Collected':<11}{'Abandoned':<10}\n{'-'*56}")
+    for x in rows:
+        print(f"{x[0]:<5}{x[1] or '(deleted)':<20}{x[2]:<10}{x[3]:<11}{x[4]:<10}")
+    print()
+
+def view_customer_ltv(conn: psycopg.Connection):
+    """Display the customers with the highest lifetime value."""
+    rows = customer_ltv(conn)
+    print(f"\n{'Email':<30}{'Name':<20}{'Orders':<8}{'Revenue':<11}{'Average':<10}{'Last order':<12}\n{'-'*91}")
+    for x in rows:
+        print(f"{x[0]:<30}{x[1] or '':<20}{x[2]:<8}£{x[3]:<10}£{x[4]:<9}{x[6]:%Y-%m-%d}")
+    print()
+
+def prompt_rebuild_analytics(conn: psycopg.Connection):
+    """Recompute the analytics summary tables from the order history."""
+    rebuild_analytics(conn)
+    print("\nAnalytics rebuilt!\n")
+
+ANALYTICS_COMMANDS = [
+    ("Daily sales", view_daily_sales),
+    ("Top products", view_top_products),
+    ("Courier throughput", view_courier_throughput),
+    ("Customer lifetime value", view_customer_ltv),
+    ("Rebuild analytics from order history", prompt_rebuild_analytics),
+]
@@ -0,0 +1,254 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import psycopg
+from psycopg import sql
+from connection import connect
+from database import OPEN_STATUSES
+from export import copy_to_csv
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+PARTITION_MONTHS_AHEAD = 3
+ARCHIVE_INTERVAL = 3600
+
+def month_start(moment: datetime):
+    """Return the start of the month a moment falls in, in UTC."""
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+def next_month(month: datetime):
+    """Return the start of the month after `month`."""
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+def partition_name(month: datetime):
+    """Return the name of the orders partition for a month, e.g. orders_p202501."""
+    return f"orders_p{month:%Y%m}"
+
+def create_partition(cursor: psycopg.Cursor, month: datetime):
+    """
+    Create the partition of orders for one calendar month (UTC), if it does not exist yet.
+
+    Args:
+        cursor (psycopg.Cursor): A cursor on the connection to create it with.
+        month (datetime): The start of the month.
+
+    Orders already in the default partition for that month, e.g. ones replayed
+    with an old created_at, are moved into the new partition in the same
+    transaction, since PostgreSQL refuses to add a range the default partition
+    holds rows for. They are moved partition to partition, so the statement
+    triggers on orders do not count them a second time. The default partition
+    is locked first, so no order can land in it between the move and the
+    CREATE. Returns True if the partition was created.
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0] is not None:
+        return False
+
+    lower, upper = sql.Literal(month), sql.Literal(next_month(month))
+    cursor.execute("LOCK TABLE orders_default IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(
+        sql.SQL("CREATE TEMP TABLE stray_orders ON COMMIT DROP AS SELECT * FROM orders_default WHERE created_at >= {} AND created_at < {}").format(lower, upper)
+    )
+    cursor.execute(sql.SQL("DELETE FROM orders_default WHERE created_at >= {} AND created_at < {}").format(lower, upper))
+    cursor.execute(
+        sql.SQL("CREATE TABLE {} PARTITION OF orders FOR VALUES FROM ({}) TO ({})").format(sql.Identifier(name), lower, upper)
+    )
+    cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM stray_orders").format(sql.Identifier(name)))
+    cursor.execute("DROP TABLE stray_orders")
+    return True
+
+def ensure_partitions(conn: psycopg.Connection, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """
+    Create the orders partitions for this month and the next few.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        months_ahead (int): How many months after this one to create.
+
+    Run by the archiver on every pass, so new orders always land in their own
+    month's partition rather than the default one. Returns the number of
+    partitions created.
+    """
+    month = month_start(datetime.now(timezone.utc))
+    created = 0
+    try:
+        with conn.cursor() as cursor:
+            for _ in range(months_ahead + 1):
+                created += create_partition(cursor, month)
+                month = next_month(month)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return created
+
+def order_partitions(conn: psycopg.Connection, schema: str = "public"):
+    """
+    List the monthly partitions of an orders table.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        schema (str): "public" for the live orders, or "archive" for the archived ones.
+
+    Partitions are named after their month, so the bounds are read from the
+    name. Returns a list of (name, lower, upper) rows, oldest first. The
+    default partition is not included.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """SELECT c.relname
+               FROM pg_inherits i
+               JOIN pg_class c ON c.oid = i.inhrelid
+               JOIN pg_class p ON p.oid = i.inhparent
+               JOIN pg_namespace n ON n.oid = p.relnamespace
+               WHERE p.relname = 'orders' AND n.nspname = %s AND c.relname LIKE 'orders\\_p%%'
+               ORDER BY c.relname""",
+            (schema,)
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for (name,) in rows:
+        month = datetime.strptime(name[len("orders_p"):], "%Y%m").replace(tzinfo=timezone.utc)
+        partitions.append((name, month, next_month(month)))
+    return partitions
+
+def archive_orders(conn: psycopg.Connection, days: int = ARCHIVE_AFTER_DAYS):
+    """
+    Move months of closed orders out of the live orders table into the archive schema.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        days (int): Only months that ended more than this many days ago are archived.
+
+    Each old month's partition is detached from orders and attached to
+    archive.orders, and its order_items rows move to archive.order_items, in
+    one transaction per month. Apart from one scan to check the month's rows
+    against the archive's bounds, the orders themselves are not rewritten. The
+    live tables then hold only recent months, so lookups of open orders probe a
+    few small partitions whatever the size of the history. Months that still
+    hold a preparing or ready order are left in place and reported. The live
+    orders table is locked for the whole move, before the month's partition:
+    a statement through orders, such as update_orders_status, locks orders
+    and then every partition, so locking them the other way round would
+    deadlock with it. Tills wait for the move rather than fail. The order_history and order_item_history views read both,
+    for reports over the whole history.
+
+    Returns a (archived, skipped) tuple of partition names.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    archived, skipped = [], []
+
+    for name, lower, upper in order_partitions(conn):
+        if upper > cutoff:
+            continue
+        partition = sql.Identifier(name)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("LOCK TABLE ONLY orders IN ACCESS EXCLUSIVE MODE")
+                cursor.execute(sql.SQL("LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE").format(partition))
+                cursor.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE status = ANY(%s))").format(partition), (list(OPEN_STATUSES),))
+                if cursor.fetchone()[0]:
+                    conn.rollback()
+                    skipped.append(name)
+                    continue
+
+                cursor.execute(sql.SQL(
+                    """WITH moved AS (
+                           DELETE FROM order_items WHERE order_id IN (SELECT id FROM {}) RETURNING *
+                       )
+                       INSERT INTO archive.order_items SELECT * FROM moved"""
+                ).format(partition))
+                cursor.execute(sql.SQL("ALTER TABLE orders DETACH PARTITION {}").format(partition))
+                cursor.execute(sql.SQL("ALTER TABLE {} SET SCHEMA archive").format(partition))
+                cursor.execute(sql.SQL("ALTER TABLE archive.orders ATTACH PARTITION archive.{} FOR VALUES FROM ({}) TO ({})").format(
+                    partition, sql.Literal(lower), sql.Literal(upper)
+                ))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        archived.append(name)
+
+    return archived, skipped
+
+def export_archive(conn: psycopg.Connection, directory: str, days: int = ARCHIVE_AFTER_DAYS):
+    """
+    Write archived months to compressed CSV files and drop them from the database.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        directory (str): The folder to write the files to.
+        days (int): Only archived months that ended more than this many days ago
+            are exported.
+
+    Each month becomes two gzip files, <partition>.csv.gz with its orders and
+    <partition>_items.csv.gz with their order_items, streamed with COPY. The
+    rows are only deleted once both files are written. Exported orders no
+    longer appear in order_history, so rebuilt analytics will not count them.
+    Returns the names of the exported partitions.
+    """
+    os.makedirs(directory, exist_ok=True)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    exported = []
+
+    for name, lower, upper in order_partitions(conn, "archive"):
+        if upper > cutoff:
+            continue
+        partition = sql.SQL("archive.{}").format(sql.Identifier(name))
+        try:
+            with conn.cursor() as cursor:
+                copy_to_csv(cursor, sql.SQL("SELECT * FROM {} ORDER BY id").format(partition), (), os.path.join(directory, f"{name}.csv.gz"))
+                items = sql.SQL("SELECT * FROM archive.order_items WHERE order_id IN (SELECT id FROM {}) ORDER BY order_id, product_id").format(partition)
+                copy_to_csv(cursor, items, (), os.path.join(directory, f"{name}_items.csv.gz"))
+                cursor.execute(sql.SQL("DELETE FROM archive.order_items WHERE order_id IN (SELECT id FROM {})").format(partition))
+                cursor.execute(sql.SQL("DROP TABLE {}").format(partition))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        exported.append(name)
+
+    return exported
+
+def run_archiver(days: int = ARCHIVE_AFTER_DAYS, export_days: int = None, directory: str = "archive", interval: int = ARCHIVE_INTERVAL):
+    """
+    Keep the orders partitions ahead of time and archive old months, until interrupted.
+
+    Args:
+        days (int): Archive months of orders that ended more than this many days ago.
+        export_days (int): If given, also export archived months that ended
+            more than this many days ago to compressed files and drop them.
+        directory (str): The folder for exported files.
+        interval (int): Seconds between passes.
+    """
+    while True:
+        conn = connect()
+        try:
+            created = ensure_partitions(conn)
+            archived, skipped = archive_orders(conn, days)
+            exported = export_archive(conn, directory, export_days) if export_days is not None else []
+        finally:
+            conn.close()
+
+        print(f"Created {created} partition(s), archived {', '.join(archived) or 'nothing'}, exported {', '.join(exported) or 'nothing'}")
+        if skipped:
+            print(f"Not archived, still holding open orders: {', '.join(skipped)}")
+        if interval <= 0:
+            return
+        time.sleep(interval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Partition maintenance and archiving of closed orders")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive months that ended more than this many days ago")
+    parser.add_argument("--export-days", type=int, help="also export archived months older than this to compressed files and drop them")
+    parser.add_argument("--directory", default="archive", help="where exported files are written")
+    parser.add_argument("--interval", type=int, default=0, help="seconds between passes; 0 runs once")
+    args = parser.parse_args()
+
+    try:
+        run_archiver(args.days, args.export_days, args.directory, args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,237 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+from balancer import balancer, LOAD_QUERY
+from customers import customer_cache, normalize_email, ADD_ITEMS_SPEND, ADD_SPEND
+from database import OPEN_STATUSES
+from orders import (check_order_lines, order_params, DEDUCT_STOCK, CONSUME_RESERVATION, INSERT_ORDER, INSERT_LEGACY_ORDER,
+                    ADD_ORDER_SPEND, FIND_CUSTOMER, INSERT_CUSTOMER)
+from queries import registry
+
+# The statements are the ones orders.py registers, so both workflows place
+# orders the same way and are timed under the same names.
+
+def item_counts(items: list):
+    """Return the distinct item names of an order and how many of each were ordered, as two lists."""
+    counts = Counter(item.title() for item in items)
+    names = list(counts)
+    return names, [counts[name] for name in names]
+
+async def create_order(aconn: psycopg.AsyncConnection, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, courier: str, items: list, created_at: datetime = None):
+    """
+    Create a new order and its order_items rows in one statement.
+
+    Args:
+        aconn (psycopg.AsyncConnection): An asynchronous connection to the PostgreSQL database.
+        customer_name (str): The name of the customer.
+        customer_address (str): The address of the customer.
+        customer_phone (str): The phone number of the customer.
+        customer_email (str): The email of the customer.
+        courier (str): The name of the courier assigned to the order.
+        items (list): The list of item names ordered.
+        created_at (datetime): When the order was placed, if not now.
+
+    The asyncio counterpart of orders.create_order, running the same
+    statement. Does not commit, so it can be combined with the other steps in
+    one transaction.
+    """
+    names, qtys = item_counts(items)
+    await registry.aexecute(
+        aconn.cursor(), INSERT_LEGACY_ORDER,
+        (customer_name.title(), customer_address.lower(), customer_phone, normalize_email(customer_email), courier, courier, "preparing", items, created_at, names, qtys)
+    )
+
+async def deduct_stock(aconn: psycopg.AsyncConnection, items: list):
+    """
+    Take the stock of an order off the products in one statement.
+
+    Args:
+        aconn (psycopg.AsyncConnection): An asynchronous connection to the PostgreSQL database.
+        items (list): The list of item names ordered. A name may appear more than once.
+
+    The asyncio counterpart of orders.deduct_stock. Only products with enough
+    stock left are changed. Does not commit. Raises ValueError if any item is
+    missing or short of stock, in which case the caller should roll back.
+    Returns the (name, price, qty, id) rows that were changed.
+    """
+    names, qtys = item_counts(items)
+    cursor = await registry.aexecute(aconn.cursor(), DEDUCT_STOCK, (names, qtys))
+    return check_order_lines(Counter(dict(zip(names, qtys))), await cursor.fetchall())
+
+async def update_spend(aconn: psycopg.AsyncConnection, id: int, items: list):
+    """
+    Add the price of an order's items to a customer's total spend.
+
+    Args:
+        aconn (psycopg.AsyncConnection): An asynchronous connection to the PostgreSQL database.
+        id (int): The ID of the customer.
+        items (list of str): The item names ordered.
+
+    The asyncio counterpart of customers.update_spend, with the total worked out
+    by the same statement that adds it. Does not commit.
+    """
+    names, qtys = item_counts(items)
+    await registry.aexecute(aconn.cursor(), ADD_ITEMS_SPEND, (names, qtys, id))
+
+async def get_customer_id(aconn: psycopg.AsyncConnection, name: str, phone: str, email: str):
+    """
+    Return the ID of the customer with an email, adding them if they are new.
+
+    Args:
+        aconn (psycopg.AsyncConnection): An asynchronous connection to the PostgreSQL database.
+        name (str): The name of the customer.
+        phone (str): The phone number of the customer.
+        email (str): The email of the customer.
+
+    The asyncio counterpart of orders.get_customer_id, sharing its customer_cache.
+    An existing customer's row is never rewritten, and the ID is only cached
+    once the lookup has committed.
+    """
+    email = normalize_email(email)
+    id = customer_cache.get(email)
+    if id is not None:
+        return id
+
+    async with aconn.transaction():
+        cursor = aconn.cursor()
+        row = await (await registry.aexecute(cursor, FIND_CUSTOMER, (email,))).fetchone()
+        if row is None:
+            row = await (await registry.aexecute(cursor, INSERT_CUSTOMER, (name, email, phone, 0))).fetchone()
+        if row is None:
+            row = await (await registry.aexecute(cursor, FIND_CUSTOMER, (email,))).fetchone()
+
+    customer_cache.put(email, row[0])
+    return row[0]
+
+async def courier_with_lowest_orders(aconn: psycopg.AsyncConnection):
+    """
+    Pick the courier with the fewest open orders and count a new order against them.
+
+    Args:
+        aconn (psycopg.AsyncConnection): An asynchronous connection to the PostgreSQL database,
+            used only when the workload heap has not been loaded yet.
+
+    Uses the same in-memory heap as the synchronous orders, loading it without
+    blocking the event loop. If the heap is not loaded, or is invalidated by
+    another thread meanwhile, the rows are fetched here and handed to
+    balancer.assign_rows, which loads and picks in one step. Returns a
+    (courier_id, courier_name) tuple, or raises ValueError if there are no
+    couriers.
+    """
+    rows = None
+    while True:
+        picked = balancer.assign_rows(rows)
+        if picked is not None:
+            return picked
+        cursor = await registry.aexecute(aconn.cursor(), LOAD_QUERY, (list(OPEN_STATUSES),))
+        rows = await cursor.fetchall()
+
+async def add_order_spend(cursor: psycopg.AsyncCursor, name: str, email: str, phone: str, total):
+    """The asyncio counterpart of orders.add_order_spend. The caller commits and fills customer_cache. Returns the customer ID."""
+    id = customer_cache.get(email)
+    if id is not None:
+        await registry.aexecute(cursor, ADD_SPEND, (total, id))
+        if cursor.rowcount:
+            return id
+        customer_cache.invalidate(id)
+
+    await registry.aexecute(cursor, ADD_ORDER_SPEND, (name, email, phone, total))
+    return (await cursor.fetchone())[0]
+
+async def place_order(aconn: psycopg.AsyncConnection, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, courier_id: int, items: list, reservation: str = None, created_at: datetime = None):
+    """
+    Create an order, deduct its stock and update the customer's spend in one transaction.
+
+    Args:
+        aconn (psycopg.AsyncConnection): An asynchronous connection to the PostgreSQL database.
+        customer_name (str): The name of the customer.
+        customer_address (str): The address of the customer.
+        customer_phone (str): The phone number of the customer.
+        customer_email (str): The email of the customer.
+        courier_id (int): The ID of the courier assigned to the order.
+        items (list): The list of item names ordered. A name may appear more than once.
+        reservation (str): A stock reservation made with stock.reserve for exactly
+            these items, used instead of taking the stock from the products now.
+        created_at (datetime): When the order was placed, if not now.
+
+    The asyncio counterpart of orders.place_order: the same registered
+    statements in the same order, so the stock, order and spend are written
+    exactly as on a till, while other tasks on the event loop carry on during
+    each round-trip. If any item is short of stock, or the reservation does
+    not match, the transaction is rolled back and ValueError is raised.
+    Returns a (order_id, customer_id, total) tuple.
+    """
+    counts = Counter(item.title() for item in items)
+    names = list(counts)
+    email = normalize_email(customer_email)
+
+    async with aconn.transaction():
+        cursor = aconn.cursor()
+        if reservation is None:
+            await registry.aexecute(cursor, DEDUCT_STOCK, (names, [counts[name] for name in names]))
+        else:
+            await registry.aexecute(cursor, CONSUME_RESERVATION, (reservation,))
+        rows = check_order_lines(counts, await cursor.fetchall(), reservation)
+        total = sum(row[1] * row[2] for row in rows)
+
+        await registry.aexecute(cursor, INSERT_ORDER, order_params(customer_name, customer_address, customer_phone, email, courier_id, items, created_at, rows))
+        order_id = (await cursor.fetchone())[0]
+        customer_id = await add_order_spend(cursor, customer_name, email, customer_phone, total)
+
+    customer_cache.put(email, customer_id)
+    return order_id, customer_id, total
+
+async def take_order(pool: AsyncConnectionPool, order: dict):
+    """
+    Assign a courier and place one order on a connection borrowed from the pool.
+
+    Args:
+        pool (AsyncConnectionPool): The pool to borrow a connection from.
+        order (dict): The order, with name, address, phone, email and items keys,
+            items being a list of item names.
+
+    The courier is freed up again if the order cannot be placed. Returns the
+    (order_id, customer_id, total) tuple from place_order.
+    """
+    async with pool.connection() as aconn:
+        courier_id, courier = await courier_with_lowest_orders(aconn)
+        try:
+            return await place_order(aconn, order["name"], order["address"], order["phone"], order["email"], courier_id, order["items"])
+        except Exception:
+            balancer.release(courier_id)
+            raise
+
+async def take_orders(pool: AsyncConnectionPool, stream):
+    """
+    Place every order from an order stream, one after another.
+
+    Args:
+        pool (AsyncConnectionPool): The pool to borrow connections from.
+        stream: An iterable or async iterable of order dicts, as taken by take_order.
+
+    Each till or online channel runs its own take_orders task, and any number of
+    them can share one event loop and pool: while one waits on the database the
+    others carry on. An order that fails does not stop the stream. Returns a list
+    with the result of each order, or the exception it raised.
+    """
+    results = []
+
+    async def take(order):
+        try:
+            results.append(await take_order(pool, order))
+        except (ValueError, psycopg.Error) as e:
+            results.append(e)
+
+    if hasattr(stream, "__aiter__"):
+        async for order in stream:
+            await take(order)
+    else:
+        for order in stream:
+            await take(order)
+    return results
+
+async def take_concurrent_orders(pool: AsyncConnectionPool, streams: list):
+    """Run one take_orders task per stream on the current event loop and return their results."""
+    return await asyncio.gather(*(take_orders(pool, stream) for stream in streams))
@@ -0,0 +1,129 @@
+import heapq
+import threading
+import psycopg
+from database import OPEN_STATUSES
+from queries import registry
+
+LOAD_QUERY = registry.register("couriers.open_order_counts", """
+    SELECT c.id, c.name, COALESCE(o.open_orders, 0)
+    FROM couriers c
+    LEFT JOIN (SELECT courier_id, COUNT(*) AS open_orders FROM orders
+               WHERE status = ANY(%s) GROUP BY courier_id) o
+    ON o.courier_id = c.id""")
+
+class CourierBalancer:
+    """
+    In-memory min-heap of open orders per courier.
+
+    The heap is loaded once from a single grouped query and then kept up to date
+    as orders are assigned and closed, so picking the least busy courier costs
+    O(log n) instead of a scan of the orders table. Entries are invalidated lazily:
+    each courier has a current load in `loads`, and heap entries whose load no
+    longer matches are discarded when they reach the top. All methods are safe to
+    call from several threads sharing one balancer.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.loads = {}
+        self.names = {}
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    def load(self, conn: psycopg.Connection):
+        """
+        Load the open-order count of every courier from the database.
+
+        Args:
+            conn (psycopg.Connection): A connection to the PostgreSQL database.
+
+        Runs one grouped query over the open orders, which is served by the
+        (status, courier_id) index, so its cost depends on the number of open orders
+        rather than on the size of the order history.
+        """
+        with conn.cursor() as cursor:
+            registry.execute(cursor, LOAD_QUERY, (list(OPEN_STATUSES),))
+            self.fill(cursor.fetchall())
+
+    def fill(self, rows: list):
+        """Replace the heap with (courier_id, name, open_orders) rows, as returned by LOAD_QUERY."""
+        with self.lock:
+            self.names = {row[0]: row[1].rstrip() for row in rows}
+            self.loads = {row[0]: row[2] for row in rows}
+            self.heap = [(load, id) for id, load in self.loads.items()]
+            heapq.heapify(self.heap)
+            self.loaded = True
+
+    def invalidate(self):
+        """Drop the heap so it is reloaded on next use, e.g. after couriers are added or deleted."""
+        with self.lock:
+            self.loaded = False
+
+    def assign(self, conn: psycopg.Connection):
+        """
+        Pick the courier with the fewest open orders and count a new order against them.
+
+        Args:
+            conn (psycopg.Connection): A connection to the PostgreSQL database, used
+                only when the heap has not been loaded yet.
+
+        Returns a (courier_id, courier_name) tuple. Raises ValueError if there are
+        no couriers.
+        """
+        with self.lock:
+            if not self.loaded:
+                self.load(conn)
+            return self.pick()
+
+    def assign_rows(self, rows: list = None):
+        """
+        Pick the least busy courier, loading the heap from rows fetched by the caller if it is not loaded.
+
+        Args:
+            rows (list): (courier_id, name, open_orders) rows from LOAD_QUERY, or
+                None if the caller has not fetched any.
+
+        For callers that cannot run LOAD_QUERY on a synchronous connection, such
+        as the asyncio orders. The check and the pick happen under the lock, so
+        an invalidate from another thread in between cannot leave the heap
+        empty. Returns a (courier_id, courier_name) tuple, or None if the heap
+        is not loaded and no rows were given. Raises ValueError if there are no
+        couriers.
+        """
+        with self.lock:
+            if not self.loaded:
+                if rows is None:
+                    return None
+                self.fill(rows)
+            return self.pick()
+
+    def pick(self):
+        """Count a new order against the courier at the top of the heap. The caller holds the lock."""
+        while self.heap:
+            load, id = self.heap[0]
+            if self.loads.get(id) != load:
+                heapq.heappop(self.heap)
+                continue
+            self.loads[id] = load + 1
+            heapq.heapreplace(self.heap, (load + 1, id))
+            return id, self.names[id]
+
+        raise ValueError("No couriers available")
+
+    def release(self, id: int):
+        """
+        Take one open order off a courier's workload.
+
+        Args:
+            id (int): The ID of the courier whose order was collected or abandoned.
+
+        Unknown couriers are ignored, as they may have been deleted since the heap
+        was loaded.
+        """
+        with self.lock:
+            if id not in self.loads or self.loads[id] == 0:
+                return
+            self.loads[id] -= 1
+            heapq.heappush(self.heap, (self.loads[id], id))
+
+balancer = CourierBalancer()
@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import psycopg
+import async_orders
+from balancer import CourierBalancer, balancer
+from connection import connect, create_pool, create_async_pool
+from customers import customer_cache
+from database import create_database
+from orders import add_order_spend, place_order
+from storage import PostgresStorage, SQLiteStorage
+from workload import DEFAULT_MIX, Workload, run_suite, seed
+
+def seed_orders(conn: psycopg.Connection, couriers: int, orders: int, open_ratio: float):
+    """
+    Insert synthetic couriers and historical orders for benchmarking.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        couriers (int): The number of couriers to create.
+        orders (int): The number of orders to create.
+        open_ratio (float): The fraction of orders left open (preparing or ready).
+
+    Rows are generated server-side with generate_series. Nothing is committed, so
+    the caller can roll the seed back once the benchmark is done.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO couriers (name) SELECT 'Bench courier ' || n FROM generate_series(1, %s) n RETURNING id",
+            (couriers,)
+        )
+        courier_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """INSERT INTO orders (customer_name, customer_email, customer_phone, customer_address, items, status, courier_id)
+               SELECT 'Bench', 'bench' || n || '@example.com', '0', 'bench street', '{Latte}',
+                      CASE WHEN random() < %s THEN 'preparing' ELSE 'collected' END,
+                      (%s::int[])[1 + n %% %s]
+               FROM generate_series(1, %s) n""",
+            (open_ratio, courier_ids, couriers, orders)
+        )
+        cursor.execute("ANALYZE orders")
+
+def bench_courier_assignment(conn: psycopg.Connection, sizes: list, couriers: int, assignments: int):
+    """
+    Measure courier assignment latency against growing order histories.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        sizes (list of int): The numbers of historical orders to test with.
+        couriers (int): The number of couriers to seed.
+        assignments (int): The number of assignments timed per size.
+
+    For each size the tables are seeded inside a transaction, the workload heap is
+    loaded and a batch of assignments is timed, then everything is rolled back.
+    Prints the heap load time and the mean assignment latency for each size.
+    """
+    print(f"\n{'Orders':<12}{'Load (ms)':<14}{'Assign (us)':<14}")
+    for size in sizes:
+        seed_orders(conn, couriers, size, 0.01)
+
+        balancer = CourierBalancer()
+        start = time.perf_counter()
+        balancer.load(conn)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for n in range(assignments):
+            id, name = balancer.assign(conn)
+            if n % 2:
+                balancer.release(id)
+        assign_us = (time.perf_counter() - start) * 1e6 / assignments
+
+        print(f"{size:<12}{load_ms:<14.2f}{assign_us:<14.2f}")
+        conn.rollback()
+
+def bench_customer_lookup(conn: psycopg.Connection, sizes: list, lookups: int):
+    """
+    Measure the customer spend update of place_order against growing customer tables.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        sizes (list of int): The numbers of customers to test with.
+        lookups (int): The number of updates timed per size.
+
+    For each size the customers are seeded inside a transaction, and the spend
+    of existing customers is updated through orders.add_order_spend with the
+    cache disabled, i.e. the upsert by email, then with it warm, i.e. the update
+    by primary key, before everything is rolled back. Prints the mean latency
+    of both.
+    """
+    maxsize = customer_cache.maxsize
+    print(f"\n{'Customers':<12}{'Uncached (us)':<16}{'Cached (us)':<14}")
+    for size in sizes:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO customers (customer_name, customer_email, customer_phone) SELECT 'Bench', 'bench' || n || '@example.com', '0' FROM generate_series(1, %s) n RETURNING customer_email, id",
+                (size,)
+            )
+            ids = dict(cursor.fetchall())
+            cursor.execute("ANALYZE customers")
+            emails = [f"bench{1 + (n * 7919) % size}@example.com" for n in range(lookups)]
+
+            results = []
+            for cache_size in (0, lookups):
+                customer_cache.clear()
+                customer_cache.maxsize = cache_size
+                for email in emails:
+                    customer_cache.put(email, ids[email])
+                start = time.perf_counter()
+                for email in emails:
+                    add_order_spend(cursor, "Bench", email, "0", 1)
+                results.append((time.perf_counter() - start) * 1e6 / lookups)
+
+        print(f"{size:<12}{results[0]:<16.2f}{results[1]:<14.2f}")
+        conn.rollback()
+
+    customer_cache.clear()
+    customer_cache.maxsize = maxsize
+
+def post_json(url: str, payload: dict):
+    """Send a JSON POST request and return the decoded response."""
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def load_test(url: str, workers: int, duration: float):
+    """
+    Place orders through the headless service from several threads at once.
+
+    Args:
+        url (str): The base URL of a running service, e.g. http://127.0.0.1:8000.
+        workers (int): The number of concurrent tills to simulate.
+        duration (float): How long to keep placing orders, in seconds.
+
+    Creates a product and a courier through the API, then each worker places
+    orders back to back until the time is up. Prints the number of orders
+    placed, failures and orders per second. The orders are committed, so point
+    this at a scratch database.
+    """
+    product = post_json(f"{url}/products", {"name": "Load test latte", "price": "2.50", "stock": 10_000_000})
+    post_json(f"{url}/couriers", {"name": "Load test courier"})
+
+    counts = {"ok": 0, "failed": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def till(n: int):
+        order = {"name": "Load test", "address": "1 bench street", "phone": "0", "email": f"load{n}@example.com", "items": [product["id"]]}
+        while time.perf_counter() < deadline:
+            try:
+                post_json(f"{url}/orders", order)
+                result = "ok"
+            except OSError:
+                result = "failed"
+            with lock:
+                counts[result] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=till, args=(n,)) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"\nOrders placed: {counts['ok']}\nFailed: {counts['failed']}\nOrders per second: {counts['ok'] / elapsed:.1f}\n")
+
+def bench_async_orders(conn: psycopg.Connection, streams: int, orders: int):
+    """
+    Compare placing orders from many concurrent streams with the sync and asyncio workflows.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        streams (int): The number of concurrent order streams (tills).
+        orders (int): The number of orders placed by each stream.
+
+    Creates a product and a courier, then places the same orders three ways:
+    one after another on a single connection, as the menu does; from one thread
+    per stream sharing a pool of `streams` connections; and from one asyncio task
+    per stream sharing an async pool of the same size on a single event loop.
+    Prints the orders per second of each. The orders are committed, so point
+    this at a scratch database.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO products (name, price, stock) VALUES ('Async Bench Latte', 2.50, 100000000)")
+        cursor.execute("INSERT INTO couriers (name) VALUES ('Async bench courier')")
+    conn.commit()
+    balancer.invalidate()
+
+    def order(stream: int, n: int):
+        return {"name": "Bench", "address": "1 bench street", "phone": "0", "email": f"async{stream}_{n}@example.com", "items": ["Async Bench Latte"]}
+
+    def place_sync(conn: psycopg.Connection, order: dict):
+        courier_id, courier = balancer.assign(conn)
+        place_order(conn, order["name"], order["address"], order["phone"], order["email"], courier_id, order["items"])
+
+    results = []
+
+    start = time.perf_counter()
+    for stream in range(streams):
+        for n in range(orders):
+            place_sync(conn, order(stream, n))
+    results.append(("sync, 1 connection", time.perf_counter() - start))
+
+    pool = create_pool(streams, streams)
+    try:
+        def till(stream: int):
+            for n in range(orders):
+                with pool.connection() as conn:
+                    place_sync(conn, order(stream, n))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=streams) as executor:
+            list(executor.map(till, range(streams)))
+        results.append((f"sync, {streams} threads", time.perf_counter() - start))
+    finally:
+        pool.close()
+
+    async def run_async():
+        pool = await create_async_pool(streams, streams)
+        try:
+            start = time.perf_counter()
+            await async_orders.take_concurrent_orders(pool, [[order(stream, n) for n in range(orders)] for stream in range(streams)])
+            return time.perf_counter() - start
+        finally:
+            await pool.close()
+
+    results.append((f"asyncio, {streams} tasks", asyncio.run(run_async())))
+
+    total = streams * orders
+    print(f"\n{'Workflow':<24}{'Seconds':<10}{'Orders/sec':<12}")
+    for name, seconds in results:
+        print(f"{name:<24}{seconds:<10.2f}{total / seconds:<12.1f}")
+
+def bench_storage(conn: psycopg.Connection, reads: int, orders: int):
+    """
+    Compare read and order latency through the storage interface on PostgreSQL and in-memory SQLite.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        reads (int): The number of product pages read from each backend.
+        orders (int): The number of orders placed on each backend.
+
+    Both backends get the same product and courier, then the same reads and
+    orders are timed through the Storage interface. The PostgreSQL orders are
+    committed, so point this at a scratch database.
+    """
+    backends = [("postgres", PostgresStorage(conn)), ("sqlite :memory:", SQLiteStorage(":memory:"))]
+    print(f"\n{'Backend':<18}{'Read us':<12}{'Order us':<12}")
+    for name, storage in backends:
+        storage.add_product("Storage Bench Latte", 2.50, orders)
+        storage.add_courier("Storage bench courier")
+
+        start = time.perf_counter()
+        for _ in range(reads):
+            storage.list_products(limit=20)
+        read = (time.perf_counter() - start) / reads
+
+        start = time.perf_counter()
+        for n in range(orders):
+            storage.place_order("Bench", "1 bench street", "0", f"storage{n}@example.com", ["Storage Bench Latte"])
+        order = (time.perf_counter() - start) / orders
+
+        print(f"{name:<18}{read * 1e6:<12.1f}{order * 1e6:<12.1f}")
+    print()
+
+def git_commit():
+    """Return the current git commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_suite(conn: psycopg.Connection, products: int, customers: int, couriers: int, orders: int, workers: int, operations: int, random_seed: int, mix: dict, output: str):
+    """
+    Seed a synthetic cafe, run a realistic mix of operations against it and save the latencies.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        products (int): The number of products to seed.
+        customers (int): The number of customers to seed.
+        couriers (int): The number of couriers to seed.
+        orders (int): The number of historical orders to seed.
+        workers (int): The number of concurrent tills running the mix.
+        operations (int): The number of operations run by each till.
+        random_seed (int): The random seed, so runs on different commits do the same work.
+        mix (dict): The relative weight of each operation, as in workload.DEFAULT_MIX.
+        output (str): The folder to write the JSON results to.
+
+    Prints the count, errors, p50, p95 and p99 latency and throughput of each
+    operation, and writes them with the git commit and configuration to a JSON
+    file, to be compared against other runs with the compare command. The seed
+    and the orders are committed, so point this at a scratch database, such as
+    the one in docker-compose.yml.
+    """
+    print(f"Seeding {products} products, {customers} customers, {couriers} couriers and {orders} orders...")
+    start = time.perf_counter()
+    product_rows, courier_ids = seed(conn, products, customers, couriers, orders)
+    print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    workload = Workload(product_rows, customers, courier_ids, mix)
+    workload.load_open_orders(conn)
+    conn.commit()
+
+    results = run_suite(workers, operations, random_seed, workload)
+
+    print(f"\n{'Operation':<24}{'Count':<8}{'Errors':<8}{'p50 ms':<10}{'p95 ms':<10}{'p99 ms':<10}{'Ops/sec':<10}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['count']:<8}{r['errors']:<8}{r['p50_ms']:<10.2f}{r['p95_ms']:<10.2f}{r['p99_ms']:<10.2f}{r['ops_per_sec']:<10.1f}")
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {"products": products, "customers": customers, "couriers": couriers, "orders": orders,
+                   "workers": workers, "operations": operations, "seed": random_seed, "mix": mix},
+        "results": results,
+    }
+    os.makedirs(output, exist_ok=True)
+    path = os.path.join(output, f"suite-{time.strftime('%Y%m%d-%H%M%S')}-{(commit or 'nogit')[:8]}.json")
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults written to {path}\n")
+
+def compare_results(baseline: str, candidate: str):
+    """
+    Print the change in latency and throughput of each operation between two suite results.
+
+    Args:
+        baseline (str): The JSON results to compare against, e.g. from the main branch.
+        candidate (str): The JSON results of the change being measured.
+
+    A positive p95 change is a slowdown.
+    """
+    with open(baseline) as file:
+        before = json.load(file)
+    with open(candidate) as file:
+        after = json.load(file)
+
+    print(f"\nBaseline:  {before.get('commit')}\nCandidate: {after.get('commit')}\n")
+    print(f"{'Operation':<24}{'p95 before':<12}{'p95 after':<12}{'p95 change':<12}{'Ops/sec before':<16}{'Ops/sec after':<14}")
+    for name in after["results"]:
+        if name not in before["results"]:
+            continue
+        old, new = before["results"][name], after["results"][name]
+        change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        print(f"{name:<24}{old['p95_ms']:<12.2f}{new['p95_ms']:<12.2f}{change:<+12.1f}{old['ops_per_sec']:<16.1f}{new['ops_per_sec']:<14.1f}")
+    print()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cafe ordering system benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    courier = commands.add_parser("courier", help="courier assignment latency")
+    courier.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    courier.add_argument("--couriers", type=int, default=20)
+    courier.add_argument("--assignments", type=int, default=10_000)
+
+    customers = commands.add_parser("customers", help="customer lookup latency")
+    customers.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    customers.add_argument("--lookups", type=int, default=10_000)
+
+    load = commands.add_parser("load", help="orders per second through the headless service")
+    load.add_argument("--url", default="http://127.0.0.1:8000")
+    load.add_argument("--workers", type=int, default=8)
+    load.add_argument("--duration", type=float, default=30)
+
+    concurrent = commands.add_parser("async", help="sync versus asyncio order workflow under concurrent streams")
+    concurrent.add_argument("--streams", type=int, default=16)
+    concurrent.add_argument("--orders", type=int, default=200, help="orders placed by each stream")
+
+    storage = commands.add_parser("storage", help="read and order latency on PostgreSQL versus embedded SQLite")
+    storage.add_argument("--reads", type=int, default=10_000)
+    storage.add_argument("--orders", type=int, default=1_000)
+
+    suite = commands.add_parser("suite", help="end-to-end latency of a synthetic cafe workload, saved as JSON")
+    suite.add_argument("--products", type=int, default=200)
+    suite.add_argument("--customers", type=int, default=50_000)
+    suite.add_argument("--couriers", type=int, default=20)
+    suite.add_argument("--orders", type=int, default=1_000_000, help="historical orders to seed")
+    suite.add_argument("--workers", type=int, default=8)
+    suite.add_argument("--operations", type=int, default=2_000, help="operations run by each worker")
+    suite.add_argument("--seed", type=int, default=42)
+    suite.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help='operation weights as JSON, e.g. \'{"create_order": 80, "export": 0}\'')
+    suite.add_argument("--output", default="bench-results")
+
+    compare = commands.add_parser("compare", help="compare two suite result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+
+    args = parser.parse_args()
+
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    if args.command == "load":
+        load_test(args.url, args.workers, args.duration)
+        exit()
+    if args.command == "compare":
+        compare_results(args.baseline, args.candidate)
+        exit()
+
+    conn = connect()
+    try:
+        create_database(conn)
+        if args.command == "courier":
+            bench_courier_assignment(conn, args.sizes, args.couriers, args.assignments)
+        elif args.command == "customers":
+            bench_customer_lookup(conn, args.sizes, args.lookups)
+        elif args.command == "async":
+            bench_async_orders(conn, args.streams, args.orders)
+        elif args.command == "storage":
+            bench_storage(conn, args.reads, args.orders)
+        elif args.command == "suite":
+            bench_suite(conn, args.products, args.customers, args.couriers, args.orders, args.workers, args.operations, args.seed, args.mix, args.output)
+    finally:
+        conn.close()
@@ -0,0 +1,213 @@
+import argparse
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+import psycopg
+from balancer import balancer
+from connection import connect
+from customers import normalize_email
+
+BATCH_SIZE = 10_000
+
+def clean_product(record: dict):
+    """Validate a product record and return its (name, price, stock) values."""
+    name = (record.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    try:
+        price = Decimal(str(record.get("price")).strip().lstrip("£"))
+    except InvalidOperation:
+        raise ValueError(f"invalid price {record.get('price')!r}")
+    if not price.is_finite():
+        raise ValueError(f"invalid price {record.get('price')!r}")
+    if price < 0:
+        raise ValueError("price must not be negative")
+    stock = int(record.get("stock") or 0)
+    if stock < 0:
+        raise ValueError("stock must not be negative")
+    return (name.title(), price, stock)
+
+def clean_customer(record: dict):
+    """Validate a customer record and return its (customer_name, customer_email, customer_phone) values."""
+    name = (record.get("customer_name") or record.get("name") or "").strip()
+    email = normalize_email(record.get("customer_email") or record.get("email") or "")
+    phone = str(record.get("customer_phone") or record.get("phone") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    if "@" not in email:
+        raise ValueError(f"invalid email {email!r}")
+    return (name.title(), email, phone)
+
+def clean_courier(record: dict):
+    """Validate a courier record and return its (name,) values."""
+    name = (record.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    return (name.capitalize(),)
+
+IMPORTS = {
+    "products": {
+        "columns": ("name", "price", "stock"),
+        "staging": "name VARCHAR(255), price DECIMAL, stock INT",
+        "clean": clean_product,
+        "merge": """WITH incoming AS (
+                        SELECT DISTINCT ON (name) name, price, stock FROM import_staging ORDER BY name, line DESC
+                    ), updated AS (
+                        UPDATE products SET price = incoming.price, stock = incoming.stock
+                        FROM incoming WHERE products.name = incoming.name
+                        RETURNING products.name
+                    )
+                    INSERT INTO products (name, price, stock)
+                    SELECT name, price, stock FROM incoming WHERE NOT EXISTS (SELECT 1 FROM updated WHERE updated.name = incoming.name)""",
+    },
+    "customers": {
+        "columns": ("customer_name", "customer_email", "customer_phone"),
+        "staging": "customer_name VARCHAR(255), customer_email VARCHAR(255), customer_phone VARCHAR(255)",
+        "clean": clean_customer,
+        "merge": """INSERT INTO customers (customer_name, customer_email, customer_phone)
+                    SELECT DISTINCT ON (customer_email) customer_name, customer_email, customer_phone
+                    FROM import_staging ORDER BY customer_email, line DESC
+                    ON CONFLICT ((lower(customer_email))) DO UPDATE
+                    SET customer_name = EXCLUDED.customer_name, customer_phone = EXCLUDED.customer_phone""",
+    },
+    "couriers": {
+        "columns": ("name",),
+        "staging": "name VARCHAR(255)",
+        "clean": clean_courier,
+        "merge": """INSERT INTO couriers (name)
+                    SELECT DISTINCT name FROM import_staging s WHERE NOT EXISTS (SELECT 1 FROM couriers c WHERE c.name = s.name)""",
+    },
+}
+
+def read_records(path: str):
+    """
+    Read records from a CSV file with a header row, or from a JSONL file.
+
+    Args:
+        path (str): The file to read. Files ending in .jsonl or .json are read
+            as one JSON object per line, anything else as CSV.
+
+    Yields (line_number, record) tuples, where record is a dict, or the error
+    message if the line could not be parsed.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith((".jsonl", ".json")):
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, f"invalid JSON: {e}"
+        else:
+            for line_number, record in enumerate(csv.DictReader(file), start=2):
+                yield line_number, record
+
+def batches(records, size: int):
+    """Group an iterable into lists of at most `size` items."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def bulk_load(conn: psycopg.Connection, table: str, path: str, batch_size: int = BATCH_SIZE):
+    """
+    Load products, customers or couriers from a file in one transaction.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        table (str): "products", "customers" or "couriers".
+        path (str): The CSV or JSONL file to load.
+        batch_size (int): The number of records validated and copied at a time.
+
+    Records are validated in batches and the valid ones streamed with COPY FROM
+    STDIN into a temporary staging table. Once the whole file is staged it is
+    merged into the table in one statement: products are matched by name,
+    customers by email and couriers by name, and later records in the file win.
+    Rejected records are written with their line number and reason to
+    `<path>.rejected.jsonl`. Nothing is loaded if the merge fails.
+
+    Returns a (loaded, rejected, seconds) tuple.
+    """
+    spec = IMPORTS[table]
+    rejects_path = path + ".rejected.jsonl"
+    loaded = 0
+    rejected = 0
+    start = time.perf_counter()
+
+    try:
+        with conn.cursor() as cursor, open(rejects_path, "w", encoding="utf-8") as rejects:
+            cursor.execute(f"CREATE TEMP TABLE import_staging (line INT, {spec['staging']}) ON COMMIT DROP")
+
+            for batch in batches(read_records(path), batch_size):
+                rows = []
+                for line_number, record in batch:
+                    try:
+                        if isinstance(record, str):
+                            raise ValueError(record)
+                        rows.append((line_number,) + spec["clean"](record))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        rejected += 1
+                        rejects.write(json.dumps({"line": line_number, "error": str(e), "record": record}, default=str) + "\n")
+
+                with cursor.copy(f"COPY import_staging (line, {', '.join(spec['columns'])}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                loaded += len(rows)
+
+                elapsed = time.perf_counter() - start
+                print(f"Staged {loaded} rows, rejected {rejected} ({loaded / elapsed:.0f} rows/sec)")
+
+            cursor.execute(spec["merge"])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if table == "couriers":
+        balancer.invalidate()
+
+    return loaded, rejected, time.perf_counter() - start
+
+def prompt_bulk_import(conn: psycopg.Connection):
+    """
+    Prompt for a table and a file, then bulk load it and report the throughput.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+    """
+    table = input("Table to import into (products/customers/couriers): ").strip().lower()
+    if table not in IMPORTS:
+        print("\nInvalid table! Try again!\n")
+        return
+    path = input("Path to CSV or JSONL file: ").strip()
+
+    try:
+        loaded, rejected, seconds = bulk_load(conn, table, path)
+    except (OSError, psycopg.Error) as e:
+        print(f"\nImport failed: {e}\n")
+        return
+
+    print(f"\nImported {loaded} rows into {table} in {seconds:.2f}s ({loaded / max(seconds, 1e-9):.0f} rows/sec).")
+    if rejected:
+        print(f"{rejected} rows were rejected, see {path}.rejected.jsonl")
+    print()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk load products, customers or couriers from CSV or JSONL")
+    parser.add_argument("table", choices=sorted(IMPORTS))
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        loaded, rejected, seconds = bulk_load(conn, args.table, args.path, args.batch_size)
+        print(f"\nImported {loaded} rows, rejected {rejected}, {loaded / max(seconds, 1e-9):.0f} rows/sec")
+    finally:
+        conn.close()
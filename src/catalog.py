@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from decimal import Decimal
+import psycopg
+from queries import registry
+
+CHANNEL = "products_changed"
+
+LOAD_PRODUCTS = registry.register("products.all", "SELECT id, name, price, stock FROM products")
+PRODUCT_BY_ID = registry.register("products.by_id", "SELECT id, name, price, stock FROM products WHERE id = %s")
+PRODUCT_BY_NAME = registry.register("products.by_name", "SELECT id, name, price, stock FROM products WHERE name = %s ORDER BY id LIMIT 1")
+
+class ProductCatalog:
+    """
+    Read-through cache of the products table, keyed by ID with a secondary name index.
+
+    A background thread LISTENs on the products_changed channel, which a trigger
+    on products notifies on every insert, update and delete, and applies each
+    change to the cache. While that listener is not connected the catalogue
+    cannot know when it is stale, so every lookup goes to the database instead.
+    Rows are (id, name, price, stock) tuples.
+    """
+
+    def __init__(self):
+        self.products = {}
+        self.names = {}
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def listen(self, conninfo: str):
+        """
+        Start the background listener that loads the catalogue and keeps it fresh.
+
+        Args:
+            conninfo (str): The connection string for the listener's own connection.
+
+        The listener subscribes before loading, so no change can slip in between
+        the load and the first notification. If its connection drops, the cache is
+        marked stale and the listener reconnects and reloads.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, args=(conninfo,), daemon=True)
+        self.thread.start()
+
+    def run(self, conninfo: str):
+        """Body of the listener thread: subscribe, load, then apply notifications until the connection drops."""
+        while True:
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    self.load(conn)
+                    for notify in conn.notifies():
+                        self.apply(json.loads(notify.payload, parse_float=Decimal))
+            except psycopg.Error:
+                with self.lock:
+                    self.ready = False
+                time.sleep(1)
+
+    def load(self, conn: psycopg.Connection):
+        """Replace the cache with every product in the database."""
+        with conn.cursor() as cursor:
+            registry.execute(cursor, LOAD_PRODUCTS)
+            rows = cursor.fetchall()
+
+        with self.lock:
+            self.products = {row[0]: row for row in rows}
+            self.names = {}
+            for row in sorted(rows, reverse=True):
+                self.names[row[1]] = row[0]
+            self.ready = True
+
+    def apply(self, change: dict):
+        """Apply one products_changed notification to the cache."""
+        with self.lock:
+            old = self.products.pop(change["id"], None)
+            if old is not None and self.names.get(old[1]) == old[0]:
+                del self.names[old[1]]
+                others = [row[0] for row in self.products.values() if row[1] == old[1]]
+                if others:
+                    self.names[old[1]] = min(others)
+            if change["op"] != "DELETE":
+                row = (change["id"], change["name"], change["price"], change["stock"])
+                self.products[row[0]] = row
+                if row[1] not in self.names or row[0] < self.names[row[1]]:
+                    self.names[row[1]] = row[0]
+
+    def get(self, conn: psycopg.Connection, id: int):
+        """
+        Look a product up by ID.
+
+        Args:
+            conn (psycopg.Connection): A connection to the PostgreSQL database,
+                used only on a cache miss.
+            id (int): The ID of the product.
+
+        Returns the (id, name, price, stock) row, or None if there is no such product.
+        """
+        with self.lock:
+            if self.ready:
+                self.hits += 1
+                return self.products.get(id)
+            self.misses += 1
+
+        with conn.cursor() as cursor:
+            registry.execute(cursor, PRODUCT_BY_ID, (id,))
+            return cursor.fetchone()
+
+    def by_name(self, conn: psycopg.Connection, name: str):
+        """
+        Look a product up by name, as stored in orders.
+
+        Args:
+            conn (psycopg.Connection): A connection to the PostgreSQL database,
+                used only on a cache miss.
+            name (str): The name of the product.
+
+        Returns the (id, name, price, stock) row with the lowest ID for that name,
+        or None if there is no such product.
+        """
+        with self.lock:
+            if self.ready:
+                self.hits += 1
+                id = self.names.get(name)
+                return self.products.get(id) if id is not None else None
+            self.misses += 1
+
+        with conn.cursor() as cursor:
+            registry.execute(cursor, PRODUCT_BY_NAME, (name,))
+            return cursor.fetchone()
+
+    def stats(self):
+        """Return a dict with the number of cached products, hits, misses and the hit ratio."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "products": len(self.products),
+                "listening": self.ready,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+catalog = ProductCatalog()
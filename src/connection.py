@@ -0,0 +1,71 @@
+import os
+import psycopg
+from dotenv import load_dotenv
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+load_dotenv()
+
+def get_conninfo():
+    """
+    Build a libpq connection string from the POSTGRES_* settings in `.env`.
+
+    Returns the connection string for the configured database.
+    """
+    return make_conninfo(
+        dbname=os.getenv('POSTGRES_DB'),
+        host=os.getenv('POSTGRES_HOST'),
+        port=os.getenv('POSTGRES_PORT'),
+        user=os.getenv('POSTGRES_USER'),
+        password=os.getenv('POSTGRES_PASSWORD')
+    )
+
+def connect():
+    """
+    Open a single connection to the configured database.
+
+    Returns a psycopg.Connection. Used by the interactive menu, which only needs
+    one connection for one operator.
+    """
+    return psycopg.connect(get_conninfo())
+
+def create_pool(min_size: int = None, max_size: int = None):
+    """
+    Open a pool of connections to the configured database.
+
+    Args:
+        min_size (int): The number of connections kept open. Defaults to
+            POSTGRES_POOL_MIN from `.env`, or 1.
+        max_size (int): The maximum number of connections. Defaults to
+            POSTGRES_POOL_MAX from `.env`, or 10.
+
+    Connections borrowed with `pool.connection()` are committed when the block
+    exits normally and rolled back if it raises, so a failed statement never
+    leaves a connection stuck in an aborted transaction. Returns a ConnectionPool.
+    """
+    min_size = min_size or int(os.getenv('POSTGRES_POOL_MIN', 1))
+    max_size = max_size or int(os.getenv('POSTGRES_POOL_MAX', 10))
+
+    pool = ConnectionPool(get_conninfo(), min_size=min_size, max_size=max(min_size, max_size), open=True)
+    pool.wait()
+    return pool
+
+async def create_async_pool(min_size: int = None, max_size: int = None):
+    """
+    Open a pool of asynchronous connections to the configured database.
+
+    Args:
+        min_size (int): The number of connections kept open. Defaults to
+            POSTGRES_POOL_MIN from `.env`, or 1.
+        max_size (int): The maximum number of connections. Defaults to
+            POSTGRES_POOL_MAX from `.env`, or 10.
+
+    The asyncio counterpart of create_pool, with the same commit and rollback
+    behaviour. Returns an open AsyncConnectionPool.
+    """
+    min_size = min_size or int(os.getenv('POSTGRES_POOL_MIN', 1))
+    max_size = max_size or int(os.getenv('POSTGRES_POOL_MAX', 10))
+
+    pool = AsyncConnectionPool(get_conninfo(), min_size=min_size, max_size=max(min_size, max_size), open=False)
+    await pool.open(wait=True)
+    return pool
@@ -1,45 +1,84 @@
-import os
 import psycopg
+from balancer import balancer
+from database import OPEN_STATUSES
+from paging import browse, keyset_page, PAGE_SIZE
+from queries import registry
+
+COURIER_COLUMNS = ("id", "name")
+COURIER_ORDER_COLUMNS = ("id", "customer_name", "customer_address", "customer_phone", "items", "status")
+
+INSERT_COURIER = registry.register("couriers.insert", "INSERT INTO couriers (name) VALUES (%s) RETURNING id")
+DELETE_COURIER = registry.register("couriers.delete", "DELETE FROM couriers WHERE id = %s")
+
+# One page of a courier's open orders together with how many they have in each
+# status. The counts come from an index-only aggregate over the courier's open
+# orders. The page is cut per status, so each branch is a range scan of the
+# (courier_id, status, id) index that stops after `limit` rows, and the
+# branches are merged and cut again. The courier is joined from the left so a
+# courier with no open orders still returns a row. Pages going backwards read
+# the index in descending order from the first ID, and come out in ID order
+# again from the outer ORDER BY.
+OPEN_ORDERS_PAGE = """
+    SELECT c.name, counts.preparing, counts.ready, page.id, page.customer_name, page.customer_address, page.customer_phone, page.items, page.status
+    FROM couriers c
+    CROSS JOIN (
+        SELECT COUNT(*) FILTER (WHERE status = 'preparing') AS preparing, COUNT(*) FILTER (WHERE status = 'ready') AS ready
+        FROM orders WHERE courier_id = %s AND status = ANY(%s)
+    ) counts
+    LEFT JOIN (
+        SELECT o.* FROM unnest(%s::text[]) AS wanted(status)
+        CROSS JOIN LATERAL (
+            SELECT id, customer_name, customer_address, customer_phone, items, orders.status FROM orders
+            WHERE courier_id = %s AND orders.status = wanted.status AND id {op} %s
+            ORDER BY id {direction} LIMIT %s
+        ) o
+        ORDER BY o.id {direction} LIMIT %s
+    ) page ON true
+    WHERE c.id = %s
+    ORDER BY page.id"""
+OPEN_ORDERS_AFTER = registry.register("couriers.open_orders_after", OPEN_ORDERS_PAGE.format(op=">", direction="ASC"))
+OPEN_ORDERS_BEFORE = registry.register("couriers.open_orders_before", OPEN_ORDERS_PAGE.format(op="<", direction="DESC"))
+
+# Moves a courier's open orders to the other couriers, dealt out in turn
+# starting with whoever has the fewest open orders.
+REASSIGN_ORDERS = registry.register("couriers.reassign", """
+    WITH moving AS (
+        SELECT id, row_number() OVER (ORDER BY id) - 1 AS n
+        FROM (SELECT id FROM orders WHERE courier_id = %s AND status = ANY(%s) ORDER BY id FOR UPDATE) locked
+    ), targets AS (
+        SELECT c.id, c.name, row_number() OVER (ORDER BY COALESCE(o.open_orders, 0), c.id) - 1 AS n, COUNT(*) OVER () AS total
+        FROM couriers c
+        LEFT JOIN (SELECT courier_id, COUNT(*) AS open_orders FROM orders
+                   WHERE status = ANY(%s) GROUP BY courier_id) o ON o.courier_id = c.id
+        WHERE c.id <> %s
+    )
+    UPDATE orders SET courier_id = targets.id, courier = targets.name
+    FROM moving JOIN targets ON targets.n = moving.n %% targets.total
+    WHERE orders.id = moving.id""")
+
+def prompt_add_courier(conn: psycopg.Connection):
+    """Ask for the name of a new courier and add them."""
+    name = input("Courier name: ")
+    add_courier(conn, name)
+    print("\nCourier added.\n")
 
-def courier_menu(conn: psycopg.Connection, menu: callable):
-
-    """
-    Menu for managing couriers in the database.
-
-    Args:
-        conn (psycopg.Connection): A connection to the PostgreSQL database.
-        menu (function): The function to call to go back to the main menu.
-
-    This function provides a menu for managing couriers in the database. The
-    user can view all couriers, add a new courier, delete a courier or open
-    orders by courier. The user can also go back to the main menu by selecting
-    option 0.
-    """
-    while True:
-
-        opt = int(input("\n\n1. View couriers\n2. Add courier\n3. Delete courier\n4. Open orders by courier\n0. Main menu\n"))
-
-        if opt == 1:
-            view_couriers(conn)
-
-        elif opt == 2:
-            name = input("Courier name: ")
-            add_courier(conn, name)
-
-        elif opt == 3:
-            id = input("Courier Id to delete: ")
-            delete_courier(conn, id)
-
-        elif opt == 4:
-            id = int(input("Courier Id: "))
-            check_courier_orders(conn, id)
+def prompt_delete_courier(conn: psycopg.Connection):
+    """Ask which courier to delete and delete them."""
+    id = input("Courier Id to delete: ")
+    delete_courier(conn, id)
 
-        elif opt == 0:
-            os.system('cls')
-            menu(conn)
+def prompt_check_courier_orders(conn: psycopg.Connection):
+    """Ask for a courier ID and show the orders assigned to them."""
+    id = int(input("Courier Id: "))
+    check_courier_orders(conn, id)
 
-        else:
-            print("Invalid option!")
+def prompt_reassign_courier_orders(conn: psycopg.Connection):
+    """Ask for a courier ID and hand their open orders to the other couriers."""
+    id = int(input("Courier Id to take orders from: "))
+    moved = reassign_orders(conn, id)
+    conn.commit()
+    balancer.invalidate()
+    print(f"\n{moved} open order(s) reassigned!\n")
 
 def view_couriers(conn):
         
@@ -49,18 +88,32 @@ def view_couriers(conn):
         Args:
             conn (psycopg.Connection): A connection to the PostgreSQL database.
 
-        Retrieves all couriers from the database and displays them in a formatted
+        Retrieves the couriers from the database one page at a time and displays them in a formatted
         table with columns for ID and Name. The table headers are left-aligned and
         each row is also left-aligned.
         """
-        
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM couriers")    
-            rows = cursor.fetchall()
-            print("\n\n Available couriers:\n")
-            
-            for x in rows:
-                print(f"{x[0]}. {x[1]}") 
+
+        browse(lambda **page: list_couriers(conn, **page), show_couriers)
+
+def show_couriers(rows: list):
+    """Print a page of couriers as a numbered list."""
+    print("\n\n Available couriers:\n")
+    for x in rows:
+        print(f"{x[0]}. {x[1]}")
+
+def list_couriers(conn: psycopg.Connection, after: int = None, before: int = None, limit: int = None):
+    """
+    Retrieve couriers from the database, optionally one page at a time.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        after (int): Only return rows with an ID greater than this one.
+        before (int): Only return rows with an ID less than this one.
+        limit (int): The maximum number of rows to return. If None, all rows are returned.
+
+    Returns a list of rows sorted by ID, with the fields named in COURIER_COLUMNS.
+    """
+    return keyset_page(conn, "SELECT id, name FROM couriers", after=after, before=before, limit=limit, name="couriers.list")
 
 def add_courier(conn, courier_name):
 
@@ -73,13 +126,16 @@ def add_courier(conn, courier_name):
 
     Inserts a new courier into the couriers table with the given name,
     capitalizing the first letter, and commits the changes to the database.
+    Returns the new courier's ID.
     """
 
     with conn.cursor() as cursor:      
-        cursor.execute("INSERT INTO couriers (name) VALUES (%s)", (courier_name.capitalize(),))
+        registry.execute(cursor, INSERT_COURIER, (courier_name.capitalize(),))
+        id = cursor.fetchone()[0]
         conn.commit()
+        balancer.invalidate()
 
-    print("\nCourier added.\n")
+    return id
 
 def delete_courier(conn, courier_id):
 
@@ -91,60 +147,119 @@ def delete_courier(conn, courier_id):
         courier_id (int): The ID of the courier to be deleted.
 
     Deletes the courier with the given ID from the couriers table and commits the
-    changes to the database. If the courier is not found, an error message is printed.
+    changes to the database. Their open orders are first reassigned to the other
+    couriers in the same transaction, so no order is left without a courier. If
+    the courier is not found, an error message is printed.
     """
+    moved = reassign_orders(conn, courier_id)
+
     with conn.cursor() as cursor:
-        cursor.execute("DELETE FROM couriers WHERE id = %s", (courier_id,))
+        registry.execute(cursor, DELETE_COURIER, (courier_id,))
 
         if cursor.rowcount == 0:
+            conn.rollback()
             print("Error! Courier not found! Try again!")
         else:
-            print("\nCourier deleted.\n")
+            print(f"\nCourier deleted. {moved} open order(s) reassigned.\n")
             conn.commit()
+            balancer.invalidate()
 
-    
-def check_courier_orders(conn, id):
-
+def reassign_orders(conn: psycopg.Connection, courier_id: int):
     """
-    Check and display orders for a specific courier.
+    Move every open order of a courier to the other couriers in one statement.
 
     Args:
         conn (psycopg.Connection): A connection to the PostgreSQL database.
-        courier_name (str): The name of the courier whose orders need to be checked.
-
-    This function retrieves and displays all orders associated with the specified
-    courier ID. It first checks if the courier ID exists in the database. If not
-    found, it prints an error message. If the courier ID is valid, it retrieves
-    orders for that courier and displays each order. Additionally, it prints the
-    total number of orders found for the specified courier. If no orders are found,
-    it notifies the user.
+        courier_id (int): The ID of the courier whose orders are moved.
+
+    The orders are dealt out in turn to the other couriers, least busy first,
+    and locked while they move so a status change cannot slip in between. If
+    there are no other couriers, nothing moves. Does not commit, so it can run
+    in the same transaction as deleting the courier; the caller should
+    invalidate the balancer after committing. Returns the number of orders moved.
     """
+    with conn.cursor() as cursor:
+        registry.execute(cursor, REASSIGN_ORDERS, (courier_id, list(OPEN_STATUSES), list(OPEN_STATUSES), courier_id))
+        return cursor.rowcount
 
-    count = 0
-    couriers = {}
+def courier_open_orders(conn: psycopg.Connection, id: int, after: int = None, before: int = None, limit: int = PAGE_SIZE):
+    """
+    Retrieve one page of a courier's open orders and how many they have in each status.
 
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        id (int): The ID of the courier.
+        after (int): Only return orders with an ID greater than this one.
+        before (int): Only return orders with an ID less than this one.
+        limit (int): The maximum number of orders to return.
+
+    Orders are matched on courier_id, so renaming a courier keeps their orders.
+    The counts come from the (courier_id, status, id) index alone, and the page
+    reads at most `limit` rows of it per open status, however many open orders
+    the courier has. Returns None if the courier does not exist, or a
+    (name, counts, rows) tuple, where counts maps each open status to its number
+    of orders and rows have the fields named in COURIER_ORDER_COLUMNS.
+    """
     with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM couriers")
+        statuses = list(OPEN_STATUSES)
+        if before is not None:
+            registry.execute(cursor, OPEN_ORDERS_BEFORE, (id, statuses, statuses, id, before, limit, limit, id))
+        else:
+            registry.execute(cursor, OPEN_ORDERS_AFTER, (id, statuses, statuses, id, after or 0, limit, limit, id))
         rows = cursor.fetchall()
 
-        for x in rows:
-            couriers[x[0]] = x[1]
+    if not rows:
+        return None
+    name, preparing, ready = rows[0][:3]
+    counts = {"preparing": preparing or 0, "ready": ready or 0}
+    return name, counts, [row[3:] for row in rows if row[3] is not None]
 
-        try:
-            courier_name = couriers[id]
-        except KeyError:
-            print("Error! Courier not found! Try again!")
-            return   
+    
+def check_courier_orders(conn, id):
 
-        cursor.execute("SELECT * FROM orders WHERE courier = %s", (courier_name,))
-        rows = cursor.fetchall()
+    """
+    Check and display the open orders of a specific courier.
 
-        for x in rows:
-            count += 1
-            print(x)
-            print("-"*100)
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        id (int): The ID of the courier whose orders need to be checked.
 
-        if count == 0:
-            print("No orders found!")
-        else:
-            print(f"\nThere are {count} orders for courier: {courier_name}.\n")
\ No newline at end of file
+    This function displays how many orders the courier has preparing and ready,
+    then their open orders one page at a time. If the courier ID is not found,
+    it prints an error message. If the courier has no open orders, it notifies
+    the user.
+    """
+
+    page = courier_open_orders(conn, id)
+    if page is None:
+        print("Error! Courier not found! Try again!")
+        return
+
+    courier_name, counts, rows = page
+    if not rows:
+        print("No orders found!")
+        return
+
+    print(f"\nThere are {sum(counts.values())} open orders for courier: {courier_name.rstrip()} "
+          f"({counts['preparing']} preparing, {counts['ready']} ready).\n")
+
+    def show(rows):
+        print(f"{'ID':<8}{'Customer':<25}{'Address':<30}{'Phone':<15}{'Status':<10}Items\n{'-'*100}")
+        for order_id, customer, address, phone, items, status in rows:
+            print(f"{order_id:<8}{customer:<25}{address:<30}{phone:<15}{status:<10}{items}")
+
+    def fetch(after, before, limit):
+        if after is None and before is None:
+            return rows
+        page = courier_open_orders(conn, id, after, before, limit)
+        return page[2] if page is not None else []
+
+    browse(fetch, show)
+
+COURIER_COMMANDS = [
+    ("View couriers", view_couriers),
+    ("Add courier", prompt_add_courier),
+    ("Delete courier", prompt_delete_courier),
+    ("Open orders by courier", prompt_check_courier_orders),
+    ("Reassign a courier's open orders", prompt_reassign_courier_orders),
+]
@@ -1,59 +1,115 @@
 import os
+import threading
 import psycopg
+from collections import OrderedDict
+from catalog import catalog
+from paging import browse, keyset_page
+from queries import registry
+from search import prompt_search_customers
+from updates import update_rows
 
-def customer_menu(conn: psycopg.Connection, menu: callable):
+CUSTOMER_COLUMNS = ("id", "customer_name", "customer_email", "customer_phone", "total_spend")
+
+INSERT_CUSTOMER = registry.register("customers.insert", "INSERT INTO customers (customer_name, customer_email, customer_phone) VALUES (%s, %s, %s) RETURNING id")
+DELETE_CUSTOMER = registry.register("customers.delete", "DELETE FROM customers WHERE id = %s")
+ADD_SPEND = registry.register("customers.add_spend", "UPDATE customers SET total_spend = total_spend + %s WHERE id = %s")
+# Prices each item name at the product with the lowest ID for it, as the order paths do.
+ADD_ITEMS_SPEND = registry.register("customers.add_items_spend", """
+    UPDATE customers SET total_spend = total_spend + (
+        SELECT COALESCE(SUM(product.price * line.qty), 0)
+        FROM unnest(%s::text[], %s::int[]) AS line(name, qty)
+        JOIN LATERAL (SELECT price FROM products WHERE name = line.name ORDER BY id LIMIT 1) product ON true)
+    WHERE id = %s""")
+
+class CustomerCache:
     """
-    Menu for managing customers in the database.
+    Process-local LRU map from normalized email to customer ID.
 
-    Args:
-        conn (psycopg.Connection): A connection to the PostgreSQL database.
-        menu (function): The function to call to go back to the main menu.
-
-    This function provides a menu for managing customers in the database. The
-    user can view all customers, add a new customer, delete a customer or update
-    a customer. The user can also go back to the main menu by selecting option 0.
-    """
-    while True:
-        opt = int(input("\n\n1. View customers\n2. Add customer\n3. Delete customer\n4. Update customer\n0. Main menu\n"))
-
-        if opt == 1:
-            view_customers(conn)
-
-        elif opt == 2:
-            name = input("Customer name: ")
-            email = input("Customer email: ")
-            phone = input("Customer phone: ")
-            add_customer(conn, name, email, phone)
-
-        elif opt == 3:
-            id = input("Customer Id to delete: ")
-            delete_customer(conn, id)
-
-        elif opt == 4:
-            id = input("Customer Id to update: ")
-            choice = input("Would you like to update the name? (y/n): ").lower()
-            if choice == 'y':
-                new_name = input("New name: ")
-            else:
-                new_name = ""
-            choice = input("Would you like to update the email? (y/n): ").lower()
-            if choice == 'y':
-                email = input("Customer email: ")
-            else:
-                email = ""
-            choice = input("Would you like to update the phone? (y/n): ").lower()
-            if choice == 'y':
-                phone = input("Customer phone: ")
-            else:
-                phone = ""
-            update_customer(conn, id, email, phone, new_name)
-
-        elif opt == 0:
-            os.system('cls')
-            menu(conn)
+    Saves a round-trip when the same customer orders again. Entries are dropped
+    by update_customer and delete_customer in this process; changes made by other
+    processes are not seen, so keep the cache small on shared deployments or
+    disable it with CUSTOMER_CACHE_SIZE=0.
+    """
 
-        else:
-            print("Invalid option!")
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.ids = OrderedDict()
+        self.emails = {}
+        self.lock = threading.Lock()
+
+    def get(self, email: str):
+        """Return the cached customer ID for a normalized email, or None."""
+        with self.lock:
+            id = self.ids.get(email)
+            if id is not None:
+                self.ids.move_to_end(email)
+            return id
+
+    def put(self, email: str, id: int):
+        """Remember the customer ID for a normalized email, evicting the least recently used entry if full."""
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.ids[email] = id
+            self.ids.move_to_end(email)
+            self.emails[id] = email
+            while len(self.ids) > self.maxsize:
+                old_email, old_id = self.ids.popitem(last=False)
+                self.emails.pop(old_id, None)
+
+    def invalidate(self, id: int):
+        """Forget the entry for a customer ID."""
+        with self.lock:
+            email = self.emails.pop(id, None)
+            if email is not None:
+                self.ids.pop(email, None)
+
+    def clear(self):
+        """Forget every entry."""
+        with self.lock:
+            self.ids.clear()
+            self.emails.clear()
+
+customer_cache = CustomerCache(int(os.getenv('CUSTOMER_CACHE_SIZE', 10000)))
+
+def normalize_email(email: str):
+    """Return the email in the form it is stored and indexed in: trimmed and lower case."""
+    return email.strip().lower()
+
+def prompt_add_customer(conn: psycopg.Connection):
+    """Ask for the details of a new customer and add them."""
+    name = input("Customer name: ")
+    email = input("Customer email: ")
+    phone = input("Customer phone: ")
+    if add_customer(conn, name, email, phone) is None:
+        print("\nA customer with this email already exists!\n")
+    else:
+        print("\nCustomer created!\n")
+
+def prompt_delete_customer(conn: psycopg.Connection):
+    """Ask which customer to delete and delete them."""
+    id = input("Customer Id to delete: ")
+    delete_customer(conn, id)
+
+def prompt_update_customer(conn: psycopg.Connection):
+    """Ask which customer to update and which of their details to change, then update them."""
+    id = input("Customer Id to update: ")
+    choice = input("Would you like to update the name? (y/n): ").lower()
+    if choice == 'y':
+        new_name = input("New name: ")
+    else:
+        new_name = ""
+    choice = input("Would you like to update the email? (y/n): ").lower()
+    if choice == 'y':
+        email = input("Customer email: ")
+    else:
+        email = ""
+    choice = input("Would you like to update the phone? (y/n): ").lower()
+    if choice == 'y':
+        phone = input("Customer phone: ")
+    else:
+        phone = ""
+    update_customer(conn, id, email, phone, new_name)
 
 def view_customers(conn: psycopg.Connection):
     """
@@ -62,17 +118,32 @@ def view_customers(conn: psycopg.Connection):
     Args:
         conn (psycopg.Connection): A connection to the PostgreSQL database.
 
-    This function fetches all customer records from the database and displays
-    them in a formatted table with columns for ID, Name, Email, Phone, and Spending.
+    This function fetches the customer records from the database one page at a
+    time and displays them in a formatted table with columns for ID, Name, Email, Phone, and Spending.
     The table headers and each row are left-aligned.
     """
 
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM customers")    
-        rows = cursor.fetchall()
-        print(f"""\n\n{'ID':<5}{'Name':<25}{'Email':<28}{'Phone':<11}{'Spending':<10}\n{'-'*100}""")
-        for x in rows:
-            print(f"{x[0]}. |{x[1]:<25} |{x[2]:<25} |{x[3]:<11} |£{x[4]:<10}")
+    browse(lambda **page: list_customers(conn, **page), show_customers)
+
+def show_customers(rows: list):
+    """Print a page of customers as a table with columns for ID, Name, Email, Phone, and Spending."""
+    print(f"""\n\n{'ID':<5}{'Name':<25}{'Email':<28}{'Phone':<11}{'Spending':<10}\n{'-'*100}""")
+    for x in rows:
+        print(f"{x[0]}. |{x[1]:<25} |{x[2]:<25} |{x[3]:<11} |£{x[4]:<10}")
+
+def list_customers(conn: psycopg.Connection, after: int = None, before: int = None, limit: int = None):
+    """
+    Retrieve customers from the database, optionally one page at a time.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        after (int): Only return rows with an ID greater than this one.
+        before (int): Only return rows with an ID less than this one.
+        limit (int): The maximum number of rows to return. If None, all rows are returned.
+
+    Returns a list of rows sorted by ID, with the fields named in CUSTOMER_COLUMNS.
+    """
+    return keyset_page(conn, "SELECT id, customer_name, customer_email, customer_phone, total_spend FROM customers", after=after, before=before, limit=limit, name="customers.list")
 
 def add_customer(conn: psycopg.Connection, customer_name: str, customer_email: str, customer_phone: str):
     """
@@ -85,13 +156,19 @@ def add_customer(conn: psycopg.Connection, customer_name: str, customer_email: s
         customer_phone (str): The phone number of the customer to be added.
 
     Inserts the customer with the given name, email, and phone number into the customers table, and commits the
-    changes to the database. If the customer is not found, an error message is printed.
+    changes to the database. Returns the new customer's ID, or None if a customer with the same email already
+    exists; nothing is printed, so callers report the outcome their own way.
     """
     with conn.cursor() as cursor:
-        cursor.execute("INSERT INTO customers (customer_name, customer_email, customer_phone) VALUES (%s, %s, %s)", (customer_name.title(), customer_email, customer_phone))
-        conn.commit()
+        try:
+            registry.execute(cursor, INSERT_CUSTOMER, (customer_name.title(), normalize_email(customer_email), customer_phone))
+            id = cursor.fetchone()[0]
+            conn.commit()
+        except psycopg.errors.UniqueViolation:
+            conn.rollback()
+            return None
 
-    print("\nCustomer created!\n")
+    return id
 
 def delete_customer(conn: psycopg.Connection, customer_id: int):
     """
@@ -106,12 +183,13 @@ def delete_customer(conn: psycopg.Connection, customer_id: int):
     """
 
     with conn.cursor() as cursor:
-        cursor.execute("DELETE FROM customers WHERE id = %s", (customer_id,))
+        registry.execute(cursor, DELETE_CUSTOMER, (customer_id,))
         if cursor.rowcount == 0:
             print("Error! Customer not found! Try again!")
             return
         else:
             conn.commit()
+            customer_cache.invalidate(int(customer_id))
 
     print("\nCustomer deleted.\n")
 
@@ -126,23 +204,47 @@ def update_customer(conn: psycopg.Connection, id: int, email: str, phone: str, n
         phone (str): The new phone number of the customer to be updated.
         new_name (str): The new name of the customer to be updated.
 
-    Updates the customer with the given ID in the customers table, and commits the
-    changes to the database. If the customer is not found, an error message is printed.
+    The changed fields are written with one UPDATE, which also tells whether the customer
+    exists, and the changes are committed to the database. If the customer is not found,
+    or the new email belongs to another customer, an error message is printed.
     """
-    with conn.cursor() as cursor:
-        if len(email) > 0:
-            cursor.execute("UPDATE customers SET customer_email = %s WHERE id = %s", (email, id))
-        if len(phone) > 0:
-            cursor.execute("UPDATE customers SET customer_phone = %s WHERE id = %s", (phone, id))
-        if len(new_name) > 0:
-            cursor.execute("UPDATE customers SET customer_name = %s WHERE id = %s", (new_name, id))
+    try:
+        updated = update_customers(conn, [(id, {"customer_email": email, "customer_phone": phone, "customer_name": new_name})])
+    except psycopg.errors.UniqueViolation:
+        print("\nA customer with this email already exists!\n")
+        return
 
-        if cursor.rowcount == 0:
-            print("Error! Customer not found! Try again!")
-            return
-        else:
-            conn.commit()
-            print("\nCustomer updated.\n")
+    if updated[0]:
+        print("\nCustomer updated.\n")
+    else:
+        print("Error! Customer not found! Try again!")
+
+def update_customers(conn: psycopg.Connection, edits: list):
+    """
+    Update several customers in one transaction and one round-trip.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        edits (list): (id, fields) pairs, where fields is a dict with any of the
+            keys customer_name, customer_email and customer_phone. Empty strings
+            and None leave a field unchanged.
+
+    Emails are normalized. Every edit is sent in pipeline mode through
+    updates.update_rows, nothing is changed if any edit fails, and the updated
+    customers are dropped from customer_cache. Returns a list of booleans
+    telling whether each customer was found.
+    """
+    changes = []
+    for id, fields in edits:
+        fields = {column: None if fields.get(column) == "" else fields.get(column) for column in ("customer_name", "customer_email", "customer_phone")}
+        if fields["customer_email"]:
+            fields["customer_email"] = normalize_email(fields["customer_email"])
+        changes.append((int(id), fields))
+
+    rows = update_rows(conn, "customers", changes)
+    for id, fields in changes:
+        customer_cache.invalidate(id)
+    return [row is not None for row in rows]
 
 def update_spend(conn: psycopg.Connection, id: int, items: list):
     """
@@ -154,24 +256,25 @@ def update_spend(conn: psycopg.Connection, id: int, items: list):
         items (list of str): A list of item names representing the products purchased by the customer.
 
     This function calculates the total spend for the given items by summing their prices
-    from the products table. It then updates the customer's total spend and increments
+    from the product catalogue cache. It then updates the customer's total spend and increments
     the number of orders in the customers table. The changes are committed to the database.
     """
 
     totalspend = 0
+    for item in items:
+        product = catalog.by_name(conn, item.title())
+        if product:
+            totalspend += product[2]
+
     with conn.cursor() as cursor:
-        for item in items:
-            cursor.execute(
-                "SELECT price FROM products WHERE name = %s",
-                (item.title(),)
-            )
-            rows = cursor.fetchall()
-            for x in rows:
-                totalspend += x[0]
-
-        cursor.execute(
-            "UPDATE customers SET total_spend = total_spend + %s WHERE id = %s",
-            (totalspend, id,)
-        )
+        registry.execute(cursor, ADD_SPEND, (totalspend, id))
             
-        conn.commit()
\ No newline at end of file
+        conn.commit()
+
+CUSTOMER_COMMANDS = [
+    ("View customers", view_customers),
+    ("Search customers", prompt_search_customers),
+    ("Add customer", prompt_add_customer),
+    ("Delete customer", prompt_delete_customer),
+    ("Update customer", prompt_update_customer),
+]
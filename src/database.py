@@ -1,7 +1,10 @@
 import psycopg
+from migrations import migrate
+
+OPEN_STATUSES = ("preparing", "ready")
 
 def create_database(conn: psycopg.Connection):
-    """Create the tables in the PostgreSQL database if they don't already exist.
+    """Create the tables in the PostgreSQL database if they don't already exist, then apply any pending migrations.
 
     Args:
         conn (psycopg2.extensions.connection): A connection to the PostgreSQL database.
@@ -13,4 +16,6 @@ def create_database(conn: psycopg.Connection):
     cur.execute("CREATE TABLE IF NOT EXISTS customers (id SERIAL PRIMARY KEY, customer_name VARCHAR(255), customer_email VARCHAR(255), customer_phone VARCHAR(255), total_spend DECIMAL DEFAULT 0)")
     cur.execute("CREATE TABLE IF NOT EXISTS couriers (id SERIAL PRIMARY KEY, name VARCHAR(255))")
 
-    conn.commit()
\ No newline at end of file
+    conn.commit()
+
+    migrate(conn)
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import psycopg
+
+class Menu:
+    """
+    A screen of numbered commands.
+
+    Args:
+        title (str): The name of the menu.
+        commands (list): (label, target) pairs, numbered from 1 in order. A target
+            is either the name of another menu to open or a function that is
+            called with the connection, or with the storage for the till menus.
+        art (str): Optional ASCII art shown when the menu is opened.
+        on_open (function): Optional function called with the connection each
+            time the menu is opened, e.g. to start loading what its commands need.
+    """
+
+    def __init__(self, title: str, commands: list, art: str = None, on_open: callable = None):
+        self.title = title
+        self.commands = commands
+        self.art = art
+        self.on_open = on_open
+
+    def prompt(self, back: str):
+        """Return the text listing the commands, with option 0 labelled `back`."""
+        lines = [f"{number}. {label}" for number, (label, target) in enumerate(self.commands, start=1)]
+        return "\n\n" + "\n".join(lines) + f"\n0. {back}\n"
+
+def clear_screen():
+    """Clear the terminal."""
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+def run(conn, menus: dict, start: str = "main", interactive: bool = True):
+    """
+    Run the menus until the user leaves the first one.
+
+    Args:
+        conn: A connection to the PostgreSQL database, or a storage.Storage,
+            handed to every command. Either has a rollback method.
+        menus (dict): Menu objects by name.
+        start (str): The name of the first menu.
+        interactive (bool): If False, the screen is never cleared, which suits
+            commands scripted through standard input.
+
+    Opening a sub-menu pushes it onto a navigation stack and option 0 pops it, so
+    moving between menus never grows the Python call stack. Input is read with
+    input(), so the same commands can be replayed from a file. The run ends when
+    the first menu is left or the input runs out. If a command fails on a
+    database error, its transaction is rolled back and the menu carries on.
+    """
+    stack = [start]
+
+    def open_menu(name):
+        if interactive:
+            clear_screen()
+        if menus[name].art:
+            print(menus[name].art)
+        if menus[name].on_open is not None:
+            menus[name].on_open(conn)
+
+    open_menu(start)
+
+    while stack:
+        menu = menus[stack[-1]]
+        try:
+            line = input(menu.prompt("Exit" if len(stack) == 1 else "Back"))
+        except EOFError:
+            break
+
+        try:
+            opt = int(line)
+        except ValueError:
+            print("Invalid option!")
+            continue
+
+        if opt == 0:
+            stack.pop()
+            if stack:
+                open_menu(stack[-1])
+        elif 1 <= opt <= len(menu.commands):
+            target = menu.commands[opt - 1][1]
+            if isinstance(target, str):
+                stack.append(target)
+                open_menu(target)
+            else:
+                try:
+                    target(conn)
+                except ValueError:
+                    print("\nInvalid input! Try again!\n")
+                except (psycopg.Error, sqlite3.Error) as e:
+                    conn.rollback()
+                    print(f"\nDatabase error: {e}\n")
+        else:
+            print("Invalid option!")
@@ -0,0 +1,203 @@
+import argparse
+import json
+import time
+import psycopg
+from connection import connect, get_conninfo
+from queries import registry
+
+CHANNEL = "order_events"
+EVENT_COLUMNS = ("seq", "occurred_at", "kind", "order_id", "payload")
+BATCH_SIZE = 1000
+# A missing sequence number is only taken to belong to a transaction that rolled
+# back once every transaction running when it was first missed has ended, and
+# at least GAP_TIMEOUT seconds have passed. Also how long a tail waits between
+# checks when no notification arrives.
+GAP_TIMEOUT = 1.0
+WAIT_TIMEOUT = 1.0
+GAP_RETRY = 0.01
+
+READ_EVENTS = registry.register("order_events.read", "SELECT seq, occurred_at, kind, order_id, payload FROM order_events WHERE seq > %s ORDER BY seq LIMIT %s")
+READ_MISSING = registry.register("order_events.read_missing", "SELECT seq, occurred_at, kind, order_id, payload FROM order_events WHERE seq = ANY(%s) ORDER BY seq")
+ORDER_HISTORY = registry.register("order_events.by_order", "SELECT seq, occurred_at, kind, order_id, payload FROM order_events WHERE order_id = %s ORDER BY seq")
+LATEST_SEQ = registry.register("order_events.latest", "SELECT COALESCE(MAX(seq), 0) FROM order_events")
+SNAPSHOT = registry.register("order_events.snapshot", """
+    SELECT pg_snapshot_xmin(snapshot)::text::bigint, pg_snapshot_xmax(snapshot)::text::bigint FROM pg_current_snapshot() snapshot""")
+PRUNE_EVENTS = registry.register("order_events.prune", "DELETE FROM order_events WHERE occurred_at < now() - make_interval(days => %s)")
+
+def read_events(conn: psycopg.Connection, after: int = 0, limit: int = BATCH_SIZE):
+    """
+    Retrieve the events after a sequence number from the order_events outbox.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        after (int): Only return events with a sequence number greater than this one.
+        limit (int): The maximum number of events to return.
+
+    Events are written by triggers on orders, order_items, products and
+    customers, in the same transaction as the change they record, so every
+    write is recorded whichever function made it. Returns a list of rows with
+    the fields named in EVENT_COLUMNS, oldest first.
+    """
+    with conn.cursor() as cursor:
+        registry.execute(cursor, READ_EVENTS, (after, limit))
+        return cursor.fetchall()
+
+def order_history(conn: psycopg.Connection, order_id: int):
+    """Return every event recorded for one order, oldest first."""
+    with conn.cursor() as cursor:
+        registry.execute(cursor, ORDER_HISTORY, (order_id,))
+        return cursor.fetchall()
+
+def latest_seq(conn: psycopg.Connection):
+    """Return the sequence number of the newest event, to tail only the changes from now on."""
+    with conn.cursor() as cursor:
+        registry.execute(cursor, LATEST_SEQ)
+        return cursor.fetchone()[0]
+
+def prune_events(conn: psycopg.Connection, days: int):
+    """
+    Delete events older than a number of days.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        days (int): Events older than this are deleted.
+
+    Consumers that have fallen further behind than this will miss the deleted
+    events. Returns the number of events deleted.
+    """
+    with conn.cursor() as cursor:
+        registry.execute(cursor, PRUNE_EVENTS, (days,))
+        deleted = cursor.rowcount
+    conn.commit()
+    return deleted
+
+class EventFeed:
+    """
+    A consumer's position in the order_events log.
+
+    Sequence numbers are handed out when an event is written but become visible
+    when its transaction commits, so a lower number can appear after a higher
+    one. The feed reads forward from the highest number it has seen, remembers
+    the numbers it skipped over, and looks those up again on each poll, so a
+    late commit is delivered when it appears rather than skipped, and each
+    event is handed out once.
+
+    A missing number may belong to a transaction that is still running, e.g.
+    one waiting on a lock, however long that takes. So the feed notes the
+    first transaction ID not yet assigned when a gap is first seen again, and
+    only gives up on the number once the oldest running transaction is past
+    it, i.e. every transaction that could hold the number has committed or
+    rolled back, and GAP_TIMEOUT has passed. `position` is the number below
+    which every event has been handed out or given up on, to resume from.
+    """
+
+    def __init__(self, after: int = 0):
+        self.position = after
+        self.high = after
+        self.gaps = {}
+
+    def poll(self, conn: psycopg.Connection):
+        """
+        Read the events that have not been handed out yet.
+
+        Args:
+            conn (psycopg.Connection): A connection to the PostgreSQL database,
+                in autocommit mode so that each poll sees the transactions
+                running now.
+
+        Returns a list of new events, with the fields named in EVENT_COLUMNS,
+        in sequence order.
+        """
+        late = []
+        with conn.cursor() as cursor:
+            if self.gaps:
+                registry.execute(cursor, READ_MISSING, (list(self.gaps),))
+                late = cursor.fetchall()
+                for row in late:
+                    del self.gaps[row[0]]
+
+        rows = read_events(conn, self.high, BATCH_SIZE)
+        now = time.monotonic()
+        expected = self.high + 1
+        for row in rows:
+            for seq in range(expected, row[0]):
+                self.gaps[seq] = [now, None]
+            expected = row[0] + 1
+        if rows:
+            self.high = rows[-1][0]
+
+        if self.gaps:
+            with conn.cursor() as cursor:
+                registry.execute(cursor, SNAPSHOT)
+                xmin, xmax = cursor.fetchone()
+            for seq, gap in list(self.gaps.items()):
+                # Noted from the next poll on, so a transaction that had taken
+                # its number but not yet its ID when the gap was seen is covered.
+                if gap[1] is None:
+                    if gap[0] < now:
+                        gap[1] = xmax
+                elif xmin >= gap[1] and now - gap[0] >= GAP_TIMEOUT:
+                    del self.gaps[seq]
+
+        self.position = min(self.gaps) - 1 if self.gaps else self.high
+        return sorted(late + rows) if late else rows
+
+    @property
+    def waiting(self):
+        """
+        Whether a new gap still has to be noted, so the feed should be polled again soon.
+
+        Once noted, a late commit to fill a gap wakes the tail with its own
+        notification, so the tail only needs to check back every WAIT_TIMEOUT.
+        """
+        return any(gap[1] is None for gap in self.gaps.values())
+
+def tail_events(conninfo: str, after: int = 0):
+    """
+    Follow the order_events log as it grows.
+
+    Args:
+        conninfo (str): The connection string for the tail's own connection.
+        after (int): Start after this sequence number, e.g. the last one the
+            consumer processed, or latest_seq for new events only.
+
+    A generator that yields each event, with the fields named in EVENT_COLUMNS,
+    as soon as it is committed. The triggers that write events also notify the
+    order_events channel, so between batches the tail sleeps on LISTEN rather
+    than polling the table, and wakes within milliseconds of a commit. It also
+    checks every WAIT_TIMEOUT seconds, in case a notification arrived while it
+    was reading. Runs until the consumer stops iterating.
+    """
+    feed = EventFeed(after)
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute(f"LISTEN {CHANNEL}")
+        while True:
+            events = feed.poll(conn)
+            yield from events
+            if len(events) < BATCH_SIZE:
+                for notify in conn.notifies(timeout=GAP_RETRY if feed.waiting else WAIT_TIMEOUT, stop_after=1):
+                    pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Order event log")
+    commands = parser.add_subparsers(dest="command", required=True)
+    tail = commands.add_parser("tail", help="print events as JSON lines as they happen")
+    tail.add_argument("--after", type=int, help="start after this sequence number (default: only new events)")
+    prune = commands.add_parser("prune", help="delete old events")
+    prune.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        if args.command == "prune":
+            print(f"Deleted {prune_events(conn, args.days)} event(s)")
+            exit()
+        after = args.after if args.after is not None else latest_seq(conn)
+    finally:
+        conn.close()
+
+    try:
+        for event in tail_events(get_conninfo(), after):
+            print(json.dumps(dict(zip(EVENT_COLUMNS, event)), default=str), flush=True)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,211 @@
+import argparse
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import psycopg
+from psycopg import sql
+from connection import connect
+
+try:
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa_csv = None
+    pq = None
+
+EXPORT_TABLES = ("orders", "order_items", "products", "couriers", "customers")
+WATERMARK_FILE = ".export_watermarks.json"
+
+# The point an incremental export can safely resume from: the start of the
+# oldest transaction still running in this database, as updated_at and
+# deleted_at are set to now(), the start time of the writing transaction. A
+# transaction that started before the export and commits after its snapshot is
+# then picked up by the next export.
+EXPORT_WATERMARK = """SELECT LEAST(now(), (SELECT MIN(xact_start) FROM pg_stat_activity
+                                         WHERE datname = current_database() AND pid <> pg_backend_pid()))"""
+
+def read_watermarks(directory: str):
+    """Return the last export time of each table in a directory, as stored by write_watermarks."""
+    path = os.path.join(directory, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return {table: datetime.fromisoformat(value) for table, value in json.load(file).items()}
+
+def write_watermarks(directory: str, watermarks: dict):
+    """Store the last export time of each table in a directory."""
+    path = os.path.join(directory, WATERMARK_FILE)
+    with open(path, "w") as file:
+        json.dump({table: value.isoformat() for table, value in watermarks.items()}, file, indent=2)
+
+def copy_to_csv(cursor: psycopg.Cursor, query: sql.Composable, params: tuple, path: str):
+    """
+    Stream the result of a query straight into a CSV file with COPY ... TO STDOUT.
+
+    Args:
+        cursor (psycopg.Cursor): A cursor on the connection to export from.
+        query (sql.Composable): The SELECT statement to export.
+        params (tuple): The parameters of the query.
+        path (str): The CSV file to write. A path ending in .gz is gzip-compressed.
+
+    The rows are never held in memory; each chunk Postgres sends is written to the
+    file as it arrives. Returns the number of rows written.
+    """
+    copy = sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)").format(query)
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wb") as file:
+        with cursor.copy(copy, params) as stream:
+            for chunk in stream:
+                file.write(chunk)
+    return cursor.rowcount
+
+def csv_to_parquet(csv_path: str, parquet_path: str):
+    """
+    Convert a CSV export to a zstd-compressed Parquet file block by block.
+
+    Args:
+        csv_path (str): The CSV file to read.
+        parquet_path (str): The Parquet file to write.
+
+    Needs the optional pyarrow package.
+    """
+    if pq is None:
+        raise ImportError("Parquet export needs pyarrow. Install it with: pip install pyarrow")
+
+    reader = pa_csv.open_csv(csv_path)
+    with pq.ParquetWriter(parquet_path, reader.schema, compression="zstd") as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+def export_table(table: str, snapshot: str, since: datetime, path: str, fmt: str):
+    """
+    Export one table on its own connection.
+
+    Args:
+        table (str): The table to export.
+        snapshot (str): A snapshot ID from pg_export_snapshot, so every table is
+            read as of the same moment.
+        since (datetime): Only rows changed at or after this time are exported,
+            and the keys of rows deleted since then are written to a second
+            file, <path>_deleted. If None, the whole table is exported.
+        path (str): The file to write, without extension.
+        fmt (str): "csv" or "parquet".
+
+    Returns a (table, rows, seconds) tuple.
+    """
+    start = time.perf_counter()
+    conn = connect()
+    try:
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("SET TRANSACTION SNAPSHOT {}").format(sql.Literal(snapshot)))
+
+            query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table))
+            params = ()
+            outputs = [path]
+            if since is not None:
+                query = sql.SQL("{} WHERE updated_at >= %s").format(query)
+                params = (since,)
+                copy_to_csv(
+                    cursor,
+                    sql.SQL("SELECT row_key, deleted_at FROM export_deletions WHERE table_name = %s AND deleted_at >= %s ORDER BY id"),
+                    (table, since), path + "_deleted.csv"
+                )
+                outputs.append(path + "_deleted")
+
+            rows = copy_to_csv(cursor, query, params, path + ".csv")
+        conn.rollback()
+    finally:
+        conn.close()
+
+    if fmt == "parquet":
+        for output in outputs:
+            csv_to_parquet(output + ".csv", output + ".parquet")
+            os.remove(output + ".csv")
+
+    return table, rows, time.perf_counter() - start
+
+def export_tables(directory: str = "csv", tables: tuple = EXPORT_TABLES, incremental: bool = False, fmt: str = "csv"):
+    """
+    Export database tables to files, each table streamed concurrently on its own connection.
+
+    Args:
+        directory (str): The folder to write the files to.
+        tables (tuple of str): The tables to export.
+        incremental (bool): If True, only rows changed since the last export to
+            this directory are written, and the new watermark is saved.
+        fmt (str): "csv", or "parquet" for compressed Parquet files (needs pyarrow).
+
+    A coordinating connection exports a REPEATABLE READ snapshot that every
+    worker attaches to, so the files are consistent with each other. Incremental
+    exports resume from EXPORT_WATERMARK of the previous export, so rows written
+    by transactions that were still running at the time are not missed, though a
+    row may appear in two consecutive exports. They also write the keys of rows
+    deleted since then. Returns a list of (table, rows, seconds) tuples.
+    """
+    if fmt == "parquet" and pq is None:
+        raise ImportError("Parquet export needs pyarrow. Install it with: pip install pyarrow")
+
+    os.makedirs(directory, exist_ok=True)
+    watermarks = read_watermarks(directory) if incremental else {}
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H%M%S' if incremental else '%Y-%m-%d')
+    suffix = "_incremental" if incremental else ""
+
+    coordinator = connect()
+    try:
+        coordinator.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        with coordinator.cursor() as cursor:
+            cursor.execute("SELECT pg_export_snapshot()")
+            snapshot = cursor.fetchone()[0]
+            cursor.execute(EXPORT_WATERMARK)
+            exported_at = cursor.fetchone()[0]
+
+        with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+            jobs = []
+            for table in tables:
+                since = watermarks.get(table)
+                path = os.path.join(directory, f"{table}_{timestamp}{suffix}")
+                jobs.append(executor.submit(export_table, table, snapshot, since, path, fmt))
+            results = [job.result() for job in jobs]
+    finally:
+        coordinator.rollback()
+        coordinator.close()
+
+    if incremental:
+        watermarks.update({table: exported_at for table in tables})
+        write_watermarks(directory, watermarks)
+
+    return results
+
+def prompt_export(conn: psycopg.Connection):
+    """
+    Ask how to export, then export every table to the csv folder.
+
+    Args:
+        conn (psycopg.Connection): The menu's connection. Not used, as each table
+            is exported on its own connection.
+    """
+    incremental = input("Only export changes since the last export? (y/n): ").lower() == 'y'
+    fmt = "parquet" if input("Export as compressed Parquet instead of CSV? (y/n): ").lower() == 'y' else "csv"
+    try:
+        results = export_tables('csv', incremental=incremental, fmt=fmt)
+    except ImportError as e:
+        print(f"\n{e}\n")
+        return
+    for table, rows, seconds in results:
+        print(f"{table:<15}{rows:>10} rows  {seconds:.2f}s")
+    print("\nData exported!\n")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the cafe database to CSV or Parquet files")
+    parser.add_argument("--directory", default="csv")
+    parser.add_argument("--tables", nargs="+", default=list(EXPORT_TABLES))
+    parser.add_argument("--incremental", action="store_true", help="only export rows changed since the last export")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    args = parser.parse_args()
+
+    for table, rows, seconds in export_tables(args.directory, tuple(args.tables), args.incremental, args.format):
+        print(f"{table:<15}{rows:>10} rows  {seconds:.2f}s")
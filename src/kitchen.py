@@ -0,0 +1,413 @@
+import argparse
+import heapq
+import json
+import threading
+import time
+from datetime import datetime
+import psycopg
+from catalog import CHANNEL
+from connection import get_conninfo
+from dispatcher import clear_screen
+from events import tail_events
+from orders import update_orders_status
+from queries import registry
+
+DEFAULT_PREP_SECONDS = 60
+BATCH_SIZE = 3
+DISPLAY_LIMIT = 15
+# Each second an order waits counts against AGING_RATE seconds of its prep
+# time, so a long order moves up the queue as it ages instead of waiting
+# behind a stream of quick ones.
+AGING_RATE = 0.5
+REFRESH_SECONDS = 1.0
+LOAD_TIMEOUT = 10.0
+# The load replays the events of at least this many seconds, and of every
+# transaction still running, so an event whose transaction commits after the
+# load's snapshot is not skipped.
+RESUME_WINDOW = 60
+
+LOAD_PRODUCTS = registry.register("kitchen.load_products", "SELECT id, name, prep_seconds FROM products")
+LOAD_PREPARING = registry.register("kitchen.load_preparing", """
+    SELECT o.id, o.created_at, COALESCE(SUM(i.qty * p.prep_seconds), 0), COALESCE(string_agg(i.qty || ' x ' || p.name, ', ' ORDER BY p.name), '')
+    FROM orders o
+    LEFT JOIN order_items i ON i.order_id = o.id
+    LEFT JOIN products p ON p.id = i.product_id
+    WHERE o.status = 'preparing'
+    GROUP BY o.id, o.created_at""")
+RESUME_POINT = registry.register("kitchen.resume_point", """
+    SELECT COALESCE((
+        SELECT seq FROM order_events
+        WHERE occurred_at <= LEAST(now() - make_interval(secs => %s),
+                                   (SELECT MIN(xact_start) FROM pg_stat_activity WHERE backend_xid IS NOT NULL))
+        ORDER BY seq DESC LIMIT 1), 0)""")
+RECENT_EVENTS = registry.register("kitchen.recent_events", "SELECT seq FROM order_events WHERE seq > %s")
+SET_PREP_SECONDS = registry.register("products.set_prep_seconds", "UPDATE products SET prep_seconds = %s WHERE id = %s RETURNING id, name, prep_seconds")
+
+class KitchenQueue:
+    """
+    In-memory priority queue of the orders being prepared.
+
+    Orders are ranked by their estimated prep time less AGING_RATE times how
+    long they have waited. Taking the shortest job first minimizes the mean
+    wait, and the aging term stops long orders from starving. Every order's
+    age grows at the same rate, so the rank of two orders never changes while
+    they wait, and each order only needs its heap entry recomputed when its
+    items change. Stale heap entries are skipped lazily, as in the courier
+    balancer, and the heap is rebuilt once most of it is stale.
+
+    The queue loads the preparing orders once, then follows the order_events
+    log, so new orders, added items and status changes arrive within
+    milliseconds of their commit without polling the orders table. The names
+    and prep times of products are followed in the same way on the
+    products_changed channel, so a prep time set anywhere, or a product added
+    after the load, applies to the next items added. All methods are safe to
+    call from several threads.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.orders = {}
+        self.taken = set()
+        self.products = {}
+        self.products_live = False
+        self.replayed = set()
+        self.version = 0
+        self.ready = False
+        self.changed = threading.Condition()
+        self.thread = None
+
+    def listen(self, conninfo: str):
+        """
+        Start the background listener that loads the queue and keeps it up to date.
+
+        Args:
+            conninfo (str): The connection string for the listener's own connections.
+
+        If the connection drops, or an event cannot be applied, the queue is
+        marked stale and reloaded from the database once the listener
+        reconnects. A second thread follows product changes.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, args=(conninfo,), daemon=True)
+        self.thread.start()
+        threading.Thread(target=self.follow_products, args=(conninfo,), daemon=True).start()
+
+    def run(self, conninfo: str):
+        """Body of the listener thread: load the queue, then apply order events until the connection drops."""
+        while True:
+            try:
+                with psycopg.connect(conninfo) as conn:
+                    after = self.load(conn)
+                for event in tail_events(conninfo, after):
+                    self.apply(event)
+            except Exception:
+                # Any failure, not only a lost connection, leaves the queue
+                # behind the log, so live views are told and it is reloaded.
+                with self.changed:
+                    self.ready = False
+                    self.touch()
+                time.sleep(1)
+
+    def follow_products(self, conninfo: str):
+        """
+        Body of the products listener thread: keep product names and prep times current.
+
+        Args:
+            conninfo (str): The connection string for the listener's own connection.
+
+        Subscribes to products_changed before loading the products, so no
+        change slips in between, as the product catalogue does. While this
+        listener is not connected, load refreshes the products instead.
+        """
+        while True:
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    with conn.cursor() as cursor:
+                        registry.execute(cursor, LOAD_PRODUCTS)
+                        products = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+                    with self.changed:
+                        self.products = products
+                        self.products_live = True
+                    for notify in conn.notifies():
+                        self.product_changed(json.loads(notify.payload))
+            except Exception:
+                with self.changed:
+                    self.products_live = False
+                time.sleep(1)
+
+    def load(self, conn: psycopg.Connection):
+        """
+        Replace the queue with the orders preparing now.
+
+        Args:
+            conn (psycopg.Connection): A connection to the PostgreSQL database.
+
+        The orders and prep times are read in one REPEATABLE READ snapshot.
+        A transaction can take a lower sequence number than an event in the
+        snapshot and still commit after it, so the log is followed from the
+        last event before RESUME_WINDOW and before the oldest running
+        transaction started, rather than from the newest event. The events
+        after that point that are already in the snapshot are noted, and
+        skipped by apply when the tail hands them out again. Returns the
+        sequence number to follow the log from.
+        """
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        with conn.cursor() as cursor:
+            registry.execute(cursor, RESUME_POINT, (RESUME_WINDOW,))
+            after = cursor.fetchone()[0]
+            registry.execute(cursor, RECENT_EVENTS, (after,))
+            replayed = {row[0] for row in cursor.fetchall()}
+            registry.execute(cursor, LOAD_PRODUCTS)
+            products = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+            registry.execute(cursor, LOAD_PREPARING)
+            rows = cursor.fetchall()
+        conn.rollback()
+
+        with self.changed:
+            if not self.products_live:
+                self.products = products
+            self.replayed = replayed
+            self.heap = []
+            self.orders = {}
+            self.taken &= {row[0] for row in rows}
+            for id, created_at, prep, items in rows:
+                self.add(id, created_at.timestamp(), prep, items)
+            self.ready = True
+            self.touch()
+        return after
+
+    def add(self, id: int, created: float, prep: float, items: str):
+        """Queue an order, or requeue it with a new prep time. Call with the lock held."""
+        key = prep + AGING_RATE * created
+        self.orders[id] = (key, created, prep, items)
+        heapq.heappush(self.heap, (key, id))
+
+    def compact(self):
+        """Rebuild the heap from the queued orders, dropping stale entries. Call with the lock held."""
+        self.heap = [(key, id) for id, (key, created, prep, items) in self.orders.items() if id not in self.taken]
+        heapq.heapify(self.heap)
+
+    def touch(self):
+        """Wake up live views after a change. Call with the lock held."""
+        self.version += 1
+        self.changed.notify_all()
+
+    def apply(self, event: tuple):
+        """
+        Apply one order event, as yielded by events.tail_events, to the queue.
+
+        A new order is queued with no prep time, which its items_added event,
+        written in the same transaction, then fills in. An order leaves the
+        queue when it moves on from preparing. Events already reflected in
+        the last load are skipped, so none is applied twice.
+        """
+        seq, occurred_at, kind, order_id, payload = event
+        with self.changed:
+            if seq in self.replayed:
+                self.replayed.discard(seq)
+                return
+            if kind == "order_created" and payload["status"] == "preparing" and order_id not in self.orders:
+                self.add(order_id, datetime.fromisoformat(payload["created_at"]).timestamp(), 0, "")
+            elif kind == "items_added" and order_id in self.orders:
+                key, created, prep, items = self.orders[order_id]
+                lines = []
+                for item in payload["items"]:
+                    name, seconds = self.products.get(item["product_id"], (f"Product {item['product_id']}", DEFAULT_PREP_SECONDS))
+                    prep += item["qty"] * seconds
+                    lines.append(f"{item['qty']} x {name}")
+                self.add(order_id, created, prep, ", ".join(filter(None, [items] + lines)))
+            elif kind == "status_changed" and payload["to"] != "preparing" and order_id in self.orders:
+                del self.orders[order_id]
+                self.taken.discard(order_id)
+                if len(self.heap) > 2 * len(self.orders) + BATCH_SIZE:
+                    self.compact()
+            else:
+                return
+            self.touch()
+
+    def set_prep_seconds(self, id: int, name: str, seconds: int):
+        """Use a product's new prep time for items added from now on."""
+        with self.changed:
+            self.products[id] = (name, seconds)
+
+    def product_changed(self, change: dict):
+        """Apply one products_changed notification to the product names and prep times."""
+        with self.changed:
+            if change["op"] == "DELETE":
+                self.products.pop(change["id"], None)
+            else:
+                self.products[change["id"]] = (change["name"], change["prep_seconds"])
+
+    def wait_ready(self, timeout: float = LOAD_TIMEOUT):
+        """Block until the queue has been loaded, or the timeout passes, and return whether it is loaded."""
+        with self.changed:
+            return self.changed.wait_for(lambda: self.ready, timeout)
+
+    def next_batch(self, size: int = BATCH_SIZE):
+        """
+        Take the next orders for the kitchen to start on.
+
+        Args:
+            size (int): The maximum number of orders to take.
+
+        Taken orders are shown as in progress and are not handed out again.
+        They leave the queue once they are marked ready. Returns a list of
+        (id, waited, prep, items) rows, waited and prep in seconds, in the
+        order to make them.
+        """
+        now = time.time()
+        batch = []
+        with self.changed:
+            while self.heap and len(batch) < size:
+                key, id = heapq.heappop(self.heap)
+                if id in self.taken or self.orders.get(id, (None,))[0] != key:
+                    continue
+                key, created, prep, items = self.orders[id]
+                self.taken.add(id)
+                batch.append((id, now - created, prep, items))
+            if batch:
+                self.touch()
+        return batch
+
+    def snapshot(self, limit: int = DISPLAY_LIMIT):
+        """
+        Return the queue as it stands, without taking anything from it.
+
+        Returns a (waiting, in_progress) tuple of lists of (id, waited, prep,
+        items) rows. Waiting orders come in the order next_batch would hand
+        them out, up to `limit` of them.
+        """
+        now = time.time()
+        with self.changed:
+            waiting = heapq.nsmallest(limit, ((key, id) for id, (key, created, prep, items) in self.orders.items() if id not in self.taken))
+            rows = [(id, now - self.orders[id][1], self.orders[id][2], self.orders[id][3]) for key, id in waiting]
+            in_progress = [(id, now - created, prep, items) for id, (key, created, prep, items) in self.orders.items() if id in self.taken]
+        return rows, sorted(in_progress, key=lambda row: -row[1])
+
+    def wait(self, version: int, timeout: float = REFRESH_SECONDS):
+        """Block until the queue changes after `version` or the timeout passes, and return the current version."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+kitchen = KitchenQueue()
+
+def set_prep_seconds(conn: psycopg.Connection, id: int, seconds: int):
+    """
+    Set how long a product takes to prepare.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        id (int): The ID of the product.
+        seconds (int): The estimated prep time of one of it, in seconds.
+
+    Orders already queued keep their estimate. Returns the (id, name,
+    prep_seconds) row of the product, or None if it does not exist.
+    """
+    with conn.cursor() as cursor:
+        registry.execute(cursor, SET_PREP_SECONDS, (seconds, id))
+        row = cursor.fetchone()
+    conn.commit()
+    if row is not None:
+        kitchen.set_prep_seconds(*row)
+    return row
+
+def minutes(seconds: float):
+    """Format a number of seconds as m:ss."""
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def show_queue(waiting: list, in_progress: list):
+    """Print the kitchen queue as returned by KitchenQueue.snapshot."""
+    print(f"\n{'Next':<6}{'Order':<8}{'Waited':<9}{'Prep':<8}{'Items'}\n{'-'*70}")
+    for n, (id, waited, prep, items) in enumerate(waiting, 1):
+        print(f"{n:<6}{id:<8}{minutes(waited):<9}{minutes(prep):<8}{items}")
+    if in_progress:
+        print(f"\n{'In progress':<14}{'Waited':<9}{'Prep':<8}{'Items'}\n{'-'*70}")
+        for id, waited, prep, items in in_progress:
+            print(f"{id:<14}{minutes(waited):<9}{minutes(prep):<8}{items}")
+    print()
+
+def watch_queue(queue: KitchenQueue = kitchen, limit: int = DISPLAY_LIMIT):
+    """
+    Show the kitchen queue and redraw it as it changes, until Ctrl+C.
+
+    Args:
+        queue (KitchenQueue): The queue to show.
+        limit (int): The number of waiting orders shown.
+
+    The screen is redrawn as soon as the listener applies a change, and once
+    every REFRESH_SECONDS to update the waiting times.
+    """
+    version = -1
+    try:
+        while True:
+            version = queue.wait(version)
+            clear_screen()
+            if not queue.ready:
+                print("\nConnecting to the order events...\n")
+                continue
+            print(f"Kitchen queue, {time.strftime('%H:%M:%S')} (Ctrl+C to leave)")
+            show_queue(*queue.snapshot(limit))
+    except KeyboardInterrupt:
+        print()
+
+def open_kitchen(conn: psycopg.Connection):
+    """Start the kitchen queue's listener when the kitchen menu opens, so it loads while the menu is read."""
+    kitchen.listen(get_conninfo())
+
+def prompt_watch_queue(conn: psycopg.Connection):
+    """Show the live kitchen queue."""
+    watch_queue()
+
+def prompt_next_batch(conn: psycopg.Connection):
+    """Hand out the next orders to make, in the order that keeps waits shortest."""
+    size = input(f"How many orders to start? (Enter for {BATCH_SIZE}): ").strip()
+    if not kitchen.wait_ready():
+        print("\nThe kitchen queue could not be loaded! Try again.\n")
+        return
+    batch = kitchen.next_batch(int(size) if size.isdigit() else BATCH_SIZE)
+    if not batch:
+        print("\nNo orders waiting!\n")
+        return
+    show_queue(batch, [])
+
+def prompt_mark_ready(conn: psycopg.Connection):
+    """Ask for an order ID and mark the order ready, which takes it off the kitchen queue."""
+    id = input("Order ID: ").strip()
+    if not id.isdigit():
+        print("\nInvalid order ID!\n")
+        return
+    if update_orders_status(conn, [int(id)], "ready"):
+        print("\nOrder ready!\n")
+    else:
+        print("\nOrder not found or not preparing!\n")
+
+def prompt_set_prep_seconds(conn: psycopg.Connection):
+    """Ask for a product ID and how long it takes to prepare."""
+    id = input("Product ID: ").strip()
+    seconds = input("Prep time in seconds: ").strip()
+    if not id.isdigit() or not seconds.isdigit():
+        print("\nInvalid input!\n")
+        return
+    if set_prep_seconds(conn, int(id), int(seconds)) is None:
+        print("\nProduct not found!\n")
+        return
+    print("\nPrep time updated!\n")
+
+KITCHEN_COMMANDS = [
+    ("Live kitchen queue", prompt_watch_queue),
+    ("Start next orders", prompt_next_batch),
+    ("Mark order ready", prompt_mark_ready),
+    ("Set product prep time", prompt_set_prep_seconds),
+]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Kitchen display of the orders being prepared")
+    parser.add_argument("--limit", type=int, default=DISPLAY_LIMIT, help="the number of waiting orders shown")
+    args = parser.parse_args()
+
+    kitchen.listen(get_conninfo())
+    watch_queue(kitchen, args.limit)
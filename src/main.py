@@ -1,81 +1,69 @@
-import os
-import psycopg
-import pandas as pd
-from datetime import datetime
-from dotenv import load_dotenv
+import argparse
+import sys
+from contextlib import nullcontext
+from analytics import ANALYTICS_COMMANDS
+from bulk_import import prompt_bulk_import
+from catalog import catalog
+from connection import connect, get_conninfo
 from database import create_database
+from dispatcher import Menu, run
+from export import prompt_export
 from graphics.ascii import welcome, products, couriers, orders, customers
-from products import product_menu
-from orders import order_menu
-from couriers import courier_menu
-from customers import customer_menu
+from kitchen import KITCHEN_COMMANDS, open_kitchen
+from storage import SQLiteStorage, SQLITE_PATH
+from till import TILL_MENUS
+from products import PRODUCT_COMMANDS
+from queries import DIAGNOSTICS_COMMANDS
+from reports import REPORT_COMMANDS
+from orders import ORDER_COMMANDS
+from couriers import COURIER_COMMANDS
+from customers import CUSTOMER_COMMANDS
 
-load_dotenv()
-
-dbname = os.getenv('POSTGRES_DB')
-host = os.getenv('POSTGRES_HOST')
-port = os.getenv('POSTGRES_PORT')
-user = os.getenv('POSTGRES_USER')
-password = os.getenv('POSTGRES_PASSWORD')
-
-def menu(conn):
-    create_database(conn)
-        
-    print(welcome)
-
-    while True:
-
-        opt = int(input("To open the products menu, type '1'\nTo open the orders menu, type '2'\n\
-To open the couriers menu, type '3'\nTo open the customers menu, type '4'\n\
-To export data to CSV, type '5'\nTo exit the app, type '0'\n"))
-
-        if opt == 1:
-            os.system('cls')
-            print(products)
-            product_menu(conn, menu)
-
-        elif opt == 2:
-            os.system('cls')
-            print(orders)
-            order_menu(conn, menu)
-
-        elif opt == 3:
-            os.system('cls')
-            print(couriers)
-            courier_menu(conn, menu)
-
-        elif opt == 4:
-            os.system('cls')
-            print(customers)
-            customer_menu(conn, menu)
-
-        elif opt == 5:
-            timestamp = datetime.now().strftime('%Y-%m-%d')
-            query = "SELECT * FROM orders"
-            df = pd.read_sql_query(query, conn)
-            df.to_csv(f'csv/orders_{timestamp}.csv', index=False)
-            query = "SELECT * FROM products"
-            df = pd.read_sql_query(query, conn)
-            df.to_csv(f'csv/products_{timestamp}.csv', index=False)
-            query = "SELECT * FROM couriers"
-            df = pd.read_sql_query(query, conn)
-            df.to_csv(f'csv/couriers_{timestamp}.csv', index=False)
-            query = "SELECT * FROM customers"
-            df = pd.read_sql_query(query, conn)
-            df.to_csv(f'csv/customers_{timestamp}.csv', index=False)
-            print("\nData exported!\n")
-
-        elif opt == 0:
-            os.system('cls')
-            conn.close()
-            exit()
-
-        else:
-            print("\nInvalid option!\n")
+MENUS = {
+    "main": Menu("Main menu", [
+        ("Products menu", "products"),
+        ("Orders menu", "orders"),
+        ("Couriers menu", "couriers"),
+        ("Customers menu", "customers"),
+        ("Kitchen display", "kitchen"),
+        ("Sales analytics", "analytics"),
+        ("Export data to CSV or Parquet", prompt_export),
+        ("Bulk import data from a file", prompt_bulk_import),
+        ("Diagnostics", "diagnostics"),
+    ], art=welcome),
+    "products": Menu("Products", PRODUCT_COMMANDS, art=products),
+    "orders": Menu("Orders", ORDER_COMMANDS, art=orders),
+    "couriers": Menu("Couriers", COURIER_COMMANDS, art=couriers),
+    "customers": Menu("Customers", CUSTOMER_COMMANDS, art=customers),
+    "kitchen": Menu("Kitchen", KITCHEN_COMMANDS, on_open=open_kitchen),
+    "analytics": Menu("Sales analytics", ANALYTICS_COMMANDS + [("Offline reports from exported data", "reports")]),
+    "reports": Menu("Offline reports", REPORT_COMMANDS),
+    "diagnostics": Menu("Diagnostics", DIAGNOSTICS_COMMANDS),
+}
 
 if __name__ == '__main__':
-    try:
-        conn = psycopg.connect(dbname=dbname, host=host, port=port, user=user, password=password)
-        menu(conn)
-    finally:
-        conn.close()
+    parser = argparse.ArgumentParser(description="Alisam Cafe CLI ordering system")
+    parser.add_argument("--script", help="read menu choices and answers from this file instead of the keyboard")
+    parser.add_argument("--offline", nargs="?", const=SQLITE_PATH, metavar="PATH",
+                        help="run the till on this SQLite database (default SQLITE_PATH) without the central database")
+    args = parser.parse_args()
+
+    with open(args.script) if args.script else nullcontext(sys.stdin) as script:
+        stdin, sys.stdin = sys.stdin, script
+        try:
+            if args.offline:
+                storage = SQLiteStorage(args.offline)
+                try:
+                    run(storage, TILL_MENUS, interactive=args.script is None)
+                finally:
+                    storage.close()
+            else:
+                conn = connect()
+                try:
+                    create_database(conn)
+                    catalog.listen(get_conninfo())
+                    run(conn, MENUS, interactive=args.script is None)
+                finally:
+                    conn.close()
+        finally:
+            sys.stdin = stdin
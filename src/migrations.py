@@ -0,0 +1,535 @@
+import psycopg
+from analytics import rebuild_analytics, ANALYTICS_SLOTS
+
+BACKFILL_BATCH_SIZE = 1000
+
+def parse_legacy_items(text: str):
+    """
+    Parse the legacy `orders.items` column into a list of item names.
+
+    Args:
+        text (str): The stored value, a Postgres array literal such as
+            '{Latte,"Flat White"}'.
+
+    The column used to be VARCHAR(255), so long orders were cut off part way
+    through. An element that was cut off is dropped rather than guessed at.
+    Returns the list of item names.
+    """
+    if not text:
+        return []
+
+    body = text.strip()
+    if body.startswith("{"):
+        body = body[1:]
+    complete = body.endswith("}")
+    if complete:
+        body = body[:-1]
+
+    items = []
+    current = ""
+    quoted = False
+    escaped = False
+    for char in body:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == "," and not quoted:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += char
+
+    if complete and not quoted and not escaped:
+        items.append(current.strip())
+
+    return [item for item in items if item]
+
+def backfill_order_items(conn: psycopg.Connection):
+    """
+    Copy the items and courier of existing orders into order_items and courier_id.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+
+    Reads orders in keyset batches of BACKFILL_BATCH_SIZE, parses the legacy
+    items strings and inserts one order_items row per product with the product's
+    current price, committing after each batch. Items that no longer match a
+    product are skipped. Orders that already have order_items are left alone,
+    so an interrupted backfill can simply be run again.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE orders SET courier_id = couriers.id FROM couriers WHERE orders.courier_id IS NULL AND orders.courier = couriers.name")
+
+        cursor.execute("SELECT DISTINCT ON (name) name, id, price FROM products ORDER BY name, id")
+        products = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        conn.commit()
+
+        last_id = 0
+        while True:
+            cursor.execute(
+                """SELECT id, items FROM orders
+                   WHERE id > %s AND NOT EXISTS (SELECT 1 FROM order_items WHERE order_id = orders.id)
+                   ORDER BY id LIMIT %s""",
+                (last_id, BACKFILL_BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            lines = {}
+            for order_id, items in rows:
+                for item in parse_legacy_items(items):
+                    product = products.get(item.title())
+                    if product is None:
+                        continue
+                    key = (order_id, product[0])
+                    qty = lines[key][0] + 1 if key in lines else 1
+                    lines[key] = (qty, product[1])
+
+            cursor.executemany(
+                "INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING",
+                [(order_id, product_id, qty, price) for (order_id, product_id), (qty, price) in lines.items()]
+            )
+            conn.commit()
+            last_id = rows[-1][0]
+
+# The primary key columns recorded in export_deletions when rows of each
+# exported table are deleted, as arguments to the record_deletions trigger.
+DELETION_KEYS = {
+    "orders": "'id'",
+    "order_items": "'order_id', 'product_id'",
+    "products": "'id'",
+    "couriers": "'id'",
+    "customers": "'id'",
+}
+
+MIGRATIONS = [
+    (1, "order_items table, orders.courier_id and indexes", [
+        """CREATE TABLE IF NOT EXISTS order_items (
+               order_id INT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+               product_id INT NOT NULL REFERENCES products(id),
+               qty INT NOT NULL CHECK (qty > 0),
+               unit_price DECIMAL NOT NULL,
+               PRIMARY KEY (order_id, product_id))""",
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS courier_id INT REFERENCES couriers(id) ON DELETE SET NULL",
+        "ALTER TABLE orders ALTER COLUMN items TYPE TEXT",
+        "DROP INDEX IF EXISTS orders_status_courier_idx",
+        "CREATE INDEX IF NOT EXISTS orders_status_courier_id_idx ON orders (status, courier_id)",
+        "CREATE INDEX IF NOT EXISTS orders_customer_email_idx ON orders (customer_email)",
+        "CREATE INDEX IF NOT EXISTS order_items_product_id_idx ON order_items (product_id)",
+        "CREATE INDEX IF NOT EXISTS products_name_idx ON products (name)",
+        "CREATE INDEX IF NOT EXISTS customers_customer_email_idx ON customers (customer_email)",
+    ]),
+    (2, "backfill order_items and orders.courier_id from the legacy columns", backfill_order_items),
+    (3, "normalize customer emails and make them unique", [
+        "UPDATE customers SET customer_email = lower(trim(customer_email)) WHERE customer_email <> lower(trim(customer_email))",
+        """UPDATE customers SET total_spend = merged.total_spend
+           FROM (SELECT MIN(id) AS id, SUM(total_spend) AS total_spend FROM customers
+                 WHERE customer_email IS NOT NULL GROUP BY customer_email HAVING COUNT(*) > 1) merged
+           WHERE customers.id = merged.id""",
+        "DELETE FROM customers duplicate USING customers keeper WHERE duplicate.customer_email = keeper.customer_email AND duplicate.id > keeper.id",
+        "DROP INDEX IF EXISTS customers_customer_email_idx",
+        "CREATE UNIQUE INDEX IF NOT EXISTS customers_email_key ON customers (lower(customer_email))",
+    ]),
+    (4, "updated_at change tracking for incremental exports", [
+        """CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+           BEGIN
+               NEW.updated_at = now();
+               RETURN NEW;
+           END;
+           $$ LANGUAGE plpgsql""",
+        """CREATE TABLE IF NOT EXISTS export_deletions (
+               id BIGSERIAL PRIMARY KEY,
+               table_name VARCHAR(63) NOT NULL,
+               row_key JSONB NOT NULL,
+               deleted_at TIMESTAMPTZ NOT NULL DEFAULT now())""",
+        "CREATE INDEX IF NOT EXISTS export_deletions_table_name_deleted_at_idx ON export_deletions (table_name, deleted_at)",
+        """CREATE OR REPLACE FUNCTION record_deletions() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO export_deletions (table_name, row_key)
+               SELECT TG_TABLE_NAME, (SELECT jsonb_object_agg(key, value) FROM jsonb_each(to_jsonb(old_rows)) WHERE key = ANY(TG_ARGV))
+               FROM old_rows;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+    ] + [
+        statement.format(table=table, keys=keys)
+        for table, keys in DELETION_KEYS.items()
+        for statement in (
+            "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+            "CREATE INDEX IF NOT EXISTS {table}_updated_at_idx ON {table} (updated_at)",
+            "DROP TRIGGER IF EXISTS {table}_set_updated_at ON {table}",
+            "CREATE TRIGGER {table}_set_updated_at BEFORE UPDATE ON {table} FOR EACH ROW EXECUTE FUNCTION set_updated_at()",
+            "DROP TRIGGER IF EXISTS {table}_record_deletions ON {table}",
+            "CREATE TRIGGER {table}_record_deletions AFTER DELETE ON {table} REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION record_deletions({keys})",
+        )
+    ]),
+    (5, "index for paging orders by status", [
+        "CREATE INDEX IF NOT EXISTS orders_status_id_idx ON orders (status, id)",
+    ]),
+    (6, "notify the product catalogue cache of product changes", [
+        """CREATE OR REPLACE FUNCTION notify_products_changed() RETURNS trigger AS $$
+           BEGIN
+               IF TG_OP = 'DELETE' THEN
+                   PERFORM pg_notify('products_changed', json_build_object('op', TG_OP, 'id', OLD.id)::text);
+                   RETURN OLD;
+               END IF;
+               PERFORM pg_notify('products_changed', json_build_object('op', TG_OP, 'id', NEW.id, 'name', NEW.name, 'price', NEW.price, 'stock', NEW.stock)::text);
+               RETURN NEW;
+           END;
+           $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS products_notify ON products",
+        "CREATE TRIGGER products_notify AFTER INSERT OR UPDATE OR DELETE ON products FOR EACH ROW EXECUTE FUNCTION notify_products_changed()",
+    ]),
+    (7, "analytics summary tables maintained by triggers", [
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        """CREATE TABLE IF NOT EXISTS daily_sales (
+               day DATE NOT NULL,
+               slot SMALLINT NOT NULL DEFAULT 0,
+               orders INT NOT NULL DEFAULT 0,
+               items INT NOT NULL DEFAULT 0,
+               revenue DECIMAL NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, slot))""",
+        """CREATE TABLE IF NOT EXISTS product_daily_sales (
+               day DATE NOT NULL,
+               product_id INT NOT NULL,
+               slot SMALLINT NOT NULL DEFAULT 0,
+               orders INT NOT NULL DEFAULT 0,
+               units INT NOT NULL DEFAULT 0,
+               revenue DECIMAL NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, product_id, slot))""",
+        """CREATE TABLE IF NOT EXISTS courier_daily_stats (
+               day DATE NOT NULL,
+               courier_id INT NOT NULL,
+               slot SMALLINT NOT NULL DEFAULT 0,
+               assigned INT NOT NULL DEFAULT 0,
+               collected INT NOT NULL DEFAULT 0,
+               abandoned INT NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, courier_id, slot))""",
+        """CREATE TABLE IF NOT EXISTS customer_ltv (
+               customer_email VARCHAR(255) PRIMARY KEY,
+               orders INT NOT NULL DEFAULT 0,
+               revenue DECIMAL NOT NULL DEFAULT 0,
+               first_order_at TIMESTAMPTZ,
+               last_order_at TIMESTAMPTZ)""",
+        "CREATE INDEX IF NOT EXISTS customer_ltv_revenue_idx ON customer_ltv (revenue DESC)",
+        f"""CREATE OR REPLACE FUNCTION analytics_orders_inserted() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO daily_sales (day, slot, orders)
+               SELECT created_at::date, pg_backend_pid() % {ANALYTICS_SLOTS}, COUNT(*) FROM new_orders GROUP BY 1
+               ON CONFLICT (day, slot) DO UPDATE SET orders = daily_sales.orders + EXCLUDED.orders;
+
+               INSERT INTO courier_daily_stats (day, courier_id, slot, assigned)
+               SELECT created_at::date, courier_id, pg_backend_pid() % {ANALYTICS_SLOTS}, COUNT(*) FROM new_orders WHERE courier_id IS NOT NULL GROUP BY 1, 2
+               ON CONFLICT (day, courier_id, slot) DO UPDATE SET assigned = courier_daily_stats.assigned + EXCLUDED.assigned;
+
+               INSERT INTO customer_ltv (customer_email, orders, first_order_at, last_order_at)
+               SELECT lower(customer_email), COUNT(*), MIN(created_at), MAX(created_at)
+               FROM new_orders WHERE customer_email IS NOT NULL GROUP BY 1
+               ON CONFLICT (customer_email) DO UPDATE SET orders = customer_ltv.orders + EXCLUDED.orders,
+                   first_order_at = LEAST(customer_ltv.first_order_at, EXCLUDED.first_order_at),
+                   last_order_at = GREATEST(customer_ltv.last_order_at, EXCLUDED.last_order_at);
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        f"""CREATE OR REPLACE FUNCTION analytics_orders_closed() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO courier_daily_stats (day, courier_id, slot, collected, abandoned)
+               SELECT current_date, n.courier_id, pg_backend_pid() % {ANALYTICS_SLOTS},
+                      COUNT(*) FILTER (WHERE n.status = 'collected'), COUNT(*) FILTER (WHERE n.status = 'abandoned')
+               FROM new_orders n JOIN old_orders o ON o.id = n.id
+               WHERE n.status IN ('collected', 'abandoned') AND o.status IS DISTINCT FROM n.status AND n.courier_id IS NOT NULL
+               GROUP BY n.courier_id
+               ON CONFLICT (day, courier_id, slot) DO UPDATE SET collected = courier_daily_stats.collected + EXCLUDED.collected,
+                   abandoned = courier_daily_stats.abandoned + EXCLUDED.abandoned;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        f"""CREATE OR REPLACE FUNCTION analytics_order_items_inserted() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO daily_sales (day, slot, items, revenue)
+               SELECT o.created_at::date, pg_backend_pid() % {ANALYTICS_SLOTS}, SUM(i.qty), SUM(i.qty * i.unit_price)
+               FROM new_items i JOIN orders o ON o.id = i.order_id GROUP BY 1
+               ON CONFLICT (day, slot) DO UPDATE SET items = daily_sales.items + EXCLUDED.items,
+                   revenue = daily_sales.revenue + EXCLUDED.revenue;
+
+               INSERT INTO product_daily_sales (day, product_id, slot, orders, units, revenue)
+               SELECT o.created_at::date, i.product_id, pg_backend_pid() % {ANALYTICS_SLOTS}, COUNT(*), SUM(i.qty), SUM(i.qty * i.unit_price)
+               FROM new_items i JOIN orders o ON o.id = i.order_id GROUP BY 1, 2
+               ON CONFLICT (day, product_id, slot) DO UPDATE SET orders = product_daily_sales.orders + EXCLUDED.orders,
+                   units = product_daily_sales.units + EXCLUDED.units,
+                   revenue = product_daily_sales.revenue + EXCLUDED.revenue;
+
+               INSERT INTO customer_ltv (customer_email, revenue, first_order_at, last_order_at)
+               SELECT lower(o.customer_email), SUM(i.qty * i.unit_price), MIN(o.created_at), MAX(o.created_at)
+               FROM new_items i JOIN orders o ON o.id = i.order_id WHERE o.customer_email IS NOT NULL GROUP BY 1
+               ON CONFLICT (customer_email) DO UPDATE SET revenue = customer_ltv.revenue + EXCLUDED.revenue;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS orders_analytics_insert ON orders",
+        "CREATE TRIGGER orders_analytics_insert AFTER INSERT ON orders REFERENCING NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION analytics_orders_inserted()",
+        "DROP TRIGGER IF EXISTS orders_analytics_update ON orders",
+        "CREATE TRIGGER orders_analytics_update AFTER UPDATE ON orders REFERENCING OLD TABLE AS old_orders NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION analytics_orders_closed()",
+        "DROP TRIGGER IF EXISTS order_items_analytics_insert ON order_items",
+        "CREATE TRIGGER order_items_analytics_insert AFTER INSERT ON order_items REFERENCING NEW TABLE AS new_items FOR EACH STATEMENT EXECUTE FUNCTION analytics_order_items_inserted()",
+    ]),
+    (8, "fill the analytics summary tables from the order history", lambda conn: rebuild_analytics(conn, "orders", "order_items")),
+    (9, "stock reservations, non-negative stock and low-stock alerts", [
+        "UPDATE products SET stock = 0 WHERE stock < 0",
+        "ALTER TABLE products DROP CONSTRAINT IF EXISTS products_stock_check",
+        "ALTER TABLE products ADD CONSTRAINT products_stock_check CHECK (stock >= 0)",
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS low_stock_threshold INT NOT NULL DEFAULT 5 CHECK (low_stock_threshold >= 0)",
+        "CREATE INDEX IF NOT EXISTS products_low_stock_idx ON products (stock, id) WHERE stock <= low_stock_threshold",
+        """CREATE TABLE IF NOT EXISTS stock_reservations (
+               id BIGSERIAL PRIMARY KEY,
+               token UUID NOT NULL,
+               product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+               qty INT NOT NULL CHECK (qty > 0),
+               expires_at TIMESTAMPTZ NOT NULL,
+               UNIQUE (token, product_id))""",
+        "CREATE INDEX IF NOT EXISTS stock_reservations_expires_at_idx ON stock_reservations (expires_at)",
+        "CREATE INDEX IF NOT EXISTS stock_reservations_product_id_idx ON stock_reservations (product_id)",
+        """CREATE OR REPLACE FUNCTION notify_low_stock() RETURNS trigger AS $$
+           BEGIN
+               IF NEW.stock <= NEW.low_stock_threshold
+                  AND (TG_OP = 'INSERT' OR OLD.stock IS NULL OR OLD.stock > OLD.low_stock_threshold) THEN
+                   PERFORM pg_notify('low_stock', json_build_object('id', NEW.id, 'name', NEW.name, 'stock', NEW.stock, 'threshold', NEW.low_stock_threshold)::text);
+               END IF;
+               RETURN NEW;
+           END;
+           $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS products_low_stock ON products",
+        "CREATE TRIGGER products_low_stock AFTER INSERT OR UPDATE OF stock, low_stock_threshold ON products FOR EACH ROW EXECUTE FUNCTION notify_low_stock()",
+    ]),
+    (10, "index orders by courier and status", [
+        "UPDATE orders SET courier_id = couriers.id FROM couriers WHERE orders.courier_id IS NULL AND orders.courier = couriers.name",
+        "CREATE INDEX IF NOT EXISTS orders_courier_id_status_idx ON orders (courier_id, status, id)",
+    ]),
+    (11, "order_events outbox with change notifications", [
+        """CREATE TABLE IF NOT EXISTS order_events (
+               seq BIGSERIAL PRIMARY KEY,
+               occurred_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+               kind VARCHAR(32) NOT NULL,
+               order_id INT,
+               payload JSONB NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS order_events_order_id_idx ON order_events (order_id) WHERE order_id IS NOT NULL",
+        """CREATE OR REPLACE FUNCTION order_events_orders_inserted() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO order_events (kind, order_id, payload)
+               SELECT 'order_created', id, jsonb_build_object('status', status, 'courier_id', courier_id, 'customer_email', customer_email, 'created_at', created_at)
+               FROM new_orders ORDER BY id;
+               IF FOUND THEN
+                   PERFORM pg_notify('order_events', '');
+               END IF;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE FUNCTION order_events_status_changed() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO order_events (kind, order_id, payload)
+               SELECT 'status_changed', n.id, jsonb_build_object('from', o.status, 'to', n.status, 'courier_id', n.courier_id)
+               FROM new_orders n JOIN old_orders o ON o.id = n.id
+               WHERE o.status IS DISTINCT FROM n.status OR o.courier_id IS DISTINCT FROM n.courier_id ORDER BY n.id;
+               IF FOUND THEN
+                   PERFORM pg_notify('order_events', '');
+               END IF;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE FUNCTION order_events_items_inserted() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO order_events (kind, order_id, payload)
+               SELECT 'items_added', order_id, jsonb_build_object('items', jsonb_agg(jsonb_build_object('product_id', product_id, 'qty', qty, 'unit_price', unit_price)))
+               FROM new_items GROUP BY order_id ORDER BY order_id;
+               IF FOUND THEN
+                   PERFORM pg_notify('order_events', '');
+               END IF;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE FUNCTION order_events_stock_changed() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO order_events (kind, payload)
+               SELECT 'stock_changed', jsonb_build_object('product_id', n.id, 'name', n.name, 'change', n.stock - o.stock, 'stock', n.stock)
+               FROM new_products n JOIN old_products o ON o.id = n.id
+               WHERE n.stock <> o.stock ORDER BY n.id;
+               IF FOUND THEN
+                   PERFORM pg_notify('order_events', '');
+               END IF;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE FUNCTION order_events_spend_changed() RETURNS trigger AS $$
+           BEGIN
+               IF TG_OP = 'INSERT' THEN
+                   INSERT INTO order_events (kind, payload)
+                   SELECT 'spend_updated', jsonb_build_object('customer_id', id, 'customer_email', customer_email, 'change', total_spend, 'total_spend', total_spend)
+                   FROM new_customers WHERE total_spend <> 0 ORDER BY id;
+               ELSE
+                   INSERT INTO order_events (kind, payload)
+                   SELECT 'spend_updated', jsonb_build_object('customer_id', n.id, 'customer_email', n.customer_email, 'change', n.total_spend - o.total_spend, 'total_spend', n.total_spend)
+                   FROM new_customers n JOIN old_customers o ON o.id = n.id
+                   WHERE n.total_spend IS DISTINCT FROM o.total_spend ORDER BY n.id;
+               END IF;
+               IF FOUND THEN
+                   PERFORM pg_notify('order_events', '');
+               END IF;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS orders_events_insert ON orders",
+        "CREATE TRIGGER orders_events_insert AFTER INSERT ON orders REFERENCING NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION order_events_orders_inserted()",
+        "DROP TRIGGER IF EXISTS orders_events_update ON orders",
+        "CREATE TRIGGER orders_events_update AFTER UPDATE ON orders REFERENCING OLD TABLE AS old_orders NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION order_events_status_changed()",
+        "DROP TRIGGER IF EXISTS order_items_events_insert ON order_items",
+        "CREATE TRIGGER order_items_events_insert AFTER INSERT ON order_items REFERENCING NEW TABLE AS new_items FOR EACH STATEMENT EXECUTE FUNCTION order_events_items_inserted()",
+        "DROP TRIGGER IF EXISTS products_events_update ON products",
+        "CREATE TRIGGER products_events_update AFTER UPDATE ON products REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products FOR EACH STATEMENT EXECUTE FUNCTION order_events_stock_changed()",
+        "DROP TRIGGER IF EXISTS customers_events_insert ON customers",
+        "CREATE TRIGGER customers_events_insert AFTER INSERT ON customers REFERENCING NEW TABLE AS new_customers FOR EACH STATEMENT EXECUTE FUNCTION order_events_spend_changed()",
+        "DROP TRIGGER IF EXISTS customers_events_update ON customers",
+        "CREATE TRIGGER customers_events_update AFTER UPDATE ON customers REFERENCING OLD TABLE AS old_customers NEW TABLE AS new_customers FOR EACH STATEMENT EXECUTE FUNCTION order_events_spend_changed()",
+    ]),
+    (12, "full-text and trigram search indexes on customers and products", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS customers_search_idx ON customers USING gin (to_tsvector('simple', coalesce(customer_name, '') || ' ' || translate(coalesce(customer_email, ''), '@.', '  ')))",
+        "CREATE INDEX IF NOT EXISTS customers_name_trgm_idx ON customers USING gin (customer_name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS customers_email_trgm_idx ON customers USING gin (lower(customer_email) gin_trgm_ops)",
+        r"CREATE INDEX IF NOT EXISTS customers_phone_trgm_idx ON customers USING gin (regexp_replace(customer_phone, '\D', '', 'g') gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS products_search_idx ON products USING gin (to_tsvector('simple', name))",
+        "CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON products USING gin (name gin_trgm_ops)",
+    ]),
+    # A foreign key to a partitioned table has to include the partition key, so
+    # order_items.order_id keeps its reference to orders through constraint
+    # triggers instead: an item needs its order to exist, and an order cannot
+    # be deleted while it has items. The orders check is deferred to commit, so
+    # archive.create_partition can move orders from the default partition to a
+    # new one, and archive.archive_orders moves items with their orders.
+    (13, "partition orders by month of created_at, with an archive schema for closed months", [
+        "LOCK TABLE orders IN ACCESS EXCLUSIVE MODE",
+        """CREATE TABLE orders_partitioned (LIKE orders INCLUDING DEFAULTS INCLUDING CONSTRAINTS, PRIMARY KEY (id, created_at))
+           PARTITION BY RANGE (created_at)""",
+        """DO $$
+           DECLARE
+               month TIMESTAMP;
+           BEGIN
+               FOR month IN SELECT generate_series(
+                   date_trunc('month', COALESCE((SELECT MIN(created_at) FROM orders), now()) AT TIME ZONE 'UTC'),
+                   date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+                   interval '1 month')
+               LOOP
+                   EXECUTE format('CREATE TABLE %I PARTITION OF orders_partitioned FOR VALUES FROM (%L) TO (%L)',
+                                  'orders_p' || to_char(month, 'YYYYMM'), month AT TIME ZONE 'UTC', (month + interval '1 month') AT TIME ZONE 'UTC');
+               END LOOP;
+           END;
+           $$""",
+        "CREATE TABLE orders_default PARTITION OF orders_partitioned DEFAULT",
+        "INSERT INTO orders_partitioned SELECT * FROM orders",
+        "ALTER TABLE order_items DROP CONSTRAINT IF EXISTS order_items_order_id_fkey",
+        """CREATE OR REPLACE FUNCTION order_items_check_order() RETURNS trigger AS $$
+           BEGIN
+               PERFORM 1 FROM orders WHERE id = NEW.order_id FOR KEY SHARE;
+               IF NOT FOUND THEN
+                   RAISE EXCEPTION 'order % of order_items does not exist', NEW.order_id USING ERRCODE = 'foreign_key_violation';
+               END IF;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE FUNCTION orders_check_items() RETURNS trigger AS $$
+           BEGIN
+               IF EXISTS (SELECT 1 FROM order_items WHERE order_id = OLD.id) AND NOT EXISTS (SELECT 1 FROM orders WHERE id = OLD.id) THEN
+                   RAISE EXCEPTION 'order % still has order_items', OLD.id USING ERRCODE = 'foreign_key_violation';
+               END IF;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql""",
+        "CREATE CONSTRAINT TRIGGER order_items_order_id_check AFTER INSERT OR UPDATE OF order_id ON order_items FOR EACH ROW EXECUTE FUNCTION order_items_check_order()",
+        "ALTER SEQUENCE orders_id_seq OWNED BY NONE",
+        "DROP TABLE orders",
+        "ALTER TABLE orders_partitioned RENAME TO orders",
+        "ALTER INDEX orders_partitioned_pkey RENAME TO orders_pkey",
+        "ALTER SEQUENCE orders_id_seq OWNED BY orders.id",
+        "ALTER TABLE orders ADD CONSTRAINT orders_courier_id_fkey FOREIGN KEY (courier_id) REFERENCES couriers(id) ON DELETE SET NULL",
+        "CREATE INDEX orders_status_courier_id_idx ON orders (status, courier_id)",
+        "CREATE INDEX orders_customer_email_idx ON orders (customer_email)",
+        "CREATE INDEX orders_updated_at_idx ON orders (updated_at)",
+        "CREATE INDEX orders_status_id_idx ON orders (status, id)",
+        "CREATE INDEX orders_courier_id_status_idx ON orders (courier_id, status, id)",
+        "CREATE TRIGGER orders_set_updated_at BEFORE UPDATE ON orders FOR EACH ROW EXECUTE FUNCTION set_updated_at()",
+        """CREATE CONSTRAINT TRIGGER orders_order_items_check AFTER DELETE OR UPDATE OF id ON orders
+           DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION orders_check_items()""",
+        "CREATE TRIGGER orders_record_deletions AFTER DELETE ON orders REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION record_deletions('id')",
+        "CREATE TRIGGER orders_analytics_insert AFTER INSERT ON orders REFERENCING NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION analytics_orders_inserted()",
+        "CREATE TRIGGER orders_analytics_update AFTER UPDATE ON orders REFERENCING OLD TABLE AS old_orders NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION analytics_orders_closed()",
+        "CREATE TRIGGER orders_events_insert AFTER INSERT ON orders REFERENCING NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION order_events_orders_inserted()",
+        "CREATE TRIGGER orders_events_update AFTER UPDATE ON orders REFERENCING OLD TABLE AS old_orders NEW TABLE AS new_orders FOR EACH STATEMENT EXECUTE FUNCTION order_events_status_changed()",
+        "CREATE SCHEMA IF NOT EXISTS archive",
+        """CREATE TABLE archive.orders (LIKE orders INCLUDING DEFAULTS INCLUDING CONSTRAINTS, PRIMARY KEY (id, created_at))
+           PARTITION BY RANGE (created_at)""",
+        "CREATE TABLE archive.order_items (LIKE order_items INCLUDING ALL)",
+        "CREATE VIEW order_history AS SELECT * FROM orders UNION ALL SELECT * FROM archive.orders",
+        "CREATE VIEW order_item_history AS SELECT * FROM order_items UNION ALL SELECT * FROM archive.order_items",
+    ]),
+    (14, "prep time estimates for the kitchen queue", [
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS prep_seconds INT NOT NULL DEFAULT 60 CHECK (prep_seconds >= 0)",
+        """CREATE OR REPLACE FUNCTION notify_products_changed() RETURNS trigger AS $$
+           BEGIN
+               IF TG_OP = 'DELETE' THEN
+                   PERFORM pg_notify('products_changed', json_build_object('op', TG_OP, 'id', OLD.id)::text);
+                   RETURN OLD;
+               END IF;
+               PERFORM pg_notify('products_changed', json_build_object('op', TG_OP, 'id', NEW.id, 'name', NEW.name, 'price', NEW.price, 'stock', NEW.stock,
+                                                                       'prep_seconds', NEW.prep_seconds)::text);
+               RETURN NEW;
+           END;
+           $$ LANGUAGE plpgsql""",
+    ]),
+]
+
+def migrate(conn: psycopg.Connection):
+    """
+    Apply any schema migrations that have not been applied yet.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+
+    Applied versions are recorded in the schema_migrations table. Each migration
+    in MIGRATIONS is either a list of SQL statements, run in one transaction, or
+    a function that takes the connection and manages its own commits. An
+    advisory lock stops two tills from migrating the same database at once.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, description VARCHAR(255), applied_at TIMESTAMPTZ DEFAULT now())")
+        conn.commit()
+
+        cursor.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'))")
+        try:
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            current = cursor.fetchone()[0]
+            conn.commit()
+
+            for version, description, steps in MIGRATIONS:
+                if version <= current:
+                    continue
+
+                print(f"Applying migration {version}: {description}")
+                try:
+                    if callable(steps):
+                        steps(conn)
+                    else:
+                        for statement in steps:
+                            cursor.execute(statement)
+                    cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'))")
+            conn.commit()
@@ -1,108 +1,214 @@
-import os
 import psycopg
-from customers import update_spend
+from collections import Counter
+from datetime import datetime
+from balancer import balancer
+from catalog import catalog
+from customers import customer_cache, normalize_email, ADD_SPEND
+from database import OPEN_STATUSES
+from paging import browse, keyset_page
+from queries import registry
+from search import choose_customer, choose_product, complete_products, typeahead
+from stock import new_reservation, reserve, release
+
+STATUS_TRANSITIONS = {
+    "preparing": ("ready",),
+    "ready": ("collected", "abandoned"),
+}
+
+ORDER_COLUMNS = ("id", "customer_name", "customer_email", "customer_phone", "customer_address", "items", "status", "courier")
+
+INSERT_LEGACY_ORDER = registry.register("orders.insert_legacy", """
+    WITH new_order AS (
+        INSERT INTO orders (customer_name, customer_address, customer_phone, customer_email, courier, courier_id, status, items, created_at)
+        VALUES (%s, %s, %s, %s, %s, (SELECT id FROM couriers WHERE name = %s ORDER BY id LIMIT 1), %s, %s, COALESCE(%s, now()))
+        RETURNING id
+    )
+    INSERT INTO order_items (order_id, product_id, qty, unit_price)
+    SELECT new_order.id, product.id, wanted.qty, product.price
+    FROM new_order, unnest(%s::text[], %s::int[]) AS wanted(name, qty)
+    JOIN LATERAL (SELECT id, price FROM products WHERE name = wanted.name ORDER BY id LIMIT 1) product ON true""")
+UPDATE_STATUS = registry.register("orders.update_status", "UPDATE orders SET status = %s WHERE id = ANY(%s) AND status = ANY(%s) RETURNING id, courier_id")
+# Product names are not unique, so every order path resolves a name to the
+# product with the lowest ID, as INSERT_LEGACY_ORDER does, before touching stock.
+DEDUCT_ONE = registry.register("products.deduct_one", """
+    UPDATE products SET stock = stock - 1
+    WHERE id = (SELECT id FROM products WHERE name = %s ORDER BY id LIMIT 1) AND stock > 0""")
+DEDUCT_STOCK = registry.register("products.deduct_stock", """
+    UPDATE products SET stock = products.stock - wanted.qty
+    FROM (SELECT DISTINCT ON (product.name) product.id, line.qty
+          FROM unnest(%s::text[], %s::int[]) AS line(name, qty)
+          JOIN products product ON product.name = line.name
+          ORDER BY product.name, product.id) AS wanted
+    WHERE products.id = wanted.id AND products.stock >= wanted.qty
+    RETURNING products.name, products.price, wanted.qty, products.id""")
+CONSUME_RESERVATION = registry.register("stock_reservations.consume", """
+    WITH held AS (
+        DELETE FROM stock_reservations WHERE token = %s RETURNING product_id, qty
+    )
+    SELECT products.name, products.price, held.qty, products.id
+    FROM held JOIN products ON products.id = held.product_id""")
+INSERT_ORDER = registry.register("orders.insert", """
+    WITH new_order AS (
+        INSERT INTO orders (customer_name, customer_address, customer_phone, customer_email, courier, courier_id, status, items, created_at)
+        VALUES (%s, %s, %s, %s, (SELECT name FROM couriers WHERE id = %s), %s, %s, %s, COALESCE(%s, now()))
+        RETURNING id
+    )
+    INSERT INTO order_items (order_id, product_id, qty, unit_price)
+    SELECT new_order.id, line.product_id, line.qty, line.unit_price
+    FROM new_order, unnest(%s::int[], %s::int[], %s::numeric[]) AS line(product_id, qty, unit_price)
+    RETURNING order_id""")
+ADD_ORDER_SPEND = registry.register("customers.upsert_spend", """
+    INSERT INTO customers (customer_name, customer_email, customer_phone, total_spend) VALUES (%s, %s, %s, %s)
+    ON CONFLICT ((lower(customer_email))) DO UPDATE SET total_spend = customers.total_spend + EXCLUDED.total_spend
+    RETURNING id""")
+FIND_CUSTOMER = registry.register("customers.find_by_email", "SELECT id FROM customers WHERE lower(customer_email) = %s")
+INSERT_CUSTOMER = registry.register("customers.insert_new", """
+    INSERT INTO customers (customer_name, customer_email, customer_phone, total_spend) VALUES (%s, %s, %s, %s)
+    ON CONFLICT ((lower(customer_email))) DO NOTHING
+    RETURNING id""")
+
+def prompt_create_order(conn: psycopg.Connection):
+    """
+    Ask for the customer's details and items, assign a courier and place the order.
 
-def order_menu(conn: psycopg.Connection, menu: callable):
+    An existing customer can be found by type-ahead search instead of typing
+    their details in again. Items are reserved as they are picked, so another till cannot sell the same
+    stock while the order is being built. The reservation is released if the
+    order is not placed.
+    """
+    customer = choose_customer(conn)
+    if customer is not None:
+        id, name, email, phone, spend = customer
+        print(f"\nOrdering for {name} ({email})\n")
+        address = input("Customer address: ")
+    else:
+        name = input("Customer name: ")
+        address = input("Customer address: ")
+        phone = input("Customer phone: ")
+        email = input("Customer email: ")
+    reservation = new_reservation()
+    try:
+        items = choose_items(conn, reservation)
+    except BaseException:
+        release(conn, reservation)
+        raise
+
+    if len(items) == 0:
+        print("\nNo items ordered! Try again!\n")
+        return
+
+    try:
+        courier_id, courier = balancer.assign(conn)
+    except ValueError:
+        release(conn, reservation)
+        print("\nNo couriers available! Add a courier first before creating an order!\n")
+        return
+    try:
+        place_order(conn, name, address, phone, email, courier_id, items, reservation)
+    except ValueError as e:
+        balancer.release(courier_id)
+        release(conn, reservation)
+        print(f"\n{e}! Try again!\n")
+        return
+    print("\nOrder created!\n")
+
+def prompt_update_orders_status(conn: psycopg.Connection):
+    """Ask for one or more order IDs and a new status, then move the orders to it."""
+    ids = input("Order Id(s) to update, separated by commas: ")
+    try:
+        ids = [int(id) for id in ids.split(",") if id.strip()]
+    except ValueError:
+        print("\nOrder Ids must be numbers! Try again!\n")
+        return
+    new_status = choose_new_status()
+    if new_status is None:
+        return
+    updated = update_orders_status(conn, ids, new_status)
+    report_status_update(ids, updated, new_status)
+
+def choose_new_status():
+    """Ask which status to move orders to. Returns the status, or None after telling the user the choice was wrong."""
+    new_status = int(input("Choose status:\n1. Ready\n2. Collected\n3. Abandoned\n\nEnter option:  "))
+    if new_status == 1:
+        return "ready"
+    elif new_status == 2:
+        return "collected"
+    elif new_status == 3:
+        return "abandoned"
+    print("\nIncorrect choice! Try again!\n")
+    return None
+
+def report_status_update(ids: list, updated: list, new_status: str):
+    """Print how many of the orders asked for were moved to a new status, and which were not."""
+    skipped = set(ids) - {row[0] for row in updated}
+    print(f"\n{len(updated)} order(s) moved to {new_status}.\n")
+    if skipped:
+        print(f"Not updated (not found, or cannot move to {new_status} from their status): {', '.join(str(id) for id in sorted(skipped))}\n")
+
+def prompt_view_orders_by_status(conn: psycopg.Connection):
+    """Ask for a status and show the orders that have it."""
+    option = int(input("Choose order status to view all orders:\n1. Preparing\n2. Ready\n3. Collected\n4. Abandoned\n\nEnter choice: "))
+    if option == 1:
+        option = "preparing"
+    elif option == 2:
+        option = "ready"    
+    elif option == 3:
+        option = "collected"
+    elif option == 4:
+        option = "abandoned"
+    else:
+        print("\nIncorrect choice! Try again!\n")
+        return
+    view_orders_by_status(conn, option)
 
+def view_orders(conn: psycopg.Connection):
     """
-    Menu for managing orders in the database.
+    Retrieve and display all orders from the database.
 
     Args:
         conn (psycopg.Connection): A connection to the PostgreSQL database.
-        menu (function): The function to call to go back to the main menu.
 
-    This function provides a menu for managing orders in the database. The user can
-    view all orders, create a new order, update an order's status, or view orders by
-    status. The user can also go back to the main menu by selecting option 0.
+    This function fetches the order records from the database one page at a time,
+    sorted by ID, and displays them in a formatted table with columns for ID, Name, Email, Phone, 
+    Address, Items, Status, and Courier. The table headers and each row are left-aligned.
     """
 
-    while True:
-        opt = int(input("\n\n1. View orders\n2. Create order\n3. Update order status\n4. Check open orders by status\n0. Main menu\n"))
-
-        if opt == 1:
-            view_orders(conn)
-
-        elif opt == 2:
-            name = input("Customer name: ")
-            address = input("Customer address: ")
-            phone = input("Customer phone: ")
-            email = input("Customer email: ")
-            try:
-                courier = courier_with_lowest_orders(conn)
-            except ValueError:
-                print("\nNo couriers available! Add a courier first before creating an order!\n")
-                continue
-            items = choose_items(conn)
-            id = get_customer_id(conn, name, phone, email)
-
-            
-            if len(items) == 0:
-                print("\nNo items ordered! Try again!\n")
-                continue
-            else:
-                create_order(conn, name, address, phone,email, courier, items)
-                deduct_stock(conn, items)
-                update_spend(conn, id, items)
-                print("\nOrder created!\n")
-
-        elif opt == 3:
-            id = input("Customer Id to update: ")
-            new_status = int(input("Choose status:\n1. Ready\n2. Collected\n3. Abandoned\n\nEnter option:  "))
-            if new_status == 1:
-                new_status = "ready"
-            elif new_status == 2:
-                new_status = "collected"
-            elif new_status == 3:
-                new_status = "abandoned"
-            else:
-                print("\nIncorrect choice! Try again!\n")
-                continue
-            update_order_status(conn, id, new_status)
-
-        elif opt == 4:
-            option = int(input("Choose order status to view all orders:\n1. Preparing\n2. Ready\n3. Collected\n4. Abandoned\n\nEnter choice: "))
-            if option == 1:
-                option = "preparing"
-            elif option == 2:
-                option = "ready"    
-            elif option == 3:
-                option = "collected"
-            elif option == 4:
-                option = "abandoned"
-            else:
-                print("\nIncorrect choice! Try again!\n")
-                continue
-            view_orders_by_status(conn, option)
+    print("\nExisting orders are:\n")
+    browse(lambda **page: list_orders(conn, **page), show_orders)
 
-        elif opt == 0:
-            os.system('cls')
-            menu(conn) 
+def show_orders(rows: list):
+    """Print a page of orders as a table with columns for ID, Name, Email, Phone, Address, Items, Status, and Courier."""
+    print(f"{'ID':<5}{'Name':<20}{'Email':<35}{'Phone':<15}{'Address':<45}{'Items':<35}{'Status':<15}{'Courier':<10}\n{'_'*180}")
+    for x in rows:
+        print(f"{x[0]}. |{x[1]:<18} |{x[2]:<30} |{x[3]:<15} |{x[4]:<45} |{x[5]:<30}    |{x[6]:<10}  |{x[7]} ")
+        print("_"*180 + '|')
 
-        else:
-            print("Invalid option!")
-
-def view_orders(conn: psycopg.Connection):
+def list_orders(conn: psycopg.Connection, status: str = None, after: int = None, before: int = None, limit: int = None):
     """
-    Retrieve and display all orders from the database.
+    Retrieve orders from the database, optionally filtered by status and one page at a time.
 
     Args:
         conn (psycopg.Connection): A connection to the PostgreSQL database.
-
-    This function fetches all order records from the database, sorted by ID, and
-    displays them in a formatted table with columns for ID, Name, Email, Phone, 
-    Address, Items, Status, and Courier. The table headers and each row are left-aligned.
+        status (str): The status to filter orders by. If None, all orders are returned.
+        after (int): Only return rows with an ID greater than this one.
+        before (int): Only return rows with an ID less than this one.
+        limit (int): The maximum number of rows to return. If None, all rows are returned.
+
+    Items are listed from order_items, falling back to the legacy items column
+    for orders that predate it. Returns a list of rows sorted by ID, with the
+    fields named in ORDER_COLUMNS.
     """
-
-    print("\nExisting orders are:\n")
-    with conn.cursor() as cursor: 
-        cursor.execute("SELECT * FROM orders order by id ASC")
-        rows = cursor.fetchall()
-        print(f"{'ID':<5}{'Name':<20}{'Email':<35}{'Phone':<15}{'Address':<45}{'Items':<35}{'Status':<15}{'Courier':<10}\n{'_'*180}")
-        for x in rows:
-            print(f"{x[0]}. |{x[1]:<18} |{x[2]:<30} |{x[3]:<15} |{x[4]:<45} |{x[5]:<30}    |{x[6]:<10}  |{x[7]} ")
-            print("_"*180 + '|')
+    query = """SELECT id, customer_name, customer_email, customer_phone, customer_address,
+                      COALESCE((SELECT string_agg(p.name || CASE WHEN oi.qty > 1 THEN ' x' || oi.qty ELSE '' END, ', ' ORDER BY p.name)
+                                FROM order_items oi JOIN products p ON p.id = oi.product_id
+                                WHERE oi.order_id = orders.id), items),
+                      status, courier
+               FROM orders"""
+    if status is None:
+        return keyset_page(conn, query, after=after, before=before, limit=limit, name="orders.list")
+    return keyset_page(conn, query, "status = %s", (status,), after, before, limit, "orders.list_by_status")
             
-def create_order(conn: psycopg.Connection, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, courier: int, items: list):
+def create_order(conn: psycopg.Connection, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, courier: int, items: list, created_at: datetime = None):
     """
     Create a new order in the database.
 
@@ -112,23 +218,33 @@ def create_order(conn: psycopg.Connection, customer_name: str, customer_address:
         customer_address (str): The address of the customer.
         customer_phone (str): The phone number of the customer.
         customer_email (str): The email of the customer.
-        courier (int): The ID of the courier assigned to the order.
+        courier (str): The name of the courier assigned to the order.
         items (list): The list of items ordered.
+        created_at (datetime): When the order was placed, if not now, e.g. for
+            an order taken offline. It decides the orders partition it goes in.
 
-    Inserts a new order into the orders table with the provided customer name, address, phone number, email, courier ID, and items, and commits the changes to the database.
+    Inserts a new order into the orders table with the provided customer name, address, phone number, email, courier, and items,
+    writes one order_items row per product, and commits the changes to the database.
     """
     order = {
         "name": customer_name.title(),
         "address": customer_address.lower(),
         "phone": customer_phone,
-        "email": customer_email,
+        "email": normalize_email(customer_email),
         "courier": courier,
         "status": "preparing",
         "items" : items
     }
 
+    counts = Counter(item.title() for item in items)
+    names = list(counts)
+
     with conn.cursor() as cursor:
-        cursor.execute("INSERT INTO orders (customer_name, customer_address, customer_phone,customer_email, courier, status, items) VALUES (%s, %s, %s, %s, %s, %s, %s)", (order["name"], order["address"], order["phone"], order["email"], order["courier"], order["status"],order["items"]))
+        registry.execute(
+            cursor, INSERT_LEGACY_ORDER,
+            (order["name"], order["address"], order["phone"], order["email"], order["courier"], order["courier"], order["status"], order["items"], created_at,
+             names, [counts[name] for name in names])
+        )
         conn.commit()
 
 def update_order_status(conn: psycopg.Connection, id: int, new_status: str):
@@ -141,17 +257,52 @@ def update_order_status(conn: psycopg.Connection, id: int, new_status: str):
         id (int): The ID of the order to be updated.
         new_status (str): The new status of the order.
 
-    Checks if the order ID exists in the database. If it does, updates the order
-    status and commits the changes to the database. If the order ID does not exist,
-    prints an error message.
+    Updates the order through update_orders_status, so only the transitions in
+    STATUS_TRANSITIONS are allowed. If the order does not exist or cannot move to
+    the new status from its current one, prints an error message. Returns True if
+    the order was updated.
     """
-    with conn.cursor() as cursor:        
-        cursor.execute("UPDATE orders SET status = %s WHERE id = %s", (new_status, id))
-        if cursor.rowcount == 0:
-            print("Error! Order not found! Try again!")
-        else:
-            conn.commit()
-            print("\nOrder status updated.\n")
+    if update_orders_status(conn, [id], new_status):
+        print("\nOrder status updated.\n")
+        return True
+    print("Error! Order not found, or it cannot move to that status! Try again!")
+    return False
+
+def update_orders_status(conn: psycopg.Connection, ids: list, new_status: str):
+    """
+    Move a batch of orders to a new status in one statement.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        ids (list of int): The IDs of the orders to update.
+        new_status (str): The new status of the orders.
+
+    Orders move preparing -> ready -> collected or abandoned, as listed in
+    STATUS_TRANSITIONS. The check is made by the UPDATE itself, which only touches
+    orders whose current status may move to the new one, so a whole shift can be
+    closed out in one round-trip and concurrent updates cannot skip a step.
+    Couriers of orders that were closed are freed up in the workload heap.
+
+    Raises ValueError if no status can move to `new_status`. Returns a list of
+    (id, courier_id) rows for the orders that were actually changed.
+    """
+    allowed = [status for status, targets in STATUS_TRANSITIONS.items() if new_status in targets]
+    if not allowed:
+        raise ValueError(f"Orders cannot be moved to {new_status}")
+
+    with conn.cursor() as cursor:
+        registry.execute(
+            cursor, UPDATE_STATUS,
+            (new_status, list(ids), allowed)
+        )
+        rows = cursor.fetchall()
+    conn.commit()
+
+    if new_status not in OPEN_STATUSES:
+        for row in rows:
+            balancer.release(row[1])
+
+    return rows
 
 def view_orders_by_status(conn: psycopg.Connection, choice: str):
     
@@ -162,18 +313,12 @@ def view_orders_by_status(conn: psycopg.Connection, choice: str):
         conn (psycopg.Connection): A connection to the PostgreSQL database.
         choice (str): The status to filter orders by.
 
-    Retrieves all orders from the database filtered by the provided status and displays them in a formatted table with
+    Retrieves the orders from the database filtered by the provided status, one page at a time, and displays them in a formatted table with
     columns for ID, Name, Email, Phone, Address, Items, Status, and Courier. The table headers are left-aligned and each row is
     also left-aligned.
     """
     
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM orders WHERE status = %s", (choice,))
-        rows = cursor.fetchall()    
-        print(f"{'ID':<5}{'Name':<20}{'Email':<35}{'Phone':<15}{'Address':<45}{'Items':<35}{'Status':<15}{'Courier':<10}\n{'_'*180}")
-        for x in rows:
-            print(f"{x[0]}. |{x[1]:<18} |{x[2]:<30} |{x[3]:<15} |{x[4]:<45} |{x[5]:<30}    |{x[6]:<10}  |{x[7]} ")
-            print("_"*180 + '|')
+    browse(lambda **page: list_orders(conn, choice, **page), show_orders)
 
 
 def deduct_stock(conn: psycopg.Connection, items: list):
@@ -185,63 +330,133 @@ def deduct_stock(conn: psycopg.Connection, items: list):
         items (list): A list of item names to deduct stock from.
 
     Deducts one from the stock of each item in the provided list and commits
-    the changes to the database.
+    the changes to the database. If an item has no stock left, nothing is deducted
+    and ValueError is raised, so stock never goes below zero.
     """
     with conn.cursor() as cursor:
         for item in items:
-            cursor.execute(
-                "UPDATE products SET stock = stock - 1 WHERE name = %s",
-                (item.title(),)  
-            )
+            registry.execute(cursor, DEDUCT_ONE, (item.title(),))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                raise ValueError(f"{item.title()} is out of stock")
 
         conn.commit()
 
-def courier_with_lowest_orders(conn: psycopg.Connection):
+def place_order(conn: psycopg.Connection, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, courier_id: int, items: list, reservation: str = None, created_at: datetime = None):
     """
-    Retrieve the name of the courier with the lowest number of orders from the database.
+    Create an order, deduct its stock and update the customer's spend in one transaction.
 
     Args:
         conn (psycopg.Connection): A connection to the PostgreSQL database.
+        customer_name (str): The name of the customer.
+        customer_address (str): The address of the customer.
+        customer_phone (str): The phone number of the customer.
+        customer_email (str): The email of the customer.
+        courier_id (int): The ID of the courier assigned to the order.
+        items (list): The list of item names ordered. A name may appear more than once.
+        reservation (str): A stock reservation made with stock.reserve for exactly
+            these items. If given, the reserved stock is used for the order instead
+            of taking it from the products now.
+        created_at (datetime): When the order was placed, if not now, e.g. for
+            an order taken offline.
+
+    Replaces calling create_order, get_customer_id, deduct_stock and update_spend
+    one after another. Stock for every item is decremented in one statement that
+    only succeeds where enough stock is left, and it returns the prices used for
+    the total. The order and its order_items rows are inserted in one statement,
+    and the customer is created or has their
+    spend increased in one more statement, so the number of round-trips does not
+    grow with the number of items.
+
+    If any item is missing or does not have enough stock, or the reservation has
+    expired or does not match the items, nothing is written and ValueError is
+    raised. Returns a (order_id, customer_id, total) tuple.
+    """
+    counts = Counter(item.title() for item in items)
+    names = list(counts)
+    email = normalize_email(customer_email)
+
+    try:
+        with conn.cursor() as cursor:
+            if reservation is None:
+                registry.execute(cursor, DEDUCT_STOCK, (names, [counts[name] for name in names]))
+            else:
+                registry.execute(cursor, CONSUME_RESERVATION, (reservation,))
+            rows = check_order_lines(counts, cursor.fetchall(), reservation)
+            total = sum(row[1] * row[2] for row in rows)
+
+            registry.execute(cursor, INSERT_ORDER, order_params(customer_name, customer_address, customer_phone, email, courier_id, items, created_at, rows))
+            order_id = cursor.fetchone()[0]
+
+            customer_id = add_order_spend(cursor, customer_name, email, customer_phone, total)
+    except Exception:
+        conn.rollback()
+        raise
 
-    Retrieves all courier names from the couriers table and all order courier IDs from the
-    orders table. Counts the number of orders each courier has and finds the courier with
-    the lowest number of orders. Returns the name of this courier.
+    conn.commit()
+    customer_cache.put(email, customer_id)
+    return order_id, customer_id, total
+
+def check_order_lines(counts: Counter, rows: list, reservation: str = None):
     """
-    courier = []
-    courier_orders = []
-    courier_workload = []
+    Check the stock taken for an order covers every item, before the order is written.
 
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM couriers")
-        rows = cursor.fetchall()
+    Args:
+        counts (Counter): How many of each item name were ordered.
+        rows (list): The (name, price, qty, id) rows returned by DEDUCT_STOCK,
+            or by CONSUME_RESERVATION if a reservation was used.
+        reservation (str): The reservation the rows came from, if any.
+
+    Shared by place_order and its asyncio counterpart. Raises ValueError if an
+    item is missing or short of stock, or the reservation does not hold
+    exactly the items ordered. Returns the rows.
+    """
+    if reservation is None:
+        missing = set(counts) - {row[0] for row in rows}
+        if missing:
+            raise ValueError(f"Not enough stock for {', '.join(sorted(missing))}")
+    else:
+        held = Counter()
         for row in rows:
-            courier.append(row[1].rstrip())            
+            held[row[0]] += row[2]
+        if held != counts:
+            raise ValueError("The stock reservation has expired or does not match the order")
+    return rows
 
-        cursor.execute("SELECT * FROM orders")
-        rows = cursor.fetchall()
+def order_params(customer_name: str, customer_address: str, customer_phone: str, email: str, courier_id: int, items: list, created_at: datetime, rows: list):
+    """Return the parameters of INSERT_ORDER for an order whose stock was taken as `rows`, as checked by check_order_lines."""
+    return (customer_name.title(), customer_address.lower(), customer_phone, email, courier_id, courier_id, "preparing", items, created_at,
+            [row[3] for row in rows], [row[2] for row in rows], [row[1] for row in rows])
 
-        for row in rows:
-            courier_orders.append(row[4])
+def courier_with_lowest_orders(conn: psycopg.Connection):
+    """
+    Retrieve the name of the courier with the lowest number of open orders.
 
-        for x in courier:
-            courier_workload.append(courier_orders.count(x))
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
 
-    lowest_num = min(courier_workload)
-    index = courier_workload.index(lowest_num)
-    courier = courier[index]
+    Picks the courier from the in-memory workload heap in `balancer`, which is
+    loaded with one grouped query on first use and updated as orders are created
+    and closed. Returns the name of this courier, or raises ValueError if there
+    are no couriers.
+    """
+    id, courier = balancer.assign(conn)
 
     return courier
         
 
-def choose_items(conn: psycopg.Connection):
+def choose_items(conn: psycopg.Connection, reservation: str = None):
      
     """
     Allow the user to choose items to order from the database.
 
     Args:
         conn (psycopg.Connection): A connection to the PostgreSQL database.
+        reservation (str): If given, each item is held under this stock
+            reservation as it is picked, and is only added if it could be held.
 
-    Prompts the user to enter the ID of the item to order, and checks if the item exists and is in stock.
+    Prompts the user to enter the ID or name of the item to order, searching the
+    products when a name is typed, and checks in the product catalogue cache if the item exists and is in stock.
     If the item is in stock, adds it to the order items list. If the item is out of stock, prints an error message.
     Allows the user to continue adding items until they choose to stop.
     Returns the list of items ordered.
@@ -250,19 +465,24 @@ def choose_items(conn: psycopg.Connection):
     on = True
    
     while on:
-        choice = input("Enter item Id to order: ")
-
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM products WHERE id = %s", (choice,))
-            rows = cursor.fetchone()  
-            if rows:
-                name = rows[1]
-                if rows[3] == 0:
-                    print("\nOut of stock! Try again!\n")
-                else:
+        choice = typeahead("Enter item Id or name to order (Tab to complete): ", complete_products(conn)).strip()
+        id = int(choice) if choice.isdigit() else choose_product(conn, choice)
+
+        rows = catalog.get(conn, id) if id is not None else None
+        if rows:
+            name = rows[1]
+            if rows[3] <= 0:
+                print("\nOut of stock! Try again!\n")
+            elif reservation is not None:
+                try:
+                    reserve(conn, reservation, [rows[0]])
                     items.append(name)
+                except ValueError:
+                    print("\nOut of stock! Try again!\n")
             else:
-                print("\nProduct not found! Try again!\n")
+                items.append(name)
+        else:
+            print("\nProduct not found! Try again!\n")
         
         cont = input("Do you want to add another item? (y/n): ")
         if cont == "n":
@@ -272,6 +492,58 @@ def choose_items(conn: psycopg.Connection):
 
     return items
 
+def items_by_id(conn: psycopg.Connection, ids: list, check_stock: bool = True):
+    """
+    Look up the names of products to order from their IDs.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        ids (list of int): The product IDs to order. An ID may appear more than once.
+        check_stock (bool): If False, products are not checked for stock, as
+            when the stock is already held by a reservation.
+
+    The non-interactive counterpart of choose_items. Looks the products up in the
+    product catalogue cache and returns the list of item names in the order given.
+    Raises ValueError if a product does not exist or is out of stock.
+    """
+    items = []
+    for id in ids:
+        product = catalog.get(conn, id)
+        if product is None:
+            raise ValueError(f"Product {id} not found")
+        if check_stock and product[3] <= 0:
+            raise ValueError(f"{product[1]} is out of stock")
+        items.append(product[1])
+
+    return items
+
+def add_order_spend(cursor: psycopg.Cursor, name: str, email: str, phone: str, total):
+    """
+    Add an order's total to a customer's spend, adding the customer if they are new.
+
+    Args:
+        cursor (psycopg.Cursor): A cursor in the order's transaction. The caller commits.
+        name (str): The name of the customer.
+        email (str): The normalized email of the customer.
+        phone (str): The phone number of the customer.
+        total (Decimal): The amount to add.
+
+    If customer_cache knows the email, the spend is updated by primary key,
+    which skips the insert attempt and the conflict check on the email index.
+    If that customer has since been deleted, the entry is dropped and the
+    upsert by email is used instead. The cache itself is only filled by the
+    caller, after the order commits. Returns the ID of the customer.
+    """
+    id = customer_cache.get(email)
+    if id is not None:
+        registry.execute(cursor, ADD_SPEND, (total, id))
+        if cursor.rowcount:
+            return id
+        customer_cache.invalidate(id)
+
+    registry.execute(cursor, ADD_ORDER_SPEND, (name, email, phone, total))
+    return cursor.fetchone()[0]
+
 def get_customer_id(conn: psycopg.Connection, name: str, phone: str, email: str):
     """
     Check if a customer exists in the database, and if not, add them.
@@ -282,15 +554,39 @@ def get_customer_id(conn: psycopg.Connection, name: str, phone: str, email: str)
         phone (str): The phone number of the customer.
         email (str): The email of the customer.
 
+    Looks the email up in customer_cache first, then on the unique index on the
+    normalized email. Only a new email is inserted, with ON CONFLICT DO NOTHING
+    and a second lookup if another till added it first, so an existing
+    customer's row is never rewritten. The lookup is committed before the ID is
+    cached, so the cache never holds the ID of a row that was rolled back.
     Returns the ID of the customer, either if they existed or if they were added.
     """
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM customers")
-        rows = cursor.fetchall()
-        for row in rows:
-            if email == row[2]:
-                return row[0]
-        
-        cursor.execute("INSERT INTO customers (customer_name, customer_email, customer_phone, total_spend) VALUES (%s, %s, %s, %s) RETURNING id", (name, email, phone, 0))
-        id = cursor.fetchone()[0]
-        return id
\ No newline at end of file
+    email = normalize_email(email)
+    id = customer_cache.get(email)
+    if id is not None:
+        return id
+
+    try:
+        with conn.cursor() as cursor:
+            registry.execute(cursor, FIND_CUSTOMER, (email,))
+            row = cursor.fetchone()
+            if row is None:
+                registry.execute(cursor, INSERT_CUSTOMER, (name, email, phone, 0))
+                row = cursor.fetchone()
+            if row is None:
+                registry.execute(cursor, FIND_CUSTOMER, (email,))
+                row = cursor.fetchone()
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+    customer_cache.put(email, row[0])
+    return row[0]
+
+ORDER_COMMANDS = [
+    ("View orders", view_orders),
+    ("Create order", prompt_create_order),
+    ("Update order status", prompt_update_orders_status),
+    ("Check open orders by status", prompt_view_orders_by_status),
+]
@@ -0,0 +1,88 @@
+import psycopg
+from queries import registry
+
+PAGE_SIZE = 20
+
+def keyset_page(conn: psycopg.Connection, select: str, where: str = None, params: tuple = (), after: int = None, before: int = None, limit: int = None, name: str = "keyset_page"):
+    """
+    Fetch one page of a query using keyset pagination on the id column.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        select (str): The SELECT ... FROM part of the query. Its first column must be id.
+        where (str): An optional extra condition, with %s placeholders for `params`.
+        params (tuple): The parameters of the `where` condition.
+        after (int): Return rows with an ID greater than this one.
+        before (int): Return rows with an ID less than this one.
+        limit (int): The maximum number of rows. If None, every matching row is returned.
+        name (str): The name the query is timed under in the query registry.
+
+    Pages are found with `WHERE id > last_id LIMIT n` rather than OFFSET, so every
+    page costs one index range scan however deep into the table it is. Rows are
+    read through a server-side named cursor, so the result is not sent to the
+    client all at once. Returns a list of rows sorted by ID.
+    """
+    conditions = [where] if where else []
+    params = list(params)
+    order = "ASC"
+
+    if after is not None:
+        conditions.append("id > %s")
+        params.append(after)
+    elif before is not None:
+        conditions.append("id < %s")
+        params.append(before)
+        order = "DESC"
+
+    query = select
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY id {order}"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    with conn.cursor(name="keyset_page") as cursor, registry.timed(name):
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    if order == "DESC":
+        rows.reverse()
+    return rows
+
+def browse(fetch: callable, show: callable, limit: int = PAGE_SIZE):
+    """
+    Page interactively through a listing.
+
+    Args:
+        fetch (function): Called as fetch(after=..., before=..., limit=...) and
+            returns a list of rows whose first field is the ID.
+        show (function): Called with each page of rows to print it.
+        limit (int): The number of rows per page.
+
+    Shows the first page, then lets the user move forward with 'n', back with
+    'p' and leave with 'q'.
+    """
+    rows = fetch(after=None, before=None, limit=limit)
+    if not rows:
+        print("\nNothing to show!\n")
+        return
+    show(rows)
+
+    while True:
+        choice = input("\n(n) Next page  (p) Previous page  (q) Back: ").lower()
+        if choice == "n":
+            page = fetch(after=rows[-1][0], before=None, limit=limit)
+        elif choice == "p":
+            page = fetch(after=None, before=rows[0][0], limit=limit)
+        elif choice == "q":
+            return
+        else:
+            print("Invalid option!")
+            continue
+
+        if page:
+            rows = page
+            show(rows)
+        else:
+            print("\nNo more pages that way!\n")
@@ -1,60 +1,73 @@
-import os
 import psycopg
-
-def product_menu(conn: psycopg.Connection, menu: callable):
-    """
-    Menu for managing products in the database.
-
-    Args:
-        conn (psycopg.Connection): A connection to the PostgreSQL database.
-        menu (function): The function to call to go back to the main menu.
-
-    This function provides a menu for managing products in the database. The
-    user can view all products, create a new product, update a product or delete
-    a product. The user can also go back to the main menu by selecting option 0.
-    """
-    while True:
-
-        opt = int(input("\n\n1. View products\n2. Create product\n3. Update product\n4. Delete product\n0. Main menu\n"))
-
-        if opt == 1:
-            view_products(conn)
-
-        elif opt == 2:
-            new_product = input("Enter new product name: ")
-            new_price = input("Enter new product price: ")
-            stock = input("Enter new product stock Qty: ")
-            create_product(new_product, new_price,stock, conn)
-
-        elif opt == 3:
-            to_update = int(input("Enter product Id to update: "))
-            choice = input("Would you like to update the name? (y/n): ").lower()
-            if choice == 'y':
-                new_update = input("Enter new product name: ")
-            else:
-                new_update = ''
-            choice = input("Would you like to update the price? (y/n): ").lower()
-            if choice == 'y':
-                new_price = input("Enter new product price: ")
-            else:
-                new_price = ''
-            choice = input("Would you like to update the stock? (y/n): ").lower()
-            if choice == 'y':
-                new_stock = input("Enter new product stock: ")
-            else:
-                new_stock = ''
-            update_product(to_update, new_update.capitalize(), new_price, new_stock, conn)
-
-        elif opt == 4:
-            to_delete = int(input("Enter product Id to delete: "))
-            delete_product(to_delete, conn)
-
-        elif opt == 0:
-            os.system('cls')
-            menu(conn)
-
-        else:
-            print("Invalid option!")
+from catalog import catalog
+from paging import browse, keyset_page
+from queries import registry
+from stock import low_stock_products, set_low_stock_threshold
+from updates import update_rows
+
+PRODUCT_COLUMNS = ("id", "name", "price", "stock")
+
+INSERT_PRODUCT = registry.register("products.insert", "INSERT INTO products (name, price, stock) VALUES (%s, %s, %s) RETURNING id")
+DELETE_PRODUCT = registry.register("products.delete", "DELETE FROM products WHERE id = %s")
+
+def prompt_create_product(conn: psycopg.Connection):
+    """Ask for the details of a new product and create it."""
+    new_product = input("Enter new product name: ")
+    new_price = input("Enter new product price: ")
+    stock = input("Enter new product stock Qty: ")
+    create_product(new_product, new_price,stock, conn)
+    print("\nProduct created!\n")
+
+def prompt_update_product(conn: psycopg.Connection):
+    """Ask which product to update and which of its fields to change, then update it."""
+    to_update = int(input("Enter product Id to update: "))
+    choice = input("Would you like to update the name? (y/n): ").lower()
+    if choice == 'y':
+        new_update = input("Enter new product name: ")
+    else:
+        new_update = ''
+    choice = input("Would you like to update the price? (y/n): ").lower()
+    if choice == 'y':
+        new_price = input("Enter new product price: ")
+    else:
+        new_price = ''
+    choice = input("Would you like to update the stock? (y/n): ").lower()
+    if choice == 'y':
+        new_stock = input("Enter new product stock: ")
+    else:
+        new_stock = ''
+    update_product(to_update, new_update.capitalize(), new_price, new_stock, conn)
+
+def prompt_delete_product(conn: psycopg.Connection):
+    """Ask which product to delete and delete it."""
+    to_delete = int(input("Enter product Id to delete: "))
+    delete_product(to_delete, conn)
+
+def show_catalog_stats(conn: psycopg.Connection):
+    """Print the product catalogue cache statistics."""
+    stats = catalog.stats()
+    print(f"\nCached products: {stats['products']}\nListening for changes: {'yes' if stats['listening'] else 'no'}")
+    print(f"Hits: {stats['hits']}\nMisses: {stats['misses']}\nHit ratio: {stats['hit_ratio']:.1%}\n")
+
+def view_low_stock(conn: psycopg.Connection):
+    """Display the products at or below their low-stock threshold."""
+    rows = low_stock_products(conn)
+    if not rows:
+        print("\nNo products are low on stock.\n")
+        return
+    print(f"\n{'ID':<5}{'Name':<25}{'Stock':<10}{'Threshold':<10}")
+    for x in rows:
+        print(f"{x[0]:<5}{x[1]:<25}{x[2]:<10}{x[3]:<10}")
+    print()
+
+def prompt_low_stock_threshold(conn: psycopg.Connection):
+    """Ask for a product and the stock level at which it should raise a low-stock alert."""
+    id = int(input("Enter product Id: "))
+    threshold = int(input("Alert when stock falls to: "))
+    if set_low_stock_threshold(conn, id, threshold):
+        print("\nLow stock threshold updated!\n")
+    else:
+        print("\nProduct not found! Try again!\n")
 
 def view_products(conn: psycopg.Connection):
 
@@ -64,19 +77,33 @@ def view_products(conn: psycopg.Connection):
         Args:
             conn (psycopg.Connection): A connection to the PostgreSQL database.
 
-        Retrieves all products from the database, sorted by ID, and displays them in a formatted table with
+        Retrieves the products from the database one page at a time, sorted by ID, and displays them in a formatted table with
         columns for ID, Name, Price, and Quantity in Stock. The table headers are left-aligned and each row is
         also left-aligned.
         """
-        
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM products ORDER BY id ASC")
-            rows = cursor.fetchall()
 
-            print(f"\nOur available products are:\n")
-            print(f"{'ID':<5}{'Name':<25}{'Price':<10}{'Qty in Stock':<10}")
-            for x in rows:
-                print(f"{x[0]:<}. {x[1]:<25}  £{x[2]:<10}  {x[3]:<10}")
+        browse(lambda **page: list_products(conn, **page), show_products)
+
+def show_products(rows: list):
+    """Print a page of products as a table with columns for ID, Name, Price, and Quantity in Stock."""
+    print(f"\nOur available products are:\n")
+    print(f"{'ID':<5}{'Name':<25}{'Price':<10}{'Qty in Stock':<10}")
+    for x in rows:
+        print(f"{x[0]:<}. {x[1]:<25}  £{x[2]:<10}  {x[3]:<10}")
+
+def list_products(conn: psycopg.Connection, after: int = None, before: int = None, limit: int = None):
+    """
+    Retrieve products from the database, optionally one page at a time.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        after (int): Only return rows with an ID greater than this one.
+        before (int): Only return rows with an ID less than this one.
+        limit (int): The maximum number of rows to return. If None, all rows are returned.
+
+    Returns a list of rows sorted by ID, with the fields named in PRODUCT_COLUMNS.
+    """
+    return keyset_page(conn, "SELECT id, name, price, stock FROM products", after=after, before=before, limit=limit, name="products.list")
 
 def create_product(new_product: str, new_price: float, stock: int, conn: psycopg.Connection):
     """
@@ -89,12 +116,14 @@ def create_product(new_product: str, new_price: float, stock: int, conn: psycopg
         conn (psycopg.Connection): A connection to the PostgreSQL database.
 
     Inserts the new product with its name, price, and stock quantity into the products table, and commits the changes to the database.
+    Returns the ID of the new product.
     """
 
     with conn.cursor() as cursor:
-        cursor.execute("INSERT INTO products (name, price, stock) VALUES (%s, %s, %s)", (new_product.title(), new_price, stock))
+        registry.execute(cursor, INSERT_PRODUCT, (new_product.title(), new_price, stock))
+        id = cursor.fetchone()[0]
         conn.commit()
-        print("\nProduct created!\n")
+        return id
 
 
 def update_product(to_update: int, new_update: str, new_price: float, new_stock: int, conn: psycopg.Connection):
@@ -108,32 +137,40 @@ def update_product(to_update: int, new_update: str, new_price: float, new_stock:
         new_stock (str): The new stock quantity of the product. If not updating, pass an empty string.
         conn (psycopg.Connection): A connection to the PostgreSQL database.
 
-    Updates the product's name, price, and/or stock if specified, and commits the changes to the database.
-    If the product ID does not exist, prints a message indicating the product was not found.
+    The changed fields are written with one UPDATE, which also tells whether the product exists, and
+    the changes are committed to the database. If the product ID does not exist, prints a message indicating the product was not found.
+    Returns True if the product was found.
     """
+    updated = update_products(conn, [(to_update, {"name": new_update, "price": new_price, "stock": new_stock})])
 
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM products")
-        rows = cursor.fetchall()
-        names = []
-        for x in rows:
-            names.append(x[0])
-
-        if to_update in names:
-            
-            if len(new_update) > 0:
-                cursor.execute("UPDATE products SET name = %s WHERE id = %s", (new_update.title(), to_update,))
-            if len(new_price) > 0:
-                cursor.execute("UPDATE products SET price = %s WHERE id = %s", (new_price, to_update,))
-            if len(new_stock) > 0:
-                cursor.execute("UPDATE products SET stock = %s WHERE id = %s", (new_stock, to_update,))
+    if updated[0]:
+        print("\nProduct updated!\n")
+    else:
+        print("\nProduct to update not found! Try again!\n")
+    return updated[0]
 
-            conn.commit()
-            print("\nProduct updated!\n")
-        else:
-            print("\nProduct to update not found! Try again!\n")
-        cursor.execute("SELECT setval('products_id_seq', (SELECT MAX(id) FROM products));")
-        conn.commit()
+def update_products(conn: psycopg.Connection, edits: list):
+    """
+    Update several products in one transaction and one round-trip.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        edits (list): (id, fields) pairs, where fields is a dict with any of the
+            keys name, price and stock. Empty strings and None leave a field unchanged.
+
+    Names are stored in title case. Every edit is sent in pipeline mode through
+    updates.update_rows, and nothing is changed if any edit fails, for example
+    on negative stock. Returns a list of booleans telling whether each product
+    was found.
+    """
+    changes = []
+    for id, fields in edits:
+        fields = {column: None if fields.get(column) == "" else fields.get(column) for column in ("name", "price", "stock")}
+        if fields["name"]:
+            fields["name"] = fields["name"].title()
+        changes.append((id, fields))
+
+    return [row is not None for row in update_rows(conn, "products", changes)]
 
 def delete_product(to_delete: int, conn: psycopg.Connection):
 
@@ -144,24 +181,31 @@ def delete_product(to_delete: int, conn: psycopg.Connection):
         to_delete (int): The ID of the product to be deleted.
         conn (psycopg.Connection): A connection to the PostgreSQL database.
 
-    The function checks if the product ID exists in the database. If it does, 
-    it deletes the product and updates the products_id_seq. If the product 
-    is not found, it notifies the user.
+    The function deletes the product and tells from the number of deleted rows
+    whether it existed. IDs are not reused afterwards, as sales history refers to
+    them. If the product is not found, or appears in existing orders, it notifies the user.
     """
 
     with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM products")
-        rows = cursor.fetchall()
-        names = []
-        for x in rows:
-            names.append(x[0])
-
-        if to_delete in names:
-            cursor.execute("DELETE FROM products WHERE id = %s", (to_delete,))
+        try:
+            registry.execute(cursor, DELETE_PRODUCT, (to_delete,))
+        except psycopg.errors.ForeignKeyViolation:
+            conn.rollback()
+            print("\nProduct has existing orders and cannot be deleted! Set its stock to 0 instead.\n")
+            return
+
+        if cursor.rowcount == 0:
+            print("\nProduct to delete not found! Try again!\n")
+        else:
             conn.commit()
             print("\nProduct deleted.\n")
-        else:
-            print("\nProduct to delete not found! Try again!\n")
-        
-        cursor.execute("SELECT setval('products_id_seq', (SELECT MAX(id) FROM products));")
-        conn.commit()
\ No newline at end of file
+
+PRODUCT_COMMANDS = [
+    ("View products", view_products),
+    ("Create product", prompt_create_product),
+    ("Update product", prompt_update_product),
+    ("Delete product", prompt_delete_product),
+    ("Catalogue cache statistics", show_catalog_stats),
+    ("View low stock products", view_low_stock),
+    ("Set low stock threshold", prompt_low_stock_threshold),
+]
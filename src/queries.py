@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+import psycopg
+
+# Upper bounds in seconds of the latency histogram buckets, as in Prometheus.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRICS_FILE = os.getenv('METRICS_FILE', 'cafe_queries.prom')
+
+class QueryStats:
+    """Call count, error count and latency histogram of one named query."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, failed: bool):
+        """Record one call that took `seconds`."""
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float):
+        """Estimate a latency quantile, as the upper bound of the bucket it falls in (capped at the slowest call)."""
+        if self.calls == 0:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+class QueryRegistry:
+    """
+    Named SQL statements with per-query latency metrics.
+
+    Each module registers its statements by name when it is imported, so every
+    query the application runs can be listed in one place. Statements run with
+    execute are prepared server-side on first use on each connection, and every
+    call is timed into a histogram with the buckets in BUCKETS. All methods are
+    safe to call from several threads.
+    """
+
+    def __init__(self):
+        self.queries = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def register(self, name: str, text: str):
+        """
+        Add a statement to the registry.
+
+        Args:
+            name (str): A dotted name for the statement, such as "orders.insert".
+            text (str): The SQL, with %s placeholders.
+
+        Returns the name, to be passed to execute.
+        """
+        if self.queries.get(name, text) != text:
+            raise ValueError(f"Query {name} is already registered with different SQL")
+        self.queries[name] = text
+        return name
+
+    def execute(self, cursor: psycopg.Cursor, name: str, params=None):
+        """
+        Run a registered statement as a prepared statement and time it.
+
+        Args:
+            cursor (psycopg.Cursor): The cursor to run the statement on.
+            name (str): The registered name of the statement.
+            params: The parameters of the statement.
+
+        Returns the cursor, so results can be fetched from it.
+        """
+        with self.timed(name):
+            cursor.execute(self.queries[name], params, prepare=True)
+        return cursor
+
+    async def aexecute(self, cursor: psycopg.AsyncCursor, name: str, params=None):
+        """The asyncio counterpart of execute, for a cursor on an AsyncConnection. Returns the cursor."""
+        with self.timed(name):
+            await cursor.execute(self.queries[name], params, prepare=True)
+        return cursor
+
+    @contextmanager
+    def timed(self, name: str):
+        """Time the body of a with block as one call of `name`, for queries that are not run through execute."""
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.observe(name, time.perf_counter() - start, failed)
+
+    def observe(self, name: str, seconds: float, failed: bool = False):
+        """Record one call of a query."""
+        with self.lock:
+            if name not in self.stats:
+                self.stats[name] = QueryStats()
+            self.stats[name].observe(seconds, failed)
+
+    def snapshot(self):
+        """
+        Summarize the metrics of every query called so far.
+
+        Returns a list of (name, calls, errors, total_seconds, p50, p95, p99, max)
+        tuples, the query with the most total time first.
+        """
+        with self.lock:
+            rows = [
+                (name, s.calls, s.errors, s.seconds, s.quantile(0.5), s.quantile(0.95), s.quantile(0.99), s.max)
+                for name, s in self.stats.items()
+            ]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+    def reset(self):
+        """Forget the metrics collected so far."""
+        with self.lock:
+            self.stats = {}
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP cafe_query_duration_seconds Latency of named database queries.",
+            "# TYPE cafe_query_duration_seconds histogram",
+        ]
+        errors = [
+            "# HELP cafe_query_errors_total Named database queries that raised an error.",
+            "# TYPE cafe_query_errors_total counter",
+        ]
+        with self.lock:
+            for name, s in sorted(self.stats.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), s.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'cafe_query_duration_seconds_bucket{{query="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'cafe_query_duration_seconds_sum{{query="{name}"}} {s.seconds}')
+                lines.append(f'cafe_query_duration_seconds_count{{query="{name}"}} {s.calls}')
+                errors.append(f'cafe_query_errors_total{{query="{name}"}} {s.errors}')
+        return "\n".join(lines + errors) + "\n"
+
+    def write_prometheus(self, path: str = METRICS_FILE):
+        """
+        Write the metrics to a Prometheus text file, e.g. for node_exporter's textfile collector.
+
+        Args:
+            path (str): The file to write. It is replaced atomically, so a
+                scraper never reads it half written.
+        """
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            file.write(self.prometheus())
+        os.replace(temporary, path)
+
+registry = QueryRegistry()
+
+def view_query_metrics(conn: psycopg.Connection):
+    """Display the call count and latency of every query run so far."""
+    rows = registry.snapshot()
+    if not rows:
+        print("\nNo queries have been run yet.\n")
+        return
+    print(f"\n{'Query':<34}{'Calls':<9}{'Errors':<8}{'Total ms':<11}{'p50 ms':<9}{'p95 ms':<9}{'p99 ms':<9}{'Max ms':<9}\n{'-'*98}")
+    for name, calls, errors, seconds, p50, p95, p99, slowest in rows:
+        print(f"{name:<34}{calls:<9}{errors:<8}{seconds * 1000:<11.1f}{p50 * 1000:<9.2f}{p95 * 1000:<9.2f}{p99 * 1000:<9.2f}{slowest * 1000:<9.2f}")
+    print()
+
+def view_registered_queries(conn: psycopg.Connection):
+    """List the name and SQL of every registered statement."""
+    for name, text in sorted(registry.queries.items()):
+        print(f"\n{name}\n    {' '.join(text.split())}")
+    print()
+
+def prompt_write_metrics(conn: psycopg.Connection):
+    """Ask for a file name and write the query metrics to it in Prometheus format."""
+    path = input(f"Metrics file (default {METRICS_FILE}): ").strip() or METRICS_FILE
+    registry.write_prometheus(path)
+    print(f"\nMetrics written to {path}!\n")
+
+def prompt_reset_metrics(conn: psycopg.Connection):
+    """Clear the query metrics."""
+    registry.reset()
+    print("\nQuery metrics reset!\n")
+
+DIAGNOSTICS_COMMANDS = [
+    ("Query latency", view_query_metrics),
+    ("Registered queries", view_registered_queries),
+    ("Write Prometheus metrics file", prompt_write_metrics),
+    ("Reset query metrics", prompt_reset_metrics),
+]
@@ -0,0 +1,329 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime
+import psycopg
+from balancer import balancer
+from connection import connect
+from migrations import parse_legacy_items
+from orders import place_order, update_orders_status
+from workload import percentile
+
+OPERATIONS = ("create_order", "update_order_status")
+DEADLOCK = "40P01"
+SERIALIZATION_FAILURE = "40001"
+MAX_RETRIES = 3
+RETRY_DELAY = 0.01
+# Time given to the worker processes to start and connect before the first
+# event is due, so the start of the trace is not replayed late.
+STARTUP_DELAY = 2.0
+LOCK_SAMPLE_INTERVAL = 0.5
+
+def parse_time(value):
+    """Return a trace timestamp, either ISO 8601 text or seconds, as seconds since the epoch."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def load_jsonl(path: str):
+    """
+    Read an order trace from a JSON lines file.
+
+    Args:
+        path (str): The trace file. Each line is one operation, either
+            {"at": ..., "op": "create_order", "order": ..., "customer_name": ...,
+            "customer_address": ..., "customer_phone": ..., "customer_email": ...,
+            "items": ["Latte", ...]} or
+            {"at": ..., "op": "update_order_status", "order": ..., "status": "ready"}.
+            "at" is an ISO 8601 timestamp or a number of seconds, and "order" is
+            any key that ties an order's status changes to its creation.
+
+    Returns a list of (offset, order, op, args) events, ordered by offset, the
+    number of seconds after the first event.
+    """
+    events = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["op"] == "create_order":
+                args = (event["customer_name"], event["customer_address"], event["customer_phone"], event["customer_email"], event["items"])
+            elif event["op"] == "update_order_status":
+                args = (event["status"],)
+            else:
+                raise ValueError(f"Unknown operation {event['op']} in {path}")
+            events.append((parse_time(event["at"]), event["order"], event["op"], args))
+    return rebase(events)
+
+def load_export(orders_path: str):
+    """
+    Rebuild an order trace from the CSV files written by the export menu.
+
+    Args:
+        orders_path (str): The exported orders file, e.g. csv/orders_2025-01-31.csv.
+            The order_items and products files of the same export are read from
+            beside it.
+
+    Each order is created at its created_at with its order_items, or with its
+    legacy items column if it has none. The export only keeps an order's last
+    change, so an order that was closed is taken to have become ready halfway
+    between being placed and its updated_at, and closed at updated_at. Returns
+    a list of events as returned by load_jsonl.
+    """
+    directory, name = os.path.split(orders_path)
+    suffix = name[len("orders_"):]
+
+    with open(os.path.join(directory, "products_" + suffix), newline="") as file:
+        products = {row["id"]: row["name"] for row in csv.DictReader(file)}
+
+    items = {}
+    with open(os.path.join(directory, "order_items_" + suffix), newline="") as file:
+        for row in csv.DictReader(file):
+            if row["product_id"] in products:
+                items.setdefault(row["order_id"], []).extend([products[row["product_id"]]] * int(row["qty"]))
+
+    events = []
+    with open(orders_path, newline="") as file:
+        for row in csv.DictReader(file):
+            created = parse_time(row["created_at"])
+            updated = parse_time(row["updated_at"])
+            lines = items.get(row["id"]) or parse_legacy_items(row["items"])
+            events.append((created, row["id"], "create_order",
+                           (row["customer_name"], row["customer_address"], row["customer_phone"], row["customer_email"], lines)))
+            if row["status"] == "ready":
+                events.append((updated, row["id"], "update_order_status", ("ready",)))
+            elif row["status"] in ("collected", "abandoned"):
+                events.append(((created + updated) / 2, row["id"], "update_order_status", ("ready",)))
+                events.append((updated, row["id"], "update_order_status", (row["status"],)))
+    return rebase(events)
+
+def rebase(events: list):
+    """Sort events by time and make their times offsets from the first one."""
+    events.sort(key=lambda event: event[0])
+    if not events:
+        return events
+    first = events[0][0]
+    return [(at - first, order, op, args) for at, order, op, args in events]
+
+def split_events(events: list, workers: int):
+    """
+    Deal events out to workers so that every event of one order goes to the same worker.
+
+    Args:
+        events (list): The events, as returned by load_jsonl.
+        workers (int): The number of worker processes.
+
+    Orders are dealt round-robin in the order they first appear, so each worker
+    gets about the same share of the traffic, and an order's status changes are
+    always replayed after its creation, on the connection that knows its new
+    ID. Returns one list of events per worker, each still in time order.
+    """
+    owner = {}
+    shares = [[] for _ in range(workers)]
+    for event in events:
+        worker = owner.setdefault(event[1], len(owner) % workers)
+        shares[worker].append(event)
+    return shares
+
+def replay_worker(events: list, start: float, speed: float):
+    """
+    Replay one worker's share of a trace on its own connection.
+
+    Args:
+        events (list): The events to replay, in time order.
+        start (float): The wall-clock time, in seconds since the epoch, that
+            offset 0 of the trace is replayed at.
+        speed (float): How many times faster than recorded to replay, or 0 to
+            replay as fast as possible.
+
+    Orders are placed with orders.place_order and moved on with
+    orders.update_orders_status, the same calls the tills make, with a courier
+    from the balancer. A deadlock or serialization failure is retried up to
+    MAX_RETRIES times. A status change the order's current status does not
+    allow counts as rejected, and status changes of orders whose creation
+    failed are skipped. Returns a dict of latencies, lag behind the schedule, error counts
+    and retries.
+    """
+    conn = connect()
+    ids = {}
+    result = {
+        "latencies": {op: [] for op in OPERATIONS},
+        "errors": {op: 0 for op in OPERATIONS},
+        "lag": [],
+        "rejected": 0,
+        "skipped": 0,
+        "deadlocks": 0,
+        "serialization_failures": 0,
+        "retries": 0,
+    }
+
+    try:
+        for offset, order, op, args in events:
+            if speed > 0:
+                due = start + offset / speed
+                wait = due - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                result["lag"].append(max(0.0, time.time() - due))
+
+            if op == "update_order_status" and order not in ids:
+                result["skipped"] += 1
+                continue
+
+            began = time.perf_counter()
+            for attempt in range(MAX_RETRIES + 1):
+                courier_id = None
+                try:
+                    if op == "create_order":
+                        courier_id, courier = balancer.assign(conn)
+                        ids[order] = place_order(conn, *args[:4], courier_id, args[4])[0]
+                    elif not update_orders_status(conn, [ids[order]], args[0]):
+                        result["rejected"] += 1
+                    break
+                except ValueError:
+                    conn.rollback()
+                    if courier_id is not None:
+                        balancer.release(courier_id)
+                    result["rejected"] += 1
+                    break
+                except psycopg.Error as e:
+                    conn.rollback()
+                    if courier_id is not None:
+                        balancer.release(courier_id)
+                    if e.sqlstate == DEADLOCK:
+                        result["deadlocks"] += 1
+                    elif e.sqlstate == SERIALIZATION_FAILURE:
+                        result["serialization_failures"] += 1
+                    else:
+                        result["errors"][op] += 1
+                        break
+                    if attempt == MAX_RETRIES:
+                        result["errors"][op] += 1
+                        break
+                    result["retries"] += 1
+                    time.sleep(RETRY_DELAY * (attempt + 1))
+            result["latencies"][op].append(time.perf_counter() - began)
+    finally:
+        conn.close()
+    return result
+
+def sample_lock_waits(stop: threading.Event, samples: list):
+    """Count the backends waiting on a lock every LOCK_SAMPLE_INTERVAL seconds until stopped."""
+    conn = connect()
+    conn.autocommit = True
+    try:
+        while not stop.wait(LOCK_SAMPLE_INTERVAL):
+            row = conn.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database() AND wait_event_type = 'Lock'").fetchone()
+            samples.append(row[0])
+    finally:
+        conn.close()
+
+def database_deadlocks(conn: psycopg.Connection):
+    """Return the number of deadlocks the server has detected in this database."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        deadlocks = cursor.fetchone()[0]
+    conn.rollback()
+    return deadlocks
+
+def replay(events: list, workers: int, speed: float):
+    """
+    Replay an order trace from a pool of worker processes, each with its own connection.
+
+    Args:
+        events (list): The events, as returned by load_jsonl or load_export.
+        workers (int): The number of worker processes, i.e. concurrent tills.
+        speed (float): How many times faster than recorded to replay, e.g. 50,
+            or 0 to replay as fast as possible.
+
+    Processes rather than threads drive the load, so the replay is not held
+    back by the GIL of one Python process at high speeds. While it runs, the
+    backends waiting on a lock are sampled as a measure of contention, and the
+    server's deadlock counter is read before and after. The lag is how late
+    events started against the schedule; if it keeps growing, the database
+    cannot keep up with that speed. Returns a dict with the count, errors and
+    latency percentiles in milliseconds of each operation, and the throughput,
+    lag, lock waits, deadlocks, serialization failures and retries of the run.
+    """
+    conn = connect()
+    deadlocks_before = database_deadlocks(conn)
+
+    stop = threading.Event()
+    lock_waits = []
+    sampler = threading.Thread(target=sample_lock_waits, args=(stop, lock_waits), daemon=True)
+    sampler.start()
+
+    start = time.time() + STARTUP_DELAY
+    began = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.starmap(replay_worker, [(share, start, speed) for share in split_events(events, workers)])
+    elapsed = time.perf_counter() - began - (STARTUP_DELAY if speed > 0 else 0)
+
+    stop.set()
+    sampler.join()
+    deadlocks = database_deadlocks(conn) - deadlocks_before
+    conn.close()
+
+    def summarize(latencies: list, errors: int):
+        return {
+            "count": len(latencies),
+            "errors": errors,
+            "mean_ms": sum(latencies) * 1000 / len(latencies) if latencies else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "ops_per_sec": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        }
+
+    report = {op: summarize([l for r in results for l in r["latencies"][op]], sum(r["errors"][op] for r in results)) for op in OPERATIONS}
+    report["total"] = summarize([l for r in results for op in OPERATIONS for l in r["latencies"][op]], sum(sum(r["errors"].values()) for r in results))
+    lag = [l for r in results for l in r["lag"]]
+    report["run"] = {
+        "seconds": elapsed,
+        "trace_seconds": events[-1][0] if events else 0.0,
+        "workers": workers,
+        "speed": speed,
+        "lag_p50_ms": percentile(lag, 50) * 1000,
+        "lag_p99_ms": percentile(lag, 99) * 1000,
+        "lock_waits_mean": sum(lock_waits) / len(lock_waits) if lock_waits else 0.0,
+        "lock_waits_max": max(lock_waits, default=0),
+        "deadlocks": sum(r["deadlocks"] for r in results),
+        "server_deadlocks": deadlocks,
+        "serialization_failures": sum(r["serialization_failures"] for r in results),
+        "retries": sum(r["retries"] for r in results),
+        "rejected": sum(r["rejected"] for r in results),
+        "skipped": sum(r["skipped"] for r in results),
+    }
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded till traffic against the database from several processes")
+    parser.add_argument("trace", help="a JSON lines trace, or an orders CSV file written by the export menu")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--speed", type=float, default=1.0, help="times faster than recorded, e.g. 50; 0 replays as fast as possible")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    events = load_export(args.trace) if args.trace.endswith(".csv") else load_jsonl(args.trace)
+    print(f"Replaying {len(events)} events over {args.workers} workers at {'full speed' if args.speed <= 0 else f'{args.speed:g}x'}...")
+    report = replay(events, args.workers, args.speed)
+
+    print(f"\n{'Operation':<24}{'Count':<8}{'Errors':<8}{'p50 ms':<10}{'p95 ms':<10}{'p99 ms':<10}{'Ops/sec':<10}")
+    for name in OPERATIONS + ("total",):
+        r = report[name]
+        print(f"{name:<24}{r['count']:<8}{r['errors']:<8}{r['p50_ms']:<10.2f}{r['p95_ms']:<10.2f}{r['p99_ms']:<10.2f}{r['ops_per_sec']:<10.1f}")
+    run = report["run"]
+    print(f"\nReplayed {run['trace_seconds']:.0f}s of traffic in {run['seconds']:.1f}s, lag p50 {run['lag_p50_ms']:.1f} ms, p99 {run['lag_p99_ms']:.1f} ms")
+    print(f"Lock waits: mean {run['lock_waits_mean']:.1f}, max {run['lock_waits_max']} backends")
+    print(f"Deadlocks: {run['deadlocks']} (server: {run['server_deadlocks']}), serialization failures: {run['serialization_failures']}, retries: {run['retries']}")
+    print(f"Rejected (stock or status): {run['rejected']}, skipped status changes: {run['skipped']}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nResults written to {args.output}")
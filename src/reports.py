@@ -0,0 +1,275 @@
+import argparse
+import glob
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from pandas.api.types import CategoricalDtype, union_categoricals
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+load_dotenv()
+
+CHUNK_SIZE = 100_000
+BURNDOWN_DAYS = 14
+REPORT_TIMEZONE = os.getenv('REPORT_TIMEZONE', 'UTC')
+
+STATUS_DTYPE = CategoricalDtype(["preparing", "ready", "collected", "abandoned"])
+
+# The columns each report needs from an exported table, with the dtype they are
+# stored in once loaded. "category" columns are dictionary encoded, so a million
+# orders cost one small integer each for their courier name instead of a string.
+TABLE_COLUMNS = {
+    "orders": {"id": "int64", "status": STATUS_DTYPE, "courier": "category", "courier_id": "Int32", "created_at": "datetime"},
+    "order_items": {"order_id": "int64", "product_id": "int32", "qty": "int32", "unit_price": "float64"},
+    "products": {"id": "int32", "name": "category", "price": "float64", "stock": "Int32"},
+}
+
+def latest_export(directory: str, table: str):
+    """
+    Find the newest full export of a table written by export.export_tables.
+
+    Args:
+        directory (str): The folder the exports were written to.
+        table (str): The table to look for.
+
+    Incremental exports only hold changed rows, so they are skipped. Returns the
+    path of the newest CSV or Parquet file, or raises FileNotFoundError.
+    """
+    paths = [
+        path for path in glob.glob(os.path.join(directory, f"{table}_*"))
+        if path.endswith((".csv", ".parquet")) and "_incremental" not in path
+    ]
+    if not paths:
+        raise FileNotFoundError(f"No export of {table} found in {directory}. Export the data first.")
+    return max(paths, key=lambda path: os.path.basename(path).split(".")[0])
+
+def read_chunks(path: str, columns: list, chunksize: int):
+    """Yield a file's wanted columns as DataFrames of at most `chunksize` rows, from CSV or Parquet."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("Reading Parquet exports needs pyarrow. Install it with: pip install pyarrow")
+        file = pq.ParquetFile(path)
+        present = [column for column in columns if column in file.schema_arrow.names]
+        for batch in file.iter_batches(batch_size=chunksize, columns=present):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=lambda column: column in columns, chunksize=chunksize)
+
+def cast_chunk(chunk: pd.DataFrame, dtypes: dict):
+    """Convert the columns of one chunk to their report dtypes."""
+    for column, dtype in dtypes.items():
+        if column not in chunk:
+            continue
+        if dtype == "datetime":
+            chunk[column] = pd.to_datetime(chunk[column], utc=True, format="ISO8601")
+        else:
+            chunk[column] = chunk[column].astype(dtype)
+    return chunk
+
+def load_table(directory: str, table: str, chunksize: int = CHUNK_SIZE):
+    """
+    Load the newest export of a table into a typed, columnar DataFrame.
+
+    Args:
+        directory (str): The folder the exports were written to.
+        table (str): "orders", "order_items" or "products".
+        chunksize (int): The number of rows read and converted at a time.
+
+    Only the columns in TABLE_COLUMNS are read, and each chunk is converted to
+    its compact dtype before the next one is read, so the file is never held
+    as Python strings all at once. Category columns whose values differ between
+    chunks are merged with union_categoricals. Orders exported before
+    orders.created_at existed fall back to updated_at for their time.
+    """
+    dtypes = TABLE_COLUMNS[table]
+    columns = list(dtypes)
+    if table == "orders":
+        columns.append("updated_at")
+
+    chunks = []
+    for chunk in read_chunks(latest_export(directory, table), columns, chunksize):
+        if table == "orders" and "created_at" not in chunk and "updated_at" in chunk:
+            chunk = chunk.rename(columns={"updated_at": "created_at"})
+        chunks.append(cast_chunk(chunk.drop(columns=["updated_at"], errors="ignore"), dtypes))
+
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype="datetime64[ns, UTC]" if dtype == "datetime" else dtype) for column, dtype in dtypes.items()})
+
+    merged = {}
+    for column in chunks[0].columns:
+        if dtypes.get(column) == "category":
+            merged[column] = union_categoricals([chunk[column] for chunk in chunks], ignore_order=True)
+    frame = pd.concat([chunk.drop(columns=list(merged)) for chunk in chunks], ignore_index=True)
+    for column, values in merged.items():
+        frame[column] = pd.Categorical(values)
+    return frame
+
+def basket_analysis(items: pd.DataFrame, products: pd.DataFrame, min_orders: int = 2, top: int = 20):
+    """
+    Find the products most often bought together.
+
+    Args:
+        items (pd.DataFrame): order_items, as returned by load_table.
+        products (pd.DataFrame): products, as returned by load_table.
+        min_orders (int): Pairs bought together in fewer orders than this are left out.
+        top (int): The number of pairs to return.
+
+    Every order is joined with itself on order_id to list the product pairs in
+    it, and the pairs are counted with one groupby. Support is the share of
+    orders containing the pair; confidence is the share of orders with the first
+    product that also have the second; lift is how much more often the pair
+    occurs than it would by chance. Returns a DataFrame sorted by lift.
+    """
+    orders = items["order_id"].nunique()
+    lines = items[["order_id", "product_id"]].drop_duplicates()
+    pairs = lines.merge(lines, on="order_id", suffixes=("_a", "_b"))
+    pairs = pairs[pairs["product_id_a"] < pairs["product_id_b"]]
+
+    counts = pairs.groupby(["product_id_a", "product_id_b"]).size().rename("orders").reset_index()
+    counts = counts[counts["orders"] >= min_orders]
+
+    product_orders = lines["product_id"].value_counts()
+    support_a = counts["product_id_a"].map(product_orders).to_numpy() / orders
+    support_b = counts["product_id_b"].map(product_orders).to_numpy() / orders
+    counts["support"] = counts["orders"].to_numpy() / orders
+    counts["confidence"] = counts["support"].to_numpy() / support_a
+    counts["lift"] = counts["support"].to_numpy() / (support_a * support_b)
+
+    names = products.set_index("id")["name"]
+    counts.insert(1, "product_a", counts["product_id_a"].map(names))
+    counts.insert(3, "product_b", counts["product_id_b"].map(names))
+    return counts.sort_values(["lift", "orders"], ascending=False).head(top).reset_index(drop=True)
+
+def hourly_demand(orders: pd.DataFrame, items: pd.DataFrame):
+    """
+    Work out the demand curve over the hours of the day.
+
+    Args:
+        orders (pd.DataFrame): orders, as returned by load_table.
+        items (pd.DataFrame): order_items, as returned by load_table.
+
+    Items are totalled per order with one groupby, then orders, units and
+    revenue are binned by the hour, in REPORT_TIMEZONE, that the order was
+    placed with np.bincount. orders_per_day is the average for that hour over
+    the days in the export, counting days with no orders at that hour as zero.
+    Returns a DataFrame indexed by hour 0 to 23.
+    """
+    placed = orders["created_at"].dt.tz_convert(REPORT_TIMEZONE)
+    hours = placed.dt.hour.to_numpy()
+    days = max(placed.dt.normalize().nunique(), 1)
+
+    lines = items.assign(revenue=items["qty"].to_numpy() * items["unit_price"].to_numpy())
+    per_order = lines.groupby("order_id")[["qty", "revenue"]].sum()
+    per_order = per_order.reindex(orders["id"].to_numpy(), fill_value=0)
+
+    demand = pd.DataFrame({
+        "orders": np.bincount(hours, minlength=24),
+        "units": np.bincount(hours, weights=per_order["qty"].to_numpy(), minlength=24),
+        "revenue": np.bincount(hours, weights=per_order["revenue"].to_numpy(), minlength=24),
+    })
+    demand.index.name = "hour"
+    demand["orders_per_day"] = demand["orders"] / days
+    return demand
+
+def stock_burndown(orders: pd.DataFrame, items: pd.DataFrame, products: pd.DataFrame, days: int = BURNDOWN_DAYS):
+    """
+    Forecast when each product will run out of stock.
+
+    Args:
+        orders (pd.DataFrame): orders, as returned by load_table.
+        items (pd.DataFrame): order_items, as returned by load_table.
+        products (pd.DataFrame): products, as returned by load_table.
+        days (int): The number of days of sales, up to the newest order, used
+            for the daily sales rate.
+
+    Units sold per product per day are pivoted into a product by day matrix,
+    with days without sales filled with zero, and averaged to a daily rate.
+    Stock divided by that rate gives the days left. Products that have not sold
+    in the window never run out. Returns a DataFrame sorted by days left.
+    """
+    forecast = products[["id", "name", "stock"]].set_index("id")
+    if orders.empty:
+        return forecast.assign(daily_rate=0.0, days_left=np.inf, stockout_date=pd.NaT)
+
+    end = orders["created_at"].max().normalize()
+    window = pd.date_range(end - pd.Timedelta(days=days - 1), end, freq="D")
+    placed = orders.set_index("id")["created_at"].dt.normalize()
+
+    lines = items.assign(day=items["order_id"].map(placed))
+    lines = lines[lines["day"] >= window[0]]
+    daily = lines.pivot_table(index="product_id", columns="day", values="qty", aggfunc="sum", fill_value=0)
+    daily = daily.reindex(index=forecast.index, columns=window, fill_value=0)
+
+    rate = daily.to_numpy().mean(axis=1)
+    stock = forecast["stock"].fillna(0).to_numpy(dtype="float64")
+    with np.errstate(divide="ignore"):
+        days_left = np.where(rate > 0, np.maximum(stock, 0) / rate, np.inf)
+
+    forecast["daily_rate"] = rate
+    forecast["days_left"] = days_left
+    forecast["stockout_date"] = end + pd.to_timedelta(np.where(np.isfinite(days_left), days_left, np.nan), unit="D")
+    return forecast.sort_values("days_left")
+
+def prompt_basket_analysis(conn):
+    """Show the products most often bought together in the latest export."""
+    try:
+        items = load_table("csv", "order_items")
+        products = load_table("csv", "products")
+    except (FileNotFoundError, ImportError) as e:
+        print(f"\n{e}\n")
+        return
+    print(f"\n{basket_analysis(items, products).to_string(index=False)}\n")
+
+def prompt_hourly_demand(conn):
+    """Show the orders, units and revenue of each hour of the day in the latest export."""
+    try:
+        orders = load_table("csv", "orders")
+        items = load_table("csv", "order_items")
+    except (FileNotFoundError, ImportError) as e:
+        print(f"\n{e}\n")
+        return
+    print(f"\n{hourly_demand(orders, items).round(2).to_string()}\n")
+
+def prompt_stock_burndown(conn):
+    """Show when each product is forecast to run out of stock, from the latest export."""
+    try:
+        orders = load_table("csv", "orders")
+        items = load_table("csv", "order_items")
+        products = load_table("csv", "products")
+    except (FileNotFoundError, ImportError) as e:
+        print(f"\n{e}\n")
+        return
+    print(f"\n{stock_burndown(orders, items, products).round(2).to_string()}\n")
+
+REPORT_COMMANDS = [
+    ("Products bought together", prompt_basket_analysis),
+    ("Hourly demand", prompt_hourly_demand),
+    ("Stock burn-down forecast", prompt_stock_burndown),
+]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline reports over exported cafe data")
+    parser.add_argument("report", choices=("basket", "hourly", "burndown"))
+    parser.add_argument("--directory", default="csv", help="the folder export.py wrote to")
+    parser.add_argument("--export", action="store_true", help="take a fresh export from the database first")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--days", type=int, default=BURNDOWN_DAYS, help="sales window for the burn-down forecast")
+    args = parser.parse_args()
+
+    if args.export:
+        from export import export_tables
+        export_tables(args.directory, tuple(TABLE_COLUMNS))
+
+    items = load_table(args.directory, "order_items", args.chunksize)
+    if args.report == "basket":
+        print(basket_analysis(items, load_table(args.directory, "products", args.chunksize)).to_string(index=False))
+    elif args.report == "hourly":
+        print(hourly_demand(load_table(args.directory, "orders", args.chunksize), items).round(2).to_string())
+    else:
+        orders = load_table(args.directory, "orders", args.chunksize)
+        products = load_table(args.directory, "products", args.chunksize)
+        print(stock_burndown(orders, items, products, args.days).round(2).to_string())
@@ -0,0 +1,225 @@
+import re
+import psycopg
+from queries import registry
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+MIN_QUERY_LENGTH = 3
+SEARCH_LIMIT = 10
+
+# The document expressions below must match the GIN indexes created by
+# migration 12, or the planner cannot use them.
+PREFIX_CUSTOMERS = registry.register("customers.search_prefix", r"""
+    SELECT id, customer_name, customer_email, customer_phone, total_spend FROM customers
+    WHERE to_tsvector('simple', coalesce(customer_name, '') || ' ' || translate(coalesce(customer_email, ''), '@.', '  ')) @@ to_tsquery('simple', %s)
+       OR lower(customer_email) LIKE %s
+       OR regexp_replace(customer_phone, '\D', '', 'g') LIKE %s
+    ORDER BY lower(customer_email) LIKE %s DESC, customer_name, id
+    LIMIT %s""")
+FUZZY_CUSTOMERS = registry.register("customers.search_fuzzy", """
+    SELECT id, customer_name, customer_email, customer_phone, total_spend FROM customers
+    WHERE customer_name %% %s OR lower(customer_email) %% %s
+    ORDER BY greatest(similarity(customer_name, %s), similarity(lower(customer_email), %s)) DESC, id
+    LIMIT %s""")
+PREFIX_PRODUCTS = registry.register("products.search_prefix", """
+    SELECT id, name, price, stock FROM products
+    WHERE to_tsvector('simple', name) @@ to_tsquery('simple', %s) OR name ILIKE %s
+    ORDER BY name, id
+    LIMIT %s""")
+FUZZY_PRODUCTS = registry.register("products.search_fuzzy", """
+    SELECT id, name, price, stock FROM products
+    WHERE name %% %s
+    ORDER BY similarity(name, %s) DESC, id
+    LIMIT %s""")
+
+def prefix_query(text: str):
+    """
+    Turn what was typed into a tsquery that matches words starting with each typed word.
+
+    Args:
+        text (str): The search text. Anything other than letters and digits
+            separates words, so it is safe to pass user input straight in.
+
+    Returns the tsquery text, e.g. "ann:* & smi:*", or None if there are no words.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+def escape_like(text: str):
+    """Escape the LIKE wildcards in user input."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_customers(conn: psycopg.Connection, text: str, limit: int = SEARCH_LIMIT, fuzzy: bool = True):
+    """
+    Find customers by the start of a word in their name or email, by part of their phone number, or by a close spelling.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        text (str): What was typed, e.g. "ann smi", "ann.smith@" or "07700".
+        limit (int): The maximum number of customers to return.
+        fuzzy (bool): If True and the prefix search finds fewer than `limit`
+            customers, fill up with trigram matches, so "jonh" finds "John".
+
+    Every branch is served by a GIN index on customers: a tsvector over the
+    name and email words, and trigram indexes on the name, the lower-case
+    email and the phone digits. A lookup costs a few index probes however
+    many customers there are. Searches shorter than MIN_QUERY_LENGTH only
+    match whole word prefixes. Returns a list of rows with the fields named in
+    CUSTOMER_COLUMNS, exact email prefixes first.
+    """
+    text = text.strip()
+    query = prefix_query(text)
+    if query is None:
+        return []
+    email = escape_like(text.lower()) + "%" if len(text) >= MIN_QUERY_LENGTH else None
+    digits = re.sub(r"\D", "", text)
+    phone = f"%{digits}%" if len(digits) >= MIN_QUERY_LENGTH else None
+
+    with conn.cursor() as cursor:
+        registry.execute(cursor, PREFIX_CUSTOMERS, (query, email, phone, email, limit))
+        rows = cursor.fetchall()
+
+        if fuzzy and len(rows) < limit and len(text) >= MIN_QUERY_LENGTH:
+            registry.execute(cursor, FUZZY_CUSTOMERS, (text, text.lower(), text, text.lower(), limit))
+            found = {row[0] for row in rows}
+            rows += [row for row in cursor.fetchall() if row[0] not in found][:limit - len(rows)]
+    return rows
+
+def search_products(conn: psycopg.Connection, text: str, limit: int = SEARCH_LIMIT, fuzzy: bool = True):
+    """
+    Find products by the start of a word in their name, by part of their name, or by a close spelling.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        text (str): What was typed, e.g. "lat" or "croisant".
+        limit (int): The maximum number of products to return.
+        fuzzy (bool): If True and the prefix search finds fewer than `limit`
+            products, fill up with trigram matches.
+
+    Returns a list of rows with the fields named in PRODUCT_COLUMNS, in name order.
+    """
+    text = text.strip()
+    query = prefix_query(text)
+    if query is None:
+        return []
+
+    with conn.cursor() as cursor:
+        registry.execute(cursor, PREFIX_PRODUCTS, (query, f"%{escape_like(text)}%", limit))
+        rows = cursor.fetchall()
+
+        if fuzzy and len(rows) < limit and len(text) >= MIN_QUERY_LENGTH:
+            registry.execute(cursor, FUZZY_PRODUCTS, (text, text, limit))
+            found = {row[0] for row in rows}
+            rows += [row for row in cursor.fetchall() if row[0] not in found][:limit - len(rows)]
+    return rows
+
+def typeahead(prompt: str, complete: callable):
+    """
+    Read a line of input with Tab completion from a search.
+
+    Args:
+        prompt (str): The prompt to show.
+        complete (function): Called with the text typed so far and returns a
+            list of suggestions to complete it to.
+
+    Pressing Tab completes the line when there is one suggestion and lists
+    them when there are several. Where the readline module is not available,
+    e.g. on Windows, this is a plain input. Returns the line entered.
+    """
+    if readline is None:
+        return input(prompt)
+
+    suggestions = []
+
+    def completer(text: str, state: int):
+        if state == 0:
+            suggestions[:] = complete(readline.get_line_buffer())
+        return suggestions[state] if state < len(suggestions) else None
+
+    previous, delims = readline.get_completer(), readline.get_completer_delims()
+    readline.set_completer(completer)
+    readline.set_completer_delims("")
+    readline.parse_and_bind("tab: complete")
+    try:
+        return input(prompt)
+    finally:
+        readline.set_completer(previous)
+        readline.set_completer_delims(delims)
+
+def show_customers(rows: list):
+    """Print customer search results as a numbered list."""
+    print(f"\n{'#':<4}{'ID':<8}{'Name':<25}{'Email':<32}{'Phone':<15}\n{'-'*84}")
+    for n, row in enumerate(rows, 1):
+        print(f"{n:<4}{row[0]:<8}{row[1] or '':<25}{row[2] or '':<32}{row[3] or '':<15}")
+    print()
+
+def choose_customer(conn: psycopg.Connection, prompt: str = "Find customer by name, email or phone (Enter to skip): "):
+    """
+    Look a customer up by type-ahead search and let the operator pick one.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        prompt (str): The prompt for the search text.
+
+    Tab completes the search to a matching email. Returns the chosen row, with
+    the fields named in CUSTOMER_COLUMNS, or None if the search was skipped or
+    nothing was picked.
+    """
+    text = typeahead(prompt, lambda typed: [row[2] for row in search_customers(conn, typed, fuzzy=False)])
+    if not text.strip():
+        return None
+
+    rows = search_customers(conn, text)
+    if not rows:
+        print("\nNo customers found!\n")
+        return None
+    if len(rows) == 1:
+        return rows[0]
+
+    show_customers(rows)
+    choice = input("Number of the customer (Enter for none): ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(rows):
+        return rows[int(choice) - 1]
+    return None
+
+def choose_product(conn: psycopg.Connection, text: str):
+    """
+    Resolve a product typed by name, letting the operator pick when several match.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        text (str): The name or part of the name that was typed.
+
+    Returns the ID of the chosen product, or None if nothing was found or picked.
+    """
+    rows = search_products(conn, text)
+    if not rows:
+        return None
+    if len(rows) == 1:
+        return rows[0][0]
+
+    print(f"\n{'#':<4}{'ID':<6}{'Name':<25}{'Price':<8}{'Stock':<8}")
+    for n, row in enumerate(rows, 1):
+        print(f"{n:<4}{row[0]:<6}{row[1]:<25}£{row[2]:<7}{row[3]:<8}")
+    choice = input("\nNumber of the product (Enter for none): ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(rows):
+        return rows[int(choice) - 1][0]
+    return None
+
+def complete_products(conn: psycopg.Connection):
+    """Return a completer for typeahead that suggests product names."""
+    return lambda typed: [] if typed.strip().isdigit() else [row[1] for row in search_products(conn, typed, fuzzy=False)]
+
+def prompt_search_customers(conn: psycopg.Connection):
+    """Ask for part of a customer's name, email or phone number and show the customers that match."""
+    text = typeahead("Search customers (Tab to complete): ", lambda typed: [row[2] for row in search_customers(conn, typed, fuzzy=False)])
+    rows = search_customers(conn, text)
+    if not rows:
+        print("\nNo customers found!\n")
+        return
+    show_customers(rows)
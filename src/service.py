@@ -0,0 +1,287 @@
+import argparse
+import json
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import psycopg
+from analytics import (daily_sales, top_products, courier_throughput, customer_ltv, REPORT_DAYS, REPORT_LIMIT,
+                       DAILY_SALES_COLUMNS, TOP_PRODUCT_COLUMNS, COURIER_THROUGHPUT_COLUMNS, CUSTOMER_LTV_COLUMNS)
+from balancer import balancer
+from catalog import catalog
+from connection import create_pool, get_conninfo
+from database import create_database
+from events import read_events, order_history, EVENT_COLUMNS
+from paging import PAGE_SIZE
+from queries import registry
+from search import search_customers, search_products
+from stock import new_reservation, reserve, release, low_stock_products, RESERVATION_TTL
+from products import list_products, create_product, update_products, PRODUCT_COLUMNS
+from orders import list_orders, update_orders_status, items_by_id, place_order, ORDER_COLUMNS
+from couriers import list_couriers, add_courier, courier_open_orders, COURIER_COLUMNS, COURIER_ORDER_COLUMNS
+from customers import list_customers, add_customer, update_customers, CUSTOMER_COLUMNS
+
+# The most rows one listing request may ask for, so a client cannot read a whole
+# table in one response.
+MAX_PAGE_SIZE = 500
+
+class ServiceError(Exception):
+    """An error reported to the client with the given HTTP status."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def rows_to_dicts(columns: tuple, rows: list):
+    """Pair each row with its column names so it can be sent as a JSON object."""
+    return [dict(zip(columns, row)) for row in rows]
+
+def page_args(query: dict):
+    """
+    Read the optional after, before and limit keyset paging parameters from a query string.
+
+    The limit defaults to PAGE_SIZE and is capped at MAX_PAGE_SIZE, so a
+    listing is always one bounded page; clients follow `after` for more.
+    """
+    args = {key: int(query[key][0]) if key in query else None for key in ("after", "before")}
+    args["limit"] = max(1, min(int(query["limit"][0]), MAX_PAGE_SIZE)) if "limit" in query else PAGE_SIZE
+    return args
+
+def get_products(conn, query, body):
+    return rows_to_dicts(PRODUCT_COLUMNS, list_products(conn, **page_args(query)))
+
+def get_couriers(conn, query, body):
+    return rows_to_dicts(COURIER_COLUMNS, list_couriers(conn, **page_args(query)))
+
+def get_customers(conn, query, body):
+    return rows_to_dicts(CUSTOMER_COLUMNS, list_customers(conn, **page_args(query)))
+
+def get_customer_search(conn, query, body):
+    return rows_to_dicts(CUSTOMER_COLUMNS, search_customers(conn, query["q"][0], **report_args(query, "limit")))
+
+def get_product_search(conn, query, body):
+    return rows_to_dicts(PRODUCT_COLUMNS, search_products(conn, query["q"][0], **report_args(query, "limit")))
+
+def get_orders(conn, query, body):
+    status = query.get("status", [None])[0]
+    return rows_to_dicts(ORDER_COLUMNS, list_orders(conn, status, **page_args(query)))
+
+def report_args(query: dict, *keys):
+    """Read the optional days and limit parameters of an analytics report from a query string."""
+    defaults = {"days": REPORT_DAYS, "limit": REPORT_LIMIT}
+    return {key: int(query[key][0]) if key in query else defaults[key] for key in keys}
+
+def get_daily_sales(conn, query, body):
+    return rows_to_dicts(DAILY_SALES_COLUMNS, daily_sales(conn, **report_args(query, "days")))
+
+def get_top_products(conn, query, body):
+    return rows_to_dicts(TOP_PRODUCT_COLUMNS, top_products(conn, **report_args(query, "days", "limit")))
+
+def get_courier_throughput(conn, query, body):
+    return rows_to_dicts(COURIER_THROUGHPUT_COLUMNS, courier_throughput(conn, **report_args(query, "days")))
+
+def get_customer_ltv(conn, query, body):
+    return rows_to_dicts(CUSTOMER_LTV_COLUMNS, customer_ltv(conn, **report_args(query, "limit")))
+
+def get_events(conn, query, body):
+    """Return the order events after the `after` sequence number, for consumers that poll over HTTP."""
+    after = int(query["after"][0]) if "after" in query else 0
+    limit = max(1, min(int(query["limit"][0]), MAX_PAGE_SIZE)) if "limit" in query else 100
+    return rows_to_dicts(EVENT_COLUMNS, read_events(conn, after, limit))
+
+def get_order_events(conn, query, body, id):
+    return rows_to_dicts(EVENT_COLUMNS, order_history(conn, id))
+
+def get_query_metrics(conn, query, body):
+    columns = ("query", "calls", "errors", "total_seconds", "p50", "p95", "p99", "max")
+    return rows_to_dicts(columns, registry.snapshot())
+
+def post_products(conn, query, body):
+    id = create_product(body["name"], body["price"], body["stock"], conn)
+    return {"id": id}
+
+def post_products_update(conn, query, body):
+    """Apply a batch of product edits, each an object with an id and the fields to change, in one round-trip."""
+    found = update_products(conn, [(edit["id"], edit) for edit in body["edits"]])
+    return {"updated": [edit["id"] for edit, ok in zip(body["edits"], found) if ok]}
+
+def post_couriers(conn, query, body):
+    id = add_courier(conn, body["name"])
+    return {"id": id, "name": body["name"]}
+
+def post_customers(conn, query, body):
+    id = add_customer(conn, body["name"], body["email"], body["phone"])
+    if id is None:
+        raise ServiceError(409, f"A customer with email {body['email']} already exists")
+    return {"id": id, "email": body["email"]}
+
+def post_customers_update(conn, query, body):
+    """Apply a batch of customer edits, each an object with an id and the fields to change, in one round-trip."""
+    try:
+        found = update_customers(conn, [(edit["id"], edit) for edit in body["edits"]])
+    except psycopg.errors.UniqueViolation:
+        raise ServiceError(409, "A customer with one of the new emails already exists")
+    return {"updated": [edit["id"] for edit, ok in zip(body["edits"], found) if ok]}
+
+def post_orders(conn, query, body):
+    """Create an order the same way the orders menu does, from a JSON body with product IDs and an optional reservation."""
+    reservation = body.get("reservation")
+    items = items_by_id(conn, body["items"], check_stock=reservation is None)
+    if len(items) == 0:
+        raise ValueError("No items ordered")
+    courier_id, courier = balancer.assign(conn)
+    try:
+        order_id, customer_id, total = place_order(conn, body["name"], body["address"], body["phone"], body["email"], courier_id, items, reservation)
+    except Exception:
+        balancer.release(courier_id)
+        raise
+    return {"id": order_id, "customer_id": customer_id, "total": total, "courier": courier, "items": items}
+
+def post_reservations(conn, query, body):
+    """Hold stock for the product IDs in the body, adding to an existing reservation if its token is given."""
+    token = body.get("reservation") or new_reservation()
+    reserve(conn, token, body["items"])
+    return {"reservation": token, "expires_in": RESERVATION_TTL.total_seconds()}
+
+def post_reservations_release(conn, query, body):
+    release(conn, body["reservation"])
+    return {"reservation": body["reservation"]}
+
+def get_low_stock(conn, query, body):
+    return rows_to_dicts(("id", "name", "stock", "low_stock_threshold"), low_stock_products(conn))
+
+def get_courier_orders(conn, query, body, id):
+    """Return one page of a courier's open orders with their counts per status."""
+    page = courier_open_orders(conn, id, **{key: value for key, value in page_args(query).items() if value is not None})
+    if page is None:
+        raise ServiceError(404, f"Courier {id} not found")
+    name, counts, rows = page
+    return {"courier": name.rstrip(), "open_orders": counts, "orders": rows_to_dicts(COURIER_ORDER_COLUMNS, rows)}
+
+def post_order_status(conn, query, body, id):
+    if not update_orders_status(conn, [id], body["status"]):
+        raise ServiceError(409, f"Order {id} not found, or it cannot move to {body['status']}")
+    return {"id": id, "status": body["status"]}
+
+def post_orders_status(conn, query, body):
+    """Move a batch of orders to a new status, e.g. at close of shift, and report which ones changed."""
+    rows = update_orders_status(conn, body["ids"], body["status"])
+    return {"status": body["status"], "updated": [row[0] for row in rows]}
+
+ROUTES = {
+    ("GET", "products"): get_products,
+    ("GET", "couriers"): get_couriers,
+    ("GET", "customers"): get_customers,
+    ("GET", "orders"): get_orders,
+    ("GET", "products/low-stock"): get_low_stock,
+    ("GET", "products/search"): get_product_search,
+    ("GET", "customers/search"): get_customer_search,
+    ("GET", "diagnostics/queries"): get_query_metrics,
+    ("GET", "events"): get_events,
+    ("GET", "analytics/daily-sales"): get_daily_sales,
+    ("GET", "analytics/top-products"): get_top_products,
+    ("GET", "analytics/couriers"): get_courier_throughput,
+    ("GET", "analytics/customers"): get_customer_ltv,
+    ("POST", "products"): post_products,
+    ("POST", "couriers"): post_couriers,
+    ("POST", "customers"): post_customers,
+    ("POST", "products/update"): post_products_update,
+    ("POST", "customers/update"): post_customers_update,
+    ("POST", "orders"): post_orders,
+    ("POST", "orders/status"): post_orders_status,
+    ("POST", "reservations"): post_reservations,
+    ("POST", "reservations/release"): post_reservations_release,
+}
+
+ITEM_ROUTES = {
+    ("GET", "couriers", "orders"): get_courier_orders,
+    ("GET", "orders", "events"): get_order_events,
+    ("POST", "orders", "status"): post_order_status,
+}
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    JSON API over the product, order, courier and customer functions.
+
+    Every request borrows its own connection from the server's pool, so several
+    tills can work at the same time. The pool commits when the handler succeeds
+    and rolls back when it raises.
+    """
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method: str):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = parse_qs(url.query)
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+
+            if (method, "/".join(parts)) in ROUTES:
+                handler, args = ROUTES[(method, "/".join(parts))], ()
+            elif len(parts) == 3 and parts[1].isdigit() and (method, parts[0], parts[2]) in ITEM_ROUTES:
+                handler, args = ITEM_ROUTES[(method, parts[0], parts[2])], (int(parts[1]),)
+            else:
+                raise ServiceError(404, "Not found")
+
+            with self.server.pool.connection() as conn:
+                result = handler(conn, query, body, *args)
+            self.respond(200, result)
+        except ServiceError as e:
+            self.respond(e.status, {"error": str(e)})
+        except (ValueError, KeyError) as e:
+            self.respond(400, {"error": str(e)})
+        except Exception:
+            traceback.print_exc()
+            self.respond(500, {"error": "Internal server error"})
+
+    def respond(self, status: int, payload):
+        data = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host: str, port: int):
+    """
+    Run the headless order service until interrupted.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+
+    Opens a connection pool from the `.env` settings, checks the schema once,
+    starts the product catalogue listener and serves the JSON API with one
+    thread per request.
+    """
+    pool = create_pool()
+    with pool.connection() as conn:
+        create_database(conn)
+    catalog.listen(get_conninfo())
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.pool = pool
+    print(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless cafe order service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    serve(args.host, args.port)
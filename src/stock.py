@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import uuid
+from collections import Counter
+from datetime import timedelta
+import psycopg
+from connection import connect, get_conninfo
+from queries import registry
+
+RESERVATION_TTL = timedelta(seconds=int(os.getenv('RESERVATION_TTL_SECONDS', 600)))
+LOW_STOCK_CHANNEL = "low_stock"
+SWEEP_INTERVAL = 30
+
+RESERVE = registry.register("stock_reservations.reserve", """
+    WITH taken AS (
+        UPDATE products SET stock = products.stock - wanted.qty
+        FROM unnest(%s::int[], %s::int[]) AS wanted(id, qty)
+        WHERE products.id = wanted.id AND products.stock >= wanted.qty
+        RETURNING products.id, wanted.qty
+    )
+    INSERT INTO stock_reservations (token, product_id, qty, expires_at)
+    SELECT %s, id, qty, now() + %s FROM taken
+    ON CONFLICT (token, product_id) DO UPDATE SET qty = stock_reservations.qty + EXCLUDED.qty
+    RETURNING product_id""")
+EXTEND = registry.register("stock_reservations.extend", "UPDATE stock_reservations SET expires_at = now() + %s WHERE token = %s")
+RELEASE = registry.register("stock_reservations.release", """
+    WITH released AS (
+        DELETE FROM stock_reservations WHERE token = %s RETURNING product_id, qty
+    )
+    UPDATE products SET stock = products.stock + returned.qty
+    FROM (SELECT product_id, SUM(qty) AS qty FROM released GROUP BY product_id) returned
+    WHERE products.id = returned.product_id""")
+SWEEP = registry.register("stock_reservations.sweep", """
+    WITH expired AS (
+        DELETE FROM stock_reservations WHERE id IN (
+            SELECT id FROM stock_reservations WHERE expires_at < now() FOR UPDATE SKIP LOCKED
+        )
+        RETURNING product_id, qty
+    )
+    UPDATE products SET stock = products.stock + returned.qty
+    FROM (SELECT product_id, SUM(qty) AS qty FROM expired GROUP BY product_id) returned
+    WHERE products.id = returned.product_id
+    RETURNING products.id""")
+LOW_STOCK = registry.register("products.low_stock", """
+    SELECT id, name, stock, low_stock_threshold FROM products
+    WHERE stock <= low_stock_threshold ORDER BY stock, id""")
+SET_THRESHOLD = registry.register("products.set_low_stock_threshold", "UPDATE products SET low_stock_threshold = %s WHERE id = %s")
+
+def new_reservation():
+    """Return a new reservation token to hold stock under while an order is built."""
+    return str(uuid.uuid4())
+
+def reserve(conn: psycopg.Connection, token: str, product_ids: list, ttl: timedelta = RESERVATION_TTL):
+    """
+    Hold stock for an order that is still being built.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        token (str): The reservation to add to, from new_reservation.
+        product_ids (list of int): The products to hold. An ID may appear more
+            than once to hold several of it.
+        ttl (timedelta): How long the reservation is held for. Every call pushes
+            the expiry of the whole reservation back.
+
+    The stock is taken off the products straight away, in one statement that
+    only succeeds where enough is left, so two tills can never both get the last
+    croissant and the catalogue shows what can still be sold. Expired
+    reservations are returned to stock first. If any product is missing or does
+    not have enough stock, nothing is held and ValueError is raised.
+    """
+    counts = Counter(product_ids)
+    ids = list(counts)
+
+    try:
+        with conn.cursor() as cursor:
+            sweep(cursor)
+            registry.execute(cursor, RESERVE, (ids, [counts[id] for id in ids], token, ttl))
+            missing = set(ids) - {row[0] for row in cursor.fetchall()}
+            if missing:
+                raise ValueError(f"Not enough stock for product {', '.join(str(id) for id in sorted(missing))}")
+            registry.execute(cursor, EXTEND, (ttl, token))
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+def release(conn: psycopg.Connection, token: str):
+    """
+    Give the stock held by a reservation back.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        token (str): The reservation to release.
+
+    Call this when an order is abandoned before it is placed. Releasing a
+    reservation that was already placed or has expired does nothing.
+    """
+    with conn.cursor() as cursor:
+        registry.execute(cursor, RELEASE, (token,))
+    conn.commit()
+
+def sweep(cursor: psycopg.Cursor):
+    """
+    Return the stock of every expired reservation, without committing.
+
+    Args:
+        cursor (psycopg.Cursor): A cursor on the connection to sweep with.
+
+    Expired rows are found through the expires_at index, and rows locked by an
+    order being placed from them right now are skipped. Returns the number of
+    products whose stock was returned.
+    """
+    registry.execute(cursor, SWEEP)
+    return cursor.rowcount
+
+def expire_reservations(conn: psycopg.Connection):
+    """
+    Return the stock of every expired reservation.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+
+    reserve already does this before holding more stock, so this is only needed
+    to put stock back on display when no new orders are coming in. Returns the
+    number of products whose stock was returned.
+    """
+    with conn.cursor() as cursor:
+        returned = sweep(cursor)
+    conn.commit()
+    return returned
+
+def low_stock_products(conn: psycopg.Connection):
+    """
+    Retrieve the products at or below their low-stock threshold.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+
+    Served by the partial index on products that only holds low-stock rows, so
+    the check costs the same however big the catalogue is. Returns a list of
+    (id, name, stock, low_stock_threshold) rows, emptiest first.
+    """
+    with conn.cursor() as cursor:
+        registry.execute(cursor, LOW_STOCK)
+        return cursor.fetchall()
+
+def set_low_stock_threshold(conn: psycopg.Connection, id: int, threshold: int):
+    """
+    Change the stock level at which a product raises a low-stock alert.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        id (int): The ID of the product.
+        threshold (int): The new threshold. An alert is sent when the stock
+            drops to this level or below.
+
+    Returns True if the product was found.
+    """
+    with conn.cursor() as cursor:
+        registry.execute(cursor, SET_THRESHOLD, (threshold, id))
+        found = cursor.rowcount > 0
+    conn.commit()
+    return found
+
+def watch_low_stock(conninfo: str, on_alert: callable = print, interval: int = SWEEP_INTERVAL):
+    """
+    Receive low-stock alerts as they happen and sweep expired reservations meanwhile.
+
+    Args:
+        conninfo (str): The connection string for the watcher's own connection.
+        on_alert (function): Called with each alert, a dict with the id, name,
+            stock and threshold of the product.
+        interval (int): The longest time in seconds between sweeps of expired
+            reservations.
+
+    A trigger on products notifies the low_stock channel when a product's stock
+    falls to its threshold, so nothing has to poll the products table. Runs until
+    interrupted.
+    """
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute(f"LISTEN {LOW_STOCK_CHANNEL}")
+        while True:
+            for notify in conn.notifies(timeout=interval):
+                on_alert(json.loads(notify.payload))
+            with conn.cursor() as cursor:
+                sweep(cursor)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stock reservations and low-stock alerts")
+    parser.add_argument("command", choices=("watch", "expire", "low"))
+    args = parser.parse_args()
+
+    if args.command == "watch":
+        print(f"Listening for low-stock alerts on {LOW_STOCK_CHANNEL}...")
+        try:
+            watch_low_stock(get_conninfo(), lambda alert: print(f"Low stock: {alert['name']} (ID {alert['id']}) has {alert['stock']} left, threshold {alert['threshold']}"))
+        except KeyboardInterrupt:
+            pass
+    else:
+        conn = connect()
+        try:
+            if args.command == "expire":
+                print(f"Returned stock for {expire_reservations(conn)} product(s)")
+            else:
+                for id, name, stock, threshold in low_stock_products(conn):
+                    print(f"{id:<5}{name:<25}{stock:<8}{threshold}")
+        finally:
+            conn.close()
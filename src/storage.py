@@ -0,0 +1,422 @@
+import argparse
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+import psycopg
+from balancer import balancer
+from connection import connect
+from customers import list_customers, add_customer, normalize_email
+from couriers import list_couriers, add_courier
+from database import OPEN_STATUSES
+from orders import list_orders, place_order, update_orders_status, STATUS_TRANSITIONS
+from products import list_products, create_product
+
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'till.db')
+
+# Money columns are declared "DECIMAL TEXT": the first word picks the converter
+# below, and the word TEXT gives them text affinity, so SQLite keeps the exact
+# digits instead of turning them into a float.
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter("DECIMAL", lambda value: Decimal(value.decode()))
+
+class Storage(ABC):
+    """
+    The operations a till needs, independent of the database behind them.
+
+    Rows are returned with the same fields as the module functions, named in
+    PRODUCT_COLUMNS, COURIER_COLUMNS, CUSTOMER_COLUMNS and ORDER_COLUMNS, and
+    the add methods return the new row's ID, or None for a customer whose email
+    is taken, so code written against a Storage runs unchanged on either
+    backend.
+    """
+
+    @abstractmethod
+    def list_products(self, after: int = None, before: int = None, limit: int = None):
+        """Return (id, name, price, stock) rows sorted by ID, optionally one page at a time, as products.list_products does."""
+
+    @abstractmethod
+    def list_couriers(self, after: int = None, before: int = None, limit: int = None):
+        """Return (id, name) rows sorted by ID, optionally one page at a time, as couriers.list_couriers does."""
+
+    @abstractmethod
+    def list_customers(self, after: int = None, before: int = None, limit: int = None):
+        """Return (id, name, email, phone, total_spend) rows sorted by ID, optionally one page at a time, as customers.list_customers does."""
+
+    @abstractmethod
+    def list_orders(self, status: str = None, after: int = None, before: int = None, limit: int = None):
+        """Return order rows sorted by ID, optionally with one status and one page at a time, as orders.list_orders does."""
+
+    @abstractmethod
+    def add_product(self, name: str, price: Decimal, stock: int):
+        """Add a product. Returns its ID."""
+
+    @abstractmethod
+    def add_courier(self, name: str):
+        """Add a courier. Returns their ID."""
+
+    @abstractmethod
+    def add_customer(self, name: str, email: str, phone: str):
+        """Add a customer. Returns their ID, or None if a customer with this email already exists."""
+
+    @abstractmethod
+    def place_order(self, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, items: list):
+        """
+        Assign the least busy courier and place an order in one transaction.
+
+        Args:
+            customer_name (str): The name of the customer.
+            customer_address (str): The address of the customer.
+            customer_phone (str): The phone number of the customer.
+            customer_email (str): The email of the customer.
+            items (list): The list of item names ordered. A name may appear more than once.
+
+        If any item is missing or short of stock, nothing is written and
+        ValueError is raised. Returns a (order_id, customer_id, total, courier)
+        tuple.
+        """
+
+    @abstractmethod
+    def update_orders_status(self, ids: list, new_status: str):
+        """Move a batch of orders to a new status where STATUS_TRANSITIONS allows it. Returns (id, courier_id) rows for the orders changed."""
+
+    @abstractmethod
+    def rollback(self):
+        """Abandon whatever a failed operation left uncommitted, so the storage can be used again."""
+
+    @abstractmethod
+    def close(self):
+        """Close the storage and the database connection behind it."""
+
+class PostgresStorage(Storage):
+    """
+    Storage on the PostgreSQL database, through the products, orders, couriers and customers functions.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database. It is
+            closed with the storage.
+    """
+
+    def __init__(self, conn: psycopg.Connection):
+        self.conn = conn
+
+    def list_products(self, after: int = None, before: int = None, limit: int = None):
+        return list_products(self.conn, after, before, limit)
+
+    def list_couriers(self, after: int = None, before: int = None, limit: int = None):
+        return list_couriers(self.conn, after, before, limit)
+
+    def list_customers(self, after: int = None, before: int = None, limit: int = None):
+        return list_customers(self.conn, after, before, limit)
+
+    def list_orders(self, status: str = None, after: int = None, before: int = None, limit: int = None):
+        return list_orders(self.conn, status, after, before, limit)
+
+    def add_product(self, name: str, price: Decimal, stock: int):
+        return create_product(name, price, stock, self.conn)
+
+    def add_courier(self, name: str):
+        return add_courier(self.conn, name)
+
+    def add_customer(self, name: str, email: str, phone: str):
+        """Add a customer. Returns their ID, or None if a customer with this email already exists."""
+        return add_customer(self.conn, name, email, phone)
+
+    def place_order(self, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, items: list):
+        """Assign the least busy courier and place the order. Returns a (order_id, customer_id, total, courier) tuple."""
+        courier_id, courier = balancer.assign(self.conn)
+        try:
+            order_id, customer_id, total = place_order(self.conn, customer_name, customer_address, customer_phone, customer_email, courier_id, items)
+        except Exception:
+            balancer.release(courier_id)
+            raise
+        return order_id, customer_id, total, courier
+
+    def update_orders_status(self, ids: list, new_status: str):
+        return update_orders_status(self.conn, ids, new_status)
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY, name TEXT NOT NULL, price DECIMAL TEXT NOT NULL, stock INTEGER NOT NULL DEFAULT 0 CHECK (stock >= 0));
+    CREATE INDEX IF NOT EXISTS products_name_idx ON products (name);
+    CREATE TABLE IF NOT EXISTS couriers (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER PRIMARY KEY, customer_name TEXT, customer_email TEXT NOT NULL UNIQUE, customer_phone TEXT, total_spend DECIMAL TEXT NOT NULL DEFAULT '0');
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY, customer_name TEXT, customer_email TEXT, customer_phone TEXT, customer_address TEXT,
+        items TEXT, status TEXT NOT NULL, courier TEXT, courier_id INTEGER REFERENCES couriers (id) ON DELETE SET NULL,
+        created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+        synced_id INTEGER, synced_status TEXT);
+    CREATE INDEX IF NOT EXISTS orders_status_idx ON orders (status, id);
+    CREATE INDEX IF NOT EXISTS orders_courier_id_status_idx ON orders (courier_id, status);
+    CREATE INDEX IF NOT EXISTS orders_unsynced_idx ON orders (id) WHERE synced_id IS NULL OR synced_status IS NOT status;
+    CREATE TABLE IF NOT EXISTS order_items (
+        order_id INTEGER NOT NULL REFERENCES orders (id) ON DELETE CASCADE,
+        product_id INTEGER NOT NULL REFERENCES products (id),
+        qty INTEGER NOT NULL CHECK (qty > 0),
+        unit_price DECIMAL TEXT NOT NULL,
+        PRIMARY KEY (order_id, product_id));
+"""
+
+ORDER_ITEMS_TEXT = """COALESCE((SELECT group_concat(name, ', ') FROM (
+                          SELECT p.name || CASE WHEN oi.qty > 1 THEN ' x' || oi.qty ELSE '' END AS name
+                          FROM order_items oi JOIN products p ON p.id = oi.product_id
+                          WHERE oi.order_id = orders.id ORDER BY p.name)), items)"""
+
+class SQLiteStorage(Storage):
+    """
+    Storage in an embedded SQLite database, for a till working offline and for tests.
+
+    Args:
+        path (str): The database file, created if missing, or ":memory:" for a
+            throwaway database that starts in milliseconds.
+
+    The schema mirrors the PostgreSQL one closely enough for the listings to
+    return the same rows, and reads are local, so they take microseconds rather
+    than a network round-trip. Orders placed here are recorded with no synced_id
+    until sync pushes them to PostgreSQL. The catalogue of products and couriers
+    is managed centrally and pulled down by sync. One connection is shared by
+    every thread, behind a lock.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def page(self, query: str, where: str = None, params: tuple = (), after: int = None, before: int = None, limit: int = None):
+        """Fetch one page of a query by keyset pagination on id, as paging.keyset_page does."""
+        conditions = [where] if where else []
+        params = list(params)
+        order = "ASC"
+        if after is not None:
+            conditions.append("id > ?")
+            params.append(after)
+        elif before is not None:
+            conditions.append("id < ?")
+            params.append(before)
+            order = "DESC"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY id {order}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        if order == "DESC":
+            rows.reverse()
+        return rows
+
+    def list_products(self, after: int = None, before: int = None, limit: int = None):
+        return self.page("SELECT id, name, price, stock FROM products", after=after, before=before, limit=limit)
+
+    def list_couriers(self, after: int = None, before: int = None, limit: int = None):
+        return self.page("SELECT id, name FROM couriers", after=after, before=before, limit=limit)
+
+    def list_customers(self, after: int = None, before: int = None, limit: int = None):
+        return self.page("SELECT id, customer_name, customer_email, customer_phone, total_spend FROM customers", after=after, before=before, limit=limit)
+
+    def list_orders(self, status: str = None, after: int = None, before: int = None, limit: int = None):
+        query = f"""SELECT id, customer_name, customer_email, customer_phone, customer_address, {ORDER_ITEMS_TEXT}, status, courier
+                    FROM orders"""
+        if status is None:
+            return self.page(query, after=after, before=before, limit=limit)
+        return self.page(query, "status = ?", (status,), after, before, limit)
+
+    def add_product(self, name: str, price: Decimal, stock: int):
+        with self.lock:
+            return self.conn.execute("INSERT INTO products (name, price, stock) VALUES (?, ?, ?)", (name.title(), Decimal(str(price)), stock)).lastrowid
+
+    def add_courier(self, name: str):
+        with self.lock:
+            return self.conn.execute("INSERT INTO couriers (name) VALUES (?)", (name.capitalize(),)).lastrowid
+
+    def add_customer(self, name: str, email: str, phone: str):
+        """Add a customer. Returns their ID, or None if a customer with this email already exists."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO customers (customer_name, customer_email, customer_phone) VALUES (?, ?, ?) ON CONFLICT (customer_email) DO NOTHING",
+                (name.title(), normalize_email(email), phone)
+            )
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def place_order(self, customer_name: str, customer_address: str, customer_phone: str, customer_email: str, items: list):
+        """
+        Assign the least busy courier, then create the order, deduct its stock and update the customer's spend in one transaction.
+
+        Args:
+            customer_name (str): The name of the customer.
+            customer_address (str): The address of the customer.
+            customer_phone (str): The phone number of the customer.
+            customer_email (str): The email of the customer.
+            items (list): The list of item names ordered. A name may appear more than once.
+
+        Behaves like orders.place_order: if any item is missing or does not have
+        enough stock, nothing is written and ValueError is raised. Returns a
+        (order_id, customer_id, total, courier) tuple.
+        """
+        counts = Counter(item.title() for item in items)
+        email = normalize_email(customer_email)
+        placeholders = ", ".join("?" * len(OPEN_STATUSES))
+
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                courier = cursor.execute(
+                    f"""SELECT c.id, c.name FROM couriers c
+                        LEFT JOIN orders o ON o.courier_id = c.id AND o.status IN ({placeholders})
+                        GROUP BY c.id ORDER BY COUNT(o.id), c.id LIMIT 1""",
+                    OPEN_STATUSES
+                ).fetchone()
+                if courier is None:
+                    raise ValueError("No couriers available")
+
+                lines = []
+                for name, qty in counts.items():
+                    product = cursor.execute("SELECT id, price FROM products WHERE name = ? ORDER BY id LIMIT 1", (name,)).fetchone()
+                    if product is None or cursor.execute(
+                        "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?", (qty, product[0], qty)
+                    ).rowcount == 0:
+                        raise ValueError(f"Not enough stock for {name}")
+                    lines.append((product[0], qty, product[1]))
+                total = sum(price * qty for id, qty, price in lines)
+
+                order_id = cursor.execute(
+                    """INSERT INTO orders (customer_name, customer_address, customer_phone, customer_email, items, status, courier, courier_id)
+                       VALUES (?, ?, ?, ?, ?, 'preparing', ?, ?)""",
+                    (customer_name.title(), customer_address.lower(), customer_phone, email, ", ".join(items), courier[1], courier[0])
+                ).lastrowid
+                cursor.executemany(
+                    "INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)",
+                    [(order_id, id, qty, price) for id, qty, price in lines]
+                )
+
+                cursor.execute(
+                    "INSERT INTO customers (customer_name, customer_email, customer_phone) VALUES (?, ?, ?) ON CONFLICT (customer_email) DO NOTHING",
+                    (customer_name, email, customer_phone)
+                )
+                customer_id, spend = cursor.execute("SELECT id, total_spend FROM customers WHERE customer_email = ?", (email,)).fetchone()
+                cursor.execute("UPDATE customers SET total_spend = ? WHERE id = ?", (spend + total, customer_id))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+        return order_id, customer_id, total, courier[1]
+
+    def update_orders_status(self, ids: list, new_status: str):
+        """Move a batch of orders to a new status, as orders.update_orders_status does. Returns (id, courier_id) rows for the orders changed."""
+        allowed = [status for status, targets in STATUS_TRANSITIONS.items() if new_status in targets]
+        if not allowed:
+            raise ValueError(f"Orders cannot be moved to {new_status}")
+
+        ids = list(ids)
+        with self.lock:
+            cursor = self.conn.execute(
+                f"""UPDATE orders SET status = ? WHERE id IN ({", ".join("?" * len(ids))}) AND status IN ({", ".join("?" * len(allowed))})
+                    RETURNING id, courier_id""",
+                [new_status] + ids + allowed
+            )
+            return cursor.fetchall()
+
+    def rollback(self):
+        """Nothing to do: every method commits or rolls back its own transaction before returning."""
+
+    def close(self):
+        self.conn.close()
+
+def sync(local: SQLiteStorage, conn: psycopg.Connection):
+    """
+    Push a till's offline orders to PostgreSQL and pull the central catalogue down.
+
+    Args:
+        local (SQLiteStorage): The till's embedded storage.
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+
+    Orders not yet pushed are placed with orders.place_order, with the same
+    courier and the time it was taken, so stock and customer spend are updated
+    centrally as if the order had been taken online, and it lands in the orders
+    partition of the day it was placed. Status changes made offline are then replayed one
+    step at a time. An order that cannot be placed, e.g. because the central
+    stock has run out, or whose status change is refused centrally, e.g.
+    because it was abandoned there meanwhile, is counted as failed and left
+    at the last step that was applied, to be retried on the next sync. Finally the local
+    products and couriers are replaced with the central ones, which are
+    authoritative once every order is in. Returns a (pushed, failed) tuple.
+    """
+    with local.lock:
+        pending = local.conn.execute(
+            """SELECT id, customer_name, customer_address, customer_phone, customer_email, courier_id, status, created_at, synced_id, synced_status
+               FROM orders WHERE synced_id IS NULL OR synced_status IS NOT status ORDER BY id"""
+        ).fetchall()
+        lines = local.conn.execute(
+            """SELECT oi.order_id, p.name, oi.qty FROM order_items oi JOIN products p ON p.id = oi.product_id
+               WHERE oi.order_id IN (SELECT id FROM orders WHERE synced_id IS NULL)"""
+        ).fetchall()
+
+    items = {}
+    for order_id, name, qty in lines:
+        items.setdefault(order_id, []).extend([name] * qty)
+
+    pushed = failed = 0
+    for id, name, address, phone, email, courier_id, status, created_at, synced_id, synced_status in pending:
+        try:
+            if synced_id is None:
+                synced_id = place_order(conn, name, address, phone, email, courier_id, items.get(id, []), created_at=datetime.fromisoformat(created_at.replace("Z", "+00:00")))[0]
+                synced_status = "preparing"
+            while synced_status != status:
+                next_status = "ready" if synced_status == "preparing" else status
+                if not update_orders_status(conn, [synced_id], next_status):
+                    raise ValueError(f"Order {synced_id} cannot be moved from {synced_status} to {next_status}")
+                synced_status = next_status
+        except (ValueError, psycopg.Error):
+            conn.rollback()
+            failed += 1
+        else:
+            pushed += 1
+        with local.lock:
+            local.conn.execute("UPDATE orders SET synced_id = ?, synced_status = ? WHERE id = ?", (synced_id, synced_status, id))
+
+    products = list_products(conn)
+    couriers = list_couriers(conn)
+    conn.commit()
+    with local.lock:
+        local.conn.execute("BEGIN")
+        local.conn.executemany(
+            "INSERT INTO products (id, name, price, stock) VALUES (?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET name = excluded.name, price = excluded.price, stock = excluded.stock",
+            products
+        )
+        local.conn.executemany("INSERT INTO couriers (id, name) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET name = excluded.name", [(id, name.rstrip()) for id, name in couriers])
+        local.conn.execute("COMMIT")
+
+    balancer.invalidate()
+    return pushed, failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sync an offline till with the central database")
+    parser.add_argument("command", choices=("sync",))
+    parser.add_argument("--path", default=SQLITE_PATH, help="the till's SQLite database")
+    args = parser.parse_args()
+
+    local = SQLiteStorage(args.path)
+    conn = connect()
+    try:
+        pushed, failed = sync(local, conn)
+        print(f"Pushed {pushed} order(s), {failed} failed and left for the next sync")
+    finally:
+        conn.close()
+        local.close()
@@ -0,0 +1,111 @@
+import psycopg
+from connection import connect
+from couriers import show_couriers
+from customers import show_customers
+from dispatcher import Menu
+from graphics.ascii import welcome
+from orders import show_orders, choose_new_status, report_status_update
+from paging import browse
+from products import show_products
+from storage import Storage, SQLiteStorage, sync
+
+def view_products(storage: Storage):
+    """Show the products one page at a time, sorted by ID."""
+    browse(storage.list_products, show_products)
+
+def view_couriers(storage: Storage):
+    """Show the couriers one page at a time, sorted by ID."""
+    browse(storage.list_couriers, show_couriers)
+
+def view_customers(storage: Storage):
+    """Show the customers one page at a time, sorted by ID."""
+    browse(storage.list_customers, show_customers)
+
+def view_orders(storage: Storage):
+    """Show the orders one page at a time, sorted by ID."""
+    print("\nExisting orders are:\n")
+    browse(storage.list_orders, show_orders)
+
+def prompt_add_customer(storage: Storage):
+    """Ask for the details of a new customer and add them."""
+    name = input("Customer name: ")
+    email = input("Customer email: ")
+    phone = input("Customer phone: ")
+    if storage.add_customer(name, email, phone) is None:
+        print("\nA customer with this email already exists!\n")
+    else:
+        print("\nCustomer created!\n")
+
+def prompt_take_order(storage: Storage):
+    """
+    Ask for the customer's details and items, then place the order.
+
+    Args:
+        storage (Storage): The till's storage.
+
+    Items are typed by name, as the till may have no connection to search the
+    central catalogue. The storage assigns the least busy courier and places
+    the order in one transaction, so an order with a missing or sold-out item
+    is not placed at all.
+    """
+    name = input("Customer name: ")
+    address = input("Customer address: ")
+    phone = input("Customer phone: ")
+    email = input("Customer email: ")
+
+    items = []
+    while True:
+        items.append(input("Item name: "))
+        if input("Do you want to add another item? (y/n): ").lower() != "y":
+            break
+
+    try:
+        order_id, customer_id, total, courier = storage.place_order(name, address, phone, email, items)
+    except ValueError as e:
+        print(f"\n{e}! Try again!\n")
+        return
+    print(f"\nOrder {order_id} created for £{total}, delivered by {courier}!\n")
+
+def prompt_update_orders_status(storage: Storage):
+    """Ask for one or more order IDs and a new status, then move the orders to it."""
+    ids = input("Order Id(s) to update, separated by commas: ")
+    try:
+        ids = [int(id) for id in ids.split(",") if id.strip()]
+    except ValueError:
+        print("\nOrder Ids must be numbers! Try again!\n")
+        return
+    new_status = choose_new_status()
+    if new_status is None:
+        return
+    report_status_update(ids, storage.update_orders_status(ids, new_status), new_status)
+
+def prompt_sync(storage: Storage):
+    """Push the till's offline orders to the central database and pull the catalogue down, if the network is back."""
+    if not isinstance(storage, SQLiteStorage):
+        print("\nThis till is already working on the central database!\n")
+        return
+    try:
+        conn = connect()
+    except psycopg.OperationalError:
+        print("\nThe central database cannot be reached! Keep taking orders and try again later.\n")
+        return
+    try:
+        pushed, failed = sync(storage, conn)
+    finally:
+        conn.close()
+    print(f"\nPushed {pushed} order(s), {failed} failed and left for the next sync.\n")
+
+TILL_COMMANDS = [
+    ("View products", view_products),
+    ("View couriers", view_couriers),
+    ("View customers", view_customers),
+    ("Add customer", prompt_add_customer),
+    ("View orders", view_orders),
+    ("Create order", prompt_take_order),
+    ("Update order status", prompt_update_orders_status),
+    ("Sync with the central database", prompt_sync),
+]
+
+TILL_MENUS = {
+    "main": Menu("Till", TILL_COMMANDS, art=welcome),
+}
@@ -0,0 +1,59 @@
+import psycopg
+from psycopg import sql
+from queries import registry
+
+def update_query(table: str, id: int, fields: dict, returning: tuple = ("id",)):
+    """
+    Build one UPDATE that changes only the fields that were given.
+
+    Args:
+        table (str): The table to update. Rows are matched on its id column.
+        id (int): The ID of the row to update.
+        fields (dict): New values by column name. Columns whose value is None
+            are left unchanged.
+        returning (tuple of str): The columns to return from the updated row.
+
+    Identifiers are quoted with psycopg.sql and values are passed as
+    parameters. If no field changes, the query only selects the row, so the
+    caller can still tell whether it exists. Returns a (query, params) tuple.
+    """
+    changes = {column: value for column, value in fields.items() if value is not None}
+    columns = sql.SQL(", ").join(map(sql.Identifier, returning))
+
+    if not changes:
+        query = sql.SQL("SELECT {} FROM {} WHERE id = %s").format(columns, sql.Identifier(table))
+        return query, [id]
+
+    assignments = sql.SQL(", ").join(sql.SQL("{} = %s").format(sql.Identifier(column)) for column in changes)
+    query = sql.SQL("UPDATE {} SET {} WHERE id = %s RETURNING {}").format(sql.Identifier(table), assignments, columns)
+    return query, list(changes.values()) + [id]
+
+def update_rows(conn: psycopg.Connection, table: str, edits: list, returning: tuple = ("id",)):
+    """
+    Apply partial updates to several rows of a table in one transaction and one round-trip.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        table (str): The table to update.
+        edits (list): (id, fields) pairs, with fields as taken by update_query.
+        returning (tuple of str): The columns to return from each updated row.
+
+    Every UPDATE is sent in psycopg pipeline mode without waiting for the one
+    before it, then the results are read back together and committed. Whether a
+    row exists is told by whether its UPDATE returned it, so no lookup is needed
+    first. If any statement fails, nothing is changed and the error is raised.
+    Returns a list with the returned row of each edit, or None where the ID was
+    not found.
+    """
+    try:
+        with registry.timed(f"{table}.update_batch"), conn.pipeline():
+            cursors = []
+            for id, fields in edits:
+                query, params = update_query(table, id, fields, returning)
+                cursors.append(conn.execute(query, params))
+            rows = [cursor.fetchone() for cursor in cursors]
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return rows
@@ -0,0 +1,235 @@
+import math
+import random
+import shutil
+import tempfile
+import threading
+import time
+import psycopg
+from balancer import balancer
+from connection import connect
+from couriers import courier_open_orders
+from database import OPEN_STATUSES
+from export import export_tables
+from orders import list_orders, place_order, update_orders_status, STATUS_TRANSITIONS
+from paging import PAGE_SIZE
+
+SEED_BATCH_SIZE = 100_000
+
+# Relative weights of each operation in the default mix, roughly a busy lunch
+# service: mostly new orders and status changes, with the odd lookup and export.
+DEFAULT_MIX = {
+    "create_order": 60,
+    "update_order_status": 25,
+    "view_orders_by_status": 10,
+    "check_courier_orders": 4,
+    "export": 1,
+}
+
+def seed(conn: psycopg.Connection, products: int, customers: int, couriers: int, orders: int, open_ratio: float = 0.05, days: int = 90):
+    """
+    Fill the database with a synthetic cafe for the benchmark suite.
+
+    Args:
+        conn (psycopg.Connection): A connection to the PostgreSQL database.
+        products (int): The number of products to create.
+        customers (int): The number of customers to create.
+        couriers (int): The number of couriers to create.
+        orders (int): The number of historical orders to create.
+        open_ratio (float): The fraction of historical orders left preparing or ready.
+        days (int): Historical orders are spread over this many days.
+
+    Rows are generated server-side with generate_series. Each historical order
+    gets one to three items. Orders are inserted in batches of SEED_BATCH_SIZE,
+    committed as they go, so millions of orders do not build one huge
+    transaction. Returns a (products, courier_ids) tuple, products being a list
+    of the (id, name) of the seeded products.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """INSERT INTO products (name, price, stock)
+               SELECT 'Bench Product ' || n, round((1 + random() * 4)::numeric, 2), 100000000 FROM generate_series(1, %s) n
+               RETURNING id, name""",
+            (products,)
+        )
+        product_rows = cursor.fetchall()
+        cursor.execute(
+            """INSERT INTO customers (customer_name, customer_email, customer_phone)
+               SELECT 'Bench Customer ' || n, 'bench.customer' || n || '@example.com', '0' FROM generate_series(1, %s) n
+               ON CONFLICT ((lower(customer_email))) DO NOTHING""",
+            (customers,)
+        )
+        cursor.execute(
+            "INSERT INTO couriers (name) SELECT 'Bench courier ' || n FROM generate_series(1, %s) n RETURNING id, name",
+            (couriers,)
+        )
+        courier_rows = cursor.fetchall()
+        conn.commit()
+
+        product_ids = [row[0] for row in product_rows]
+        courier_ids = [row[0] for row in courier_rows]
+        courier_names = [row[1] for row in courier_rows]
+        for start in range(0, orders, SEED_BATCH_SIZE):
+            batch = min(SEED_BATCH_SIZE, orders - start)
+            cursor.execute(
+                """WITH new_orders AS (
+                       INSERT INTO orders (customer_name, customer_email, customer_phone, customer_address, items, status, courier, courier_id, created_at)
+                       SELECT 'Bench Customer ' || c, 'bench.customer' || c || '@example.com', '0', '1 bench street', '{}',
+                              CASE WHEN random() < %s THEN (ARRAY['preparing', 'ready'])[1 + floor(random() * 2)::int]
+                                   ELSE (ARRAY['collected', 'collected', 'collected', 'abandoned'])[1 + floor(random() * 4)::int] END,
+                              (%s::text[])[k], (%s::int[])[k], now() - random() * make_interval(days => %s)
+                       FROM (SELECT 1 + floor(random() * %s)::int AS c, 1 + floor(random() * %s)::int AS k FROM generate_series(1, %s)) picked
+                       RETURNING id
+                   )
+                   INSERT INTO order_items (order_id, product_id, qty, unit_price)
+                   SELECT o.id, p.id, 1 + floor(random() * 2)::int, p.price
+                   FROM new_orders o
+                   CROSS JOIN LATERAL (SELECT DISTINCT (%s::int[])[1 + floor(random() * %s)::int] AS product_id
+                                       FROM generate_series(1, 1 + o.id %% 3)) pick
+                   JOIN products p ON p.id = pick.product_id""",
+                (open_ratio, courier_names, courier_ids, days, customers, len(courier_ids), batch, product_ids, len(product_ids))
+            )
+            conn.commit()
+        cursor.execute("ANALYZE")
+        conn.commit()
+
+    balancer.invalidate()
+    return product_rows, courier_ids
+
+class Workload:
+    """
+    A weighted mix of cafe operations run against the database, with their latencies.
+
+    Operations call the same functions as the menus and the service. Open orders
+    are kept in a shared pool, so status updates always have an order to move on,
+    and orders placed by the run join it. Latencies are recorded per operation in
+    seconds. Safe to run from several threads, each with its own connection.
+    """
+
+    def __init__(self, products: list, customers: int, couriers: list, mix: dict = DEFAULT_MIX):
+        self.products = products
+        self.customers = customers
+        self.couriers = couriers
+        self.mix = {name: weight for name, weight in mix.items() if weight > 0}
+        self.open_orders = []
+        self.latencies = {name: [] for name in self.mix}
+        self.errors = {name: 0 for name in self.mix}
+        self.lock = threading.Lock()
+
+    def load_open_orders(self, conn: psycopg.Connection, limit: int = 100_000):
+        """Fill the pool of open orders from the database."""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id, status FROM orders WHERE status = ANY(%s) ORDER BY id DESC LIMIT %s", (list(OPEN_STATUSES), limit))
+            self.open_orders = cursor.fetchall()
+
+    def create_order(self, conn: psycopg.Connection, rng: random.Random):
+        items = [name for id, name in rng.sample(self.products, rng.randint(1, min(3, len(self.products))))]
+        customer = rng.randint(1, self.customers)
+        courier_id, courier = balancer.assign(conn)
+        try:
+            order_id, customer_id, total = place_order(conn, f"Bench Customer {customer}", "1 bench street", "0", f"bench.customer{customer}@example.com", courier_id, items)
+        except Exception:
+            balancer.release(courier_id)
+            raise
+        with self.lock:
+            self.open_orders.append((order_id, "preparing"))
+
+    def update_order_status(self, conn: psycopg.Connection, rng: random.Random):
+        with self.lock:
+            if not self.open_orders:
+                return
+            order_id, status = self.open_orders.pop(rng.randrange(len(self.open_orders)))
+        new_status = rng.choice(STATUS_TRANSITIONS[status])
+        if update_orders_status(conn, [order_id], new_status) and new_status in OPEN_STATUSES:
+            with self.lock:
+                self.open_orders.append((order_id, new_status))
+
+    def view_orders_by_status(self, conn: psycopg.Connection, rng: random.Random):
+        list_orders(conn, rng.choice(OPEN_STATUSES), limit=PAGE_SIZE)
+
+    def check_courier_orders(self, conn: psycopg.Connection, rng: random.Random):
+        courier_open_orders(conn, rng.choice(self.couriers))
+
+    def export(self, conn: psycopg.Connection, rng: random.Random):
+        directory = tempfile.mkdtemp(prefix="cafe_bench_")
+        try:
+            export_tables(directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run(self, conn: psycopg.Connection, operations: int, seed: int):
+        """
+        Run a number of operations drawn from the mix on one connection.
+
+        Args:
+            conn (psycopg.Connection): The connection to run them on.
+            operations (int): The number of operations to run.
+            seed (int): The random seed, so a run can be repeated exactly.
+        """
+        rng = random.Random(seed)
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        for name in rng.choices(names, weights, k=operations):
+            start = time.perf_counter()
+            try:
+                getattr(self, name)(conn, rng)
+                failed = False
+            except (ValueError, psycopg.Error):
+                conn.rollback()
+                failed = True
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.latencies[name].append(elapsed)
+                self.errors[name] += failed
+
+def percentile(values: list, q: float):
+    """Return the q-th percentile (0 to 100) of a list of numbers by the nearest-rank method."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+def run_suite(workers: int, operations: int, seed: int, workload: Workload):
+    """
+    Drive a workload from several threads, each on its own connection.
+
+    Args:
+        workers (int): The number of concurrent tills.
+        operations (int): The number of operations each till runs.
+        seed (int): The base random seed; each till adds its number to it.
+        workload (Workload): The workload to run.
+
+    Returns a dict of results per operation, and for the whole run, with the
+    count, errors, mean, p50, p95 and p99 latency in milliseconds and the
+    throughput in operations per second.
+    """
+    def till(n: int):
+        conn = connect()
+        try:
+            workload.run(conn, operations, seed + n)
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=till, args=(n,)) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    def summarize(latencies: list, errors: int):
+        return {
+            "count": len(latencies),
+            "errors": errors,
+            "mean_ms": sum(latencies) * 1000 / len(latencies) if latencies else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "ops_per_sec": len(latencies) / elapsed,
+        }
+
+    results = {name: summarize(latencies, workload.errors[name]) for name, latencies in workload.latencies.items()}
+    every = [latency for latencies in workload.latencies.values() for latency in latencies]
+    results["total"] = summarize(every, sum(workload.errors.values()))
+    results["total"]["seconds"] = elapsed
+    return results
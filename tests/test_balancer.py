@@ -0,0 +1,38 @@
+import pytest
+from balancer import CourierBalancer
+
+def loaded(rows):
+    balancer = CourierBalancer()
+    balancer.fill(rows)
+    return balancer
+
+def test_assign_picks_least_busy_and_counts_the_order():
+    balancer = loaded([(1, "Amy  ", 2), (2, "Ben", 0), (3, "Cat", 1)])
+    assert balancer.assign_rows() == (2, "Ben")
+    assert balancer.assign_rows() in ((2, "Ben"), (3, "Cat"))
+    assert sorted(balancer.loads.values()) == [1, 2, 2]
+
+def test_release_makes_courier_available_again():
+    balancer = loaded([(1, "Amy", 1), (2, "Ben", 1)])
+    balancer.release(2)
+    assert balancer.assign_rows() == (2, "Ben")
+
+def test_release_ignores_unknown_and_idle_couriers():
+    balancer = loaded([(1, "Amy", 0)])
+    balancer.release(1)
+    balancer.release(99)
+    assert balancer.loads == {1: 0}
+
+def test_names_are_trimmed():
+    assert loaded([(1, "Amy  ", 0)]).assign_rows() == (1, "Amy")
+
+def test_assign_rows_needs_rows_until_loaded():
+    balancer = CourierBalancer()
+    assert balancer.assign_rows() is None
+    assert balancer.assign_rows([(1, "Amy", 0)]) == (1, "Amy")
+    balancer.invalidate()
+    assert balancer.assign_rows() is None
+
+def test_no_couriers():
+    with pytest.raises(ValueError):
+        loaded([]).assign_rows()
@@ -0,0 +1,32 @@
+from decimal import Decimal
+import pytest
+from bulk_import import clean_product, clean_customer, clean_courier
+
+def test_clean_product():
+    assert clean_product({"name": " flat white ", "price": "£3.20", "stock": "4"}) == ("Flat White", Decimal("3.20"), 4)
+    assert clean_product({"name": "tea", "price": 2}) == ("Tea", Decimal("2"), 0)
+
+@pytest.mark.parametrize("record", [
+    {"name": "", "price": "1"},
+    {"name": "tea", "price": "free"},
+    {"name": "tea", "price": "NaN"},
+    {"name": "tea", "price": "-1"},
+    {"name": "tea", "price": "1", "stock": "-2"},
+])
+def test_clean_product_rejects(record):
+    with pytest.raises(ValueError):
+        clean_product(record)
+
+def test_clean_customer_accepts_either_column_names():
+    assert clean_customer({"name": "ann lee", "email": " Ann@Example.com", "phone": 7700}) == ("Ann Lee", "ann@example.com", "7700")
+    assert clean_customer({"customer_name": "bob", "customer_email": "bob@example.com"}) == ("Bob", "bob@example.com", "")
+
+@pytest.mark.parametrize("record", [{"email": "ann@example.com"}, {"name": "ann", "email": "not an email"}])
+def test_clean_customer_rejects(record):
+    with pytest.raises(ValueError):
+        clean_customer(record)
+
+def test_clean_courier():
+    assert clean_courier({"name": " amy "}) == ("Amy",)
+    with pytest.raises(ValueError):
+        clean_courier({"name": " "})
@@ -0,0 +1,32 @@
+from customers import CustomerCache, normalize_email
+
+def test_normalize_email():
+    assert normalize_email("  Ann@Example.COM ") == "ann@example.com"
+
+def test_cache_evicts_least_recently_used():
+    cache = CustomerCache(2)
+    cache.put("a@x.com", 1)
+    cache.put("b@x.com", 2)
+    assert cache.get("a@x.com") == 1
+    cache.put("c@x.com", 3)
+    assert cache.get("b@x.com") is None
+    assert (cache.get("a@x.com"), cache.get("c@x.com")) == (1, 3)
+
+def test_cache_invalidate_by_id():
+    cache = CustomerCache(10)
+    cache.put("a@x.com", 1)
+    cache.invalidate(1)
+    cache.invalidate(2)
+    assert cache.get("a@x.com") is None
+
+def test_cache_disabled():
+    cache = CustomerCache(0)
+    cache.put("a@x.com", 1)
+    assert cache.get("a@x.com") is None
+
+def test_cache_clear():
+    cache = CustomerCache(10)
+    cache.put("a@x.com", 1)
+    cache.clear()
+    assert cache.get("a@x.com") is None
+    assert cache.emails == {}
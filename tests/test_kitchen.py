@@ -0,0 +1,78 @@
+from kitchen import KitchenQueue, AGING_RATE, DEFAULT_PREP_SECONDS, minutes
+
+CREATED = "2025-01-01T12:00:00+00:00"
+
+def created(seq, id):
+    return (seq, None, "order_created", id, {"status": "preparing", "created_at": CREATED})
+
+def items(seq, id, *lines):
+    return (seq, None, "items_added", id, {"items": [{"product_id": product, "qty": qty} for product, qty in lines]})
+
+def moved(seq, id, to):
+    return (seq, None, "status_changed", id, {"to": to})
+
+def queue_with(*events):
+    queue = KitchenQueue()
+    queue.products = {1: ("Latte", 60), 2: ("Sandwich", 300)}
+    for event in events:
+        queue.apply(event)
+    return queue
+
+def test_shortest_prep_goes_first():
+    queue = queue_with(created(1, 10), items(2, 10, (2, 1)), created(3, 11), items(4, 11, (1, 2)))
+    batch = queue.next_batch(2)
+
+    assert [(row[0], row[2], row[3]) for row in batch] == [(11, 120, "2 x Latte"), (10, 300, "1 x Sandwich")]
+    assert queue.next_batch() == []
+
+def test_older_order_overtakes_as_it_ages():
+    queue = KitchenQueue()
+    queue.add(1, 0.0, 300, "slow")
+    queue.add(2, 300 / AGING_RATE, 60, "quick")
+    assert [row[0] for row in queue.next_batch(2)] == [1, 2]
+
+def test_taken_orders_show_as_in_progress_until_ready():
+    queue = queue_with(created(1, 10), items(2, 10, (1, 1)), created(3, 11), items(4, 11, (1, 1)))
+    queue.next_batch(1)
+    waiting, in_progress = queue.snapshot()
+    assert [row[0] for row in waiting] == [11]
+    assert [row[0] for row in in_progress] == [10]
+
+    queue.apply(moved(5, 10, "ready"))
+    waiting, in_progress = queue.snapshot()
+    assert in_progress == []
+    assert 10 not in queue.orders
+
+def test_replayed_events_are_skipped_once():
+    queue = queue_with()
+    queue.replayed = {1}
+    queue.apply(created(1, 10))
+    assert queue.orders == {}
+    queue.apply(created(1, 10))
+    assert 10 in queue.orders
+
+def test_unknown_product_uses_default_prep_time():
+    queue = queue_with(created(1, 10), items(2, 10, (9, 1)))
+    assert queue.orders[10][2:] == (DEFAULT_PREP_SECONDS, "1 x Product 9")
+
+def test_product_changes_apply_to_later_items():
+    queue = queue_with(created(1, 10))
+    queue.product_changed({"op": "INSERT", "id": 3, "name": "Cake", "price": 4, "stock": 1, "prep_seconds": 30})
+    queue.product_changed({"op": "UPDATE", "id": 1, "name": "Latte", "price": 3, "stock": 1, "prep_seconds": 90})
+    queue.product_changed({"op": "DELETE", "id": 2})
+    queue.apply(items(2, 10, (3, 1), (1, 1)))
+
+    assert queue.orders[10][2:] == (120, "1 x Cake, 1 x Latte")
+    assert 2 not in queue.products
+
+def test_changes_bump_the_version():
+    queue = queue_with()
+    version = queue.version
+    queue.apply(created(1, 10))
+    assert queue.wait(version, timeout=0) == version + 1
+    queue.apply(moved(2, 99, "ready"))
+    assert queue.version == version + 1
+
+def test_minutes():
+    assert minutes(0) == "0:00"
+    assert minutes(125.7) == "2:05"
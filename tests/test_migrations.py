@@ -0,0 +1,16 @@
+from migrations import parse_legacy_items
+
+def test_parse_plain_and_quoted_items():
+    assert parse_legacy_items('{Latte,"Flat White",Muffin}') == ["Latte", "Flat White", "Muffin"]
+
+def test_parse_quoted_comma_and_escape():
+    assert parse_legacy_items(r'{"Tea, Green","Say \"Hi\" Cake"}') == ["Tea, Green", 'Say "Hi" Cake']
+
+def test_parse_empty():
+    assert parse_legacy_items(None) == []
+    assert parse_legacy_items("") == []
+    assert parse_legacy_items("{}") == []
+
+def test_parse_truncated_drops_last_item():
+    assert parse_legacy_items("{Latte,Mocha,Flat Wh") == ["Latte", "Mocha"]
+    assert parse_legacy_items('{Latte,"Flat White}') == ["Latte"]
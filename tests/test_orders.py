@@ -0,0 +1,25 @@
+from collections import Counter
+from decimal import Decimal
+import pytest
+from database import OPEN_STATUSES
+from orders import STATUS_TRANSITIONS, check_order_lines
+
+def test_status_transitions_only_move_forward():
+    assert STATUS_TRANSITIONS == {"preparing": ("ready",), "ready": ("collected", "abandoned")}
+    for status, targets in STATUS_TRANSITIONS.items():
+        assert status in OPEN_STATUSES
+        assert "preparing" not in targets
+    assert "collected" not in STATUS_TRANSITIONS
+    assert "abandoned" not in STATUS_TRANSITIONS
+
+def test_check_order_lines_missing_item():
+    rows = [("Latte", Decimal("3.50"), 2, 1)]
+    assert check_order_lines(Counter({"Latte": 2}), rows) == rows
+    with pytest.raises(ValueError, match="Muffin"):
+        check_order_lines(Counter({"Latte": 2, "Muffin": 1}), rows)
+
+def test_check_order_lines_reservation_must_match():
+    rows = [("Latte", Decimal("3.50"), 1, 1), ("Latte", Decimal("3.50"), 1, 1)]
+    assert check_order_lines(Counter({"Latte": 2}), rows, "r1") == rows
+    with pytest.raises(ValueError):
+        check_order_lines(Counter({"Latte": 3}), rows, "r1")
@@ -0,0 +1,25 @@
+from replay import split_events, load_jsonl
+
+def test_split_keeps_each_order_on_one_worker():
+    events = [(0, "a", "create_order", ()), (1, "b", "create_order", ()), (2, "c", "create_order", ()),
+              (3, "a", "update_order_status", ("ready",)), (4, "c", "update_order_status", ("ready",))]
+    shares = split_events(events, 2)
+
+    assert [[event[0] for event in share] for share in shares] == [[0, 2, 3, 4], [1]]
+
+def test_split_more_workers_than_orders():
+    shares = split_events([(0, "a", "create_order", ())], 3)
+    assert [len(share) for share in shares] == [1, 0, 0]
+
+def test_load_jsonl_orders_events_by_offset(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    path.write_text(
+        '{"at": 10, "op": "update_order_status", "order": 1, "status": "ready"}\n'
+        '\n'
+        '{"at": 4, "op": "create_order", "order": 1, "customer_name": "Ann", "customer_address": "1 High St",'
+        ' "customer_phone": "0700", "customer_email": "ann@example.com", "items": ["Latte"]}\n'
+    )
+    events = load_jsonl(str(path))
+
+    assert [(event[0], event[2]) for event in events] == [(0, "create_order"), (6, "update_order_status")]
+    assert events[0][3][-1] == ["Latte"]
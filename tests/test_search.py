@@ -0,0 +1,6 @@
+from search import escape_like
+
+def test_escape_like_wildcards():
+    assert escape_like("50%_off") == "50\\%\\_off"
+    assert escape_like("a\\b") == "a\\\\b"
+    assert escape_like("latte") == "latte"
@@ -0,0 +1,85 @@
+from decimal import Decimal
+import pytest
+from storage import SQLiteStorage
+
+@pytest.fixture
+def storage():
+    storage = SQLiteStorage(":memory:")
+    storage.add_product("latte", Decimal("3.50"), 5)
+    storage.add_product("muffin", Decimal("2.25"), 1)
+    storage.add_courier("amy")
+    storage.add_courier("ben")
+    yield storage
+    storage.close()
+
+def test_list_products_pages_by_id(storage):
+    for n in range(3):
+        storage.add_product(f"tea {n}", Decimal("1.00"), 10)
+
+    first = storage.list_products(limit=2)
+    assert [row[1] for row in first] == ["Latte", "Muffin"]
+    second = storage.list_products(after=first[-1][0], limit=2)
+    assert [row[1] for row in second] == ["Tea 0", "Tea 1"]
+    assert storage.list_products(before=second[0][0], limit=2) == first
+
+def test_add_customer_with_taken_email_returns_none(storage):
+    assert storage.add_customer("ann", "Ann@Example.com ", "0700") is not None
+    assert storage.add_customer("other ann", "ann@example.com", "0800") is None
+    assert [row[2] for row in storage.list_customers()] == ["ann@example.com"]
+
+def test_place_order_deducts_stock_and_adds_spend(storage):
+    order_id, customer_id, total, courier = storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["latte", "Latte", "muffin"])
+
+    assert total == Decimal("9.25")
+    assert courier == "Amy"
+    assert [row[3] for row in storage.list_products()] == [3, 0]
+    assert storage.list_customers() == [(customer_id, "ann", "ann@example.com", "0700", Decimal("9.25"))]
+    order = storage.list_orders()[0]
+    assert order[0] == order_id
+    assert order[5] == "Latte x2, Muffin"
+    assert order[6:] == ("preparing", "Amy")
+
+def test_place_order_assigns_least_busy_courier(storage):
+    first = storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["latte"])
+    second = storage.place_order("bob", "2 High St", "0701", "bob@example.com", ["latte"])
+    assert (first[3], second[3]) == ("Amy", "Ben")
+
+    storage.update_orders_status([first[0]], "collected")
+    assert storage.place_order("cat", "3 High St", "0702", "cat@example.com", ["latte"])[3] == "Amy"
+
+def test_place_order_short_of_stock_writes_nothing(storage):
+    with pytest.raises(ValueError):
+        storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["latte", "muffin", "muffin"])
+
+    assert [row[3] for row in storage.list_products()] == [5, 1]
+    assert storage.list_orders() == []
+    assert storage.list_customers() == []
+
+def test_place_order_unknown_item(storage):
+    with pytest.raises(ValueError):
+        storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["espresso"])
+
+def test_place_order_without_couriers():
+    storage = SQLiteStorage(":memory:")
+    storage.add_product("latte", Decimal("3.50"), 5)
+    with pytest.raises(ValueError):
+        storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["latte"])
+    assert [row[3] for row in storage.list_products()] == [5]
+
+def test_update_orders_status_follows_transitions(storage):
+    id = storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["latte"])[0]
+
+    assert storage.update_orders_status([id], "ready") == [(id, 1)]
+    assert storage.update_orders_status([id], "ready") == []
+    assert storage.update_orders_status([id, 999], "collected") == [(id, 1)]
+    assert storage.update_orders_status([id], "abandoned") == []
+    with pytest.raises(ValueError):
+        storage.update_orders_status([id], "preparing")
+
+def test_list_orders_by_status(storage):
+    first = storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["latte"])[0]
+    second = storage.place_order("bob", "2 High St", "0701", "bob@example.com", ["latte"])[0]
+    storage.update_orders_status([second], "ready")
+
+    assert [row[0] for row in storage.list_orders("preparing")] == [first]
+    assert [row[0] for row in storage.list_orders("ready")] == [second]
@@ -0,0 +1,46 @@
+from decimal import Decimal
+import pytest
+from storage import SQLiteStorage
+import till
+
+@pytest.fixture
+def storage():
+    storage = SQLiteStorage(":memory:")
+    storage.add_product("latte", Decimal("3.50"), 2)
+    storage.add_courier("amy")
+    yield storage
+    storage.close()
+
+def answer(monkeypatch, *answers):
+    """Feed the answers to input() in order."""
+    answers = iter(answers)
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+
+def test_take_order(storage, monkeypatch, capsys):
+    answer(monkeypatch, "ann", "1 High St", "0700", "ann@example.com", "latte", "y", "latte", "n")
+    till.prompt_take_order(storage)
+
+    assert "created for £7.00, delivered by Amy" in capsys.readouterr().out
+    assert storage.list_products()[0][3] == 0
+
+def test_take_order_short_of_stock(storage, monkeypatch, capsys):
+    answer(monkeypatch, "ann", "1 High St", "0700", "ann@example.com", "latte", "y", "latte", "y", "latte", "n")
+    till.prompt_take_order(storage)
+
+    assert "Not enough stock for Latte" in capsys.readouterr().out
+    assert storage.list_orders() == []
+
+def test_update_orders_status_reports_skipped(storage, monkeypatch, capsys):
+    id = storage.place_order("ann", "1 High St", "0700", "ann@example.com", ["latte"])[0]
+    answer(monkeypatch, f"{id}, 99", "2")
+    till.prompt_update_orders_status(storage)
+
+    out = capsys.readouterr().out
+    assert "0 order(s) moved to collected" in out
+    assert f"{id}, 99" in out
+
+def test_sync_needs_sqlite_storage(capsys):
+    class Central:
+        pass
+    till.prompt_sync(Central())
+    assert "already working on the central database" in capsys.readouterr().out
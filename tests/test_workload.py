@@ -0,0 +1,14 @@
+from workload import percentile
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+
+def test_percentile_small_and_unsorted():
+    assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert percentile([3.0, 1.0, 2.0], 0) == 1.0
+    assert percentile([5.0], 99) == 5.0
+    assert percentile([], 95) == 0.0